@@ -1,7 +1,7 @@
 import asyncio
 from bleak import BleakClient, BleakScanner
-import struct
 from global_var import TAG_MAC
+from location import decode_proxy_positions
 # Địa chỉ MAC của module DWM1001 (thay bằng địa chỉ thực tế của bạn)
 DEVICE_ADDRESS =  "D7:7A:01:92:9B:DB" # Ví dụ: "00:11:22:33:44:55"
 
@@ -12,32 +12,13 @@ PROXY_POSITIONS_UUID = "f4a67d7d-379d-4183-9c03-4b6ea5103291"
 async def notification_handler(sender, data):
     """Xử lý thông báo từ Proxy Positions Characteristic"""
     try:
-        # Đọc số lượng phần tử (1 byte đầu tiên)
-        num_elements = data[0]
-        print(f"Received notification with {num_elements} tag positions")
+        positions = decode_proxy_positions(data)
+        print(f"Received notification with {data[0]} tag positions")
 
-        # Mỗi tag position gồm: 2 bytes node ID + 13 bytes position data
-        offset = 1
-        for i in range(num_elements):
-            if offset + 15 <= len(data):  # Kiểm tra đủ dữ liệu cho 1 tag position
-                # Đọc node ID (2 bytes)
-                node_id = struct.unpack("<H", data[offset:offset+2])[0]
-                offset += 2
-
-                # Đọc vị trí X, Y, Z (mỗi tọa độ 4 bytes, little-endian) và quality factor (1 byte)
-                x = struct.unpack("<i", data[offset:offset+4])[0] / 1000.0  # mm -> m
-                offset += 4
-                y = struct.unpack("<i", data[offset:offset+4])[0] / 1000.0  # mm -> m
-                offset += 4
-                z = struct.unpack("<i", data[offset:offset+4])[0] / 1000.0  # mm -> m
-                offset += 4
-                quality = data[offset]
-                offset += 1
-
-                print(f"Tag {i+1}: Node ID = {node_id:04x}, Position = ({x:.3f}m, {y:.3f}m, {z:.3f}m), Quality = {quality}")
-            else:
-                print("Error: Incomplete data for a tag position")
-                break
+        for i, tag in enumerate(positions):
+            position = tag["Position"]
+            print(f"Tag {i+1}: Node ID = {tag['Node ID']:04x}, Position = ({position['X']:.3f}m, {position['Y']:.3f}m, "
+                  f"{position['Z']:.3f}m), Quality = {position['Quality Factor']}")
     except Exception as e:
         print(f"Error parsing notification data: {e}")
 
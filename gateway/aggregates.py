@@ -0,0 +1,204 @@
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import REGISTRY
+from module_state import MOTION_SPEED_THRESHOLD
+
+# Cấu hình qua biến môi trường
+AGGREGATES = os.getenv("AGGREGATES", "0") == "1"
+AGGREGATE_INTERVAL = float(os.getenv("AGGREGATE_INTERVAL", "60"))  # giây giữa hai lần gửi số liệu tổng hợp
+AGGREGATE_MIN_STEP = float(os.getenv("AGGREGATE_MIN_STEP", "0.1"))  # m, dịch chuyển nhỏ hơn coi là nhiễu
+AGGREGATE_MAX_GAP = float(os.getenv("AGGREGATE_MAX_GAP", "5"))  # giây; khoảng mất mẫu dài hơn không được tính giờ
+AGGREGATE_STALE = float(os.getenv("AGGREGATE_STALE", "30"))  # giây không thấy tag thì không tính vào số người trong zone
+# Gửi vị trí thô từng mẫu; đặt 0 để chỉ gửi số liệu tổng hợp (và sự kiện)
+RAW_STREAM = os.getenv("RAW_STREAM", "1") == "1"
+
+AGGREGATE_PAYLOADS = REGISTRY.counter("gateway_aggregate_payloads_total", "Số payload tổng hợp đã tạo", ["kind"])
+
+Point = Tuple[float, float, float]
+
+
+# Số liệu cộng dồn của một tag trong kỳ hiện tại, cùng trạng thái cần để cộng tiếp ở mẫu sau
+class _TagTotals:
+    __slots__ = ("last_ts", "anchor", "anchor_ts", "moving", "distance", "moving_s", "stationary_s", "zone_s",
+                 "zones", "location")
+
+    def __init__(self, ts: float, point: Point):
+        self.last_ts = ts
+        self.anchor = point  # điểm cuối cùng đã tính quãng đường (dead-band)
+        self.anchor_ts = ts
+        self.moving = False
+        self.distance = 0.0
+        self.moving_s = 0.0
+        self.stationary_s = 0.0
+        self.zone_s: Dict[str, float] = {}  # zone -> số giây ở trong zone trong kỳ
+        self.zones: Dict[str, float] = {}  # zone đang ở -> thời điểm vào
+        self.location = None
+
+
+# Tổng hợp tại gateway, cập nhật tăng dần theo từng vị trí (O(số zone của tag) mỗi mẫu): quãng đường đi
+# (bỏ dao động nhỏ hơn min_step), thời gian di chuyển / đứng yên, thời gian trong từng zone theo tag,
+# số tag trong từng zone (hiện tại và cao nhất trong kỳ). report() trả về số liệu của kỳ và bắt đầu kỳ mới
+class EdgeAggregator:
+    def __init__(self, min_step: float = AGGREGATE_MIN_STEP, max_gap: float = AGGREGATE_MAX_GAP,
+                 stale: float = AGGREGATE_STALE, speed_threshold: float = MOTION_SPEED_THRESHOLD):
+        self.min_step = min_step
+        self.max_gap = max_gap
+        self.stale = stale
+        self.speed_threshold = speed_threshold
+        self.tags: Dict[str, _TagTotals] = {}
+        self.occupancy: Dict[str, int] = {}  # zone -> số tag đang ở trong
+        self.peak: Dict[str, int] = {}
+        self.zone_seconds: Dict[str, float] = {}  # zone -> tổng số giây của mọi tag trong kỳ
+        self.zone_names: Set[str] = set()
+        self.period_start: Optional[float] = None
+
+    # Khai báo trước các zone để zone trống vẫn có trong báo cáo (occupancy 0)
+    def set_zones(self, names: Iterable[str]):
+        for name in names:
+            self.zone_names.add(name)
+            self.occupancy.setdefault(name, 0)
+            self.peak.setdefault(name, 0)
+
+    def _enter(self, zone: str):
+        count = self.occupancy.get(zone, 0) + 1
+        self.occupancy[zone] = count
+        if count > self.peak.get(zone, 0):
+            self.peak[zone] = count
+        self.zone_names.add(zone)
+
+    def _leave(self, zone: str):
+        self.occupancy[zone] = max(0, self.occupancy.get(zone, 0) - 1)
+
+    # Một vị trí mới của tag; zones là các zone tag đang ở (ZoneEngine.zones_of), location để gửi kèm báo cáo
+    def update(self, mac: str, ts: float, x: float, y: float, z: float, zones: Iterable[str] = (), location=None):
+        if self.period_start is None:
+            self.period_start = ts
+        point = (x, y, z)
+        state = self.tags.get(mac)
+        if state is None:
+            state = self.tags[mac] = _TagTotals(ts, point)
+        elif ts > state.last_ts:
+            dt = ts - state.last_ts
+            step = math.dist(state.anchor, point)
+            if step >= self.min_step:
+                state.distance += step
+                state.moving = step / (ts - state.anchor_ts) > self.speed_threshold
+                state.anchor = point
+                state.anchor_ts = ts
+            elif state.moving and (ts - state.anchor_ts) * self.speed_threshold >= self.min_step:
+                # Đủ lâu mà chưa đi được min_step: tốc độ đã dưới ngưỡng
+                state.moving = False
+            if dt <= self.max_gap:
+                if state.moving:
+                    state.moving_s += dt
+                else:
+                    state.stationary_s += dt
+                for zone in state.zones:
+                    state.zone_s[zone] = state.zone_s.get(zone, 0.0) + dt
+                    self.zone_seconds[zone] = self.zone_seconds.get(zone, 0.0) + dt
+            state.last_ts = ts
+        state.location = location
+
+        current = state.zones
+        if len(current) != len(zones) or any(zone not in current for zone in zones):
+            zones = set(zones)
+            for zone in [zone for zone in current if zone not in zones]:
+                del current[zone]
+                self._leave(zone)
+            for zone in zones:
+                if zone not in current:
+                    current[zone] = ts
+                    self._enter(zone)
+
+    # Bỏ khỏi số người trong zone các tag lâu không thấy (mất kết nối, hết pin...)
+    def _expire(self, now: float):
+        for state in self.tags.values():
+            if state.zones and now - state.last_ts > self.stale:
+                for zone in state.zones:
+                    self._leave(zone)
+                state.zones = {}
+
+    # Số liệu của kỳ [period_start, now): theo tag (chỉ các tag thấy trong kỳ) và theo zone.
+    # reset=True bắt đầu kỳ mới (giữ trạng thái hiện tại: zone đang ở, điểm dead-band, số người trong zone)
+    def report(self, now: float, reset: bool = True) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        self._expire(now)
+        start = self.period_start if self.period_start is not None else now
+        tags: Dict[str, Dict] = {}
+        for mac, state in self.tags.items():
+            if state.last_ts < start:
+                continue
+            tags[mac] = {
+                "interval": round(now - start, 3),
+                "distance": round(state.distance, 3),
+                "moving": round(state.moving_s, 3),
+                "stationary": round(state.stationary_s, 3),
+                "zones": {zone: round(seconds, 3) for zone, seconds in state.zone_s.items()},
+                # Thời gian ở liên tục trong zone hiện tại tính tới mẫu cuối cùng
+                "dwell": {zone: round(state.last_ts - entered, 3) for zone, entered in state.zones.items()},
+                "location": state.location,
+            }
+        zones: Dict[str, Dict] = {}
+        for zone in sorted(self.zone_names):
+            members: List[str] = [mac for mac, state in self.tags.items() if zone in state.zones]
+            zones[zone] = {
+                "interval": round(now - start, 3),
+                "occupancy": self.occupancy.get(zone, 0),
+                "peak": self.peak.get(zone, 0),
+                "tag_seconds": round(self.zone_seconds.get(zone, 0.0), 3),
+                "tags": members,
+            }
+        if reset:
+            self.period_start = now
+            for mac in [mac for mac, state in self.tags.items() if now - state.last_ts > self.stale]:
+                del self.tags[mac]
+            for state in self.tags.values():
+                state.distance = state.moving_s = state.stationary_s = 0.0
+                state.zone_s = {}
+            self.zone_seconds = {}
+            self.peak = dict(self.occupancy)
+            AGGREGATE_PAYLOADS.inc(len(tags), kind="tag")
+            AGGREGATE_PAYLOADS.inc(len(zones), kind="zone")
+        return tags, zones
+
+
+# Tạo bộ tổng hợp theo cấu hình (None nếu tắt)
+def open_aggregator(zone_names: Iterable[str] = ()) -> Optional[EdgeAggregator]:
+    if not AGGREGATES:
+        return None
+    aggregator = EdgeAggregator()
+    aggregator.set_zones(zone_names)
+    return aggregator
+
+
+if __name__ == "__main__":
+    # Mô phỏng: 200 tag trong 10 phút ở 1 Hz, nửa đi lại giữa hai zone, nửa đứng yên có nhiễu;
+    # so sánh số payload gửi lên khi gửi thô và khi chỉ gửi tổng hợp mỗi phút
+    import random
+    import time
+
+    random.seed(4)
+    aggregator = EdgeAggregator()
+    aggregator.set_zones(["left", "right"])
+    tags = [f"EB:52:53:F5:{i // 256:02X}:{i % 256:02X}" for i in range(200)]
+    raw = aggregated = 0
+    started = time.perf_counter()
+    for second in range(600):
+        for i, mac in enumerate(tags):
+            if i % 2 == 0:
+                x = abs((second * 0.8 + i) % 40 - 20)  # đi lại 0..20 m với 0.8 m/s
+            else:
+                x = 5.0 + random.gauss(0, 0.02)
+            zones = ["left"] if x < 10 else ["right"]
+            aggregator.update(mac, float(second), x, float(i % 10), 1.0, zones)
+            raw += 1
+        if second % 60 == 59:
+            tag_report, zone_report = aggregator.report(second + 1.0)
+            aggregated += len(tag_report) + len(zone_report)
+    elapsed = time.perf_counter() - started
+    print(f"update: {elapsed / raw * 1e6:.2f} us/mẫu")
+    print(f"payload thô {raw}, tổng hợp {aggregated} (giảm {raw / aggregated:.0f} lần)")
+    print(f"tag đi lại: {tag_report[tags[0]]}")
+    print(f"tag đứng yên: {tag_report[tags[1]]}")
+    print(f"zone: { {zone: {k: v for k, v in data.items() if k != 'tags'} for zone, data in zone_report.items()} }")
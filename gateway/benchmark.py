@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+# Benchmark chạy độc lập, không cần server thật: trỏ uploader tới server giả cục bộ
+os.environ.setdefault("SV_URL", "http://127.0.0.1")
+os.environ.setdefault("PORT", "0")
+os.environ.setdefault("TOPIC", "bench")
+os.environ.setdefault("LOCAL_API_PORT", "0")
+
+from location import decode_location_mode_0, decode_location_mode_1, decode_location_mode_2, decode_proxy_positions
+from opmode import decode_operation_mode
+from payload import build_payload
+from serializer import SERIALIZERS, gzip_compress, make_mode_2_frame, sample_payloads
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-results")
+# Chậm hơn ngưỡng này so với lần chạy trước thì coi là regression
+REGRESSION_THRESHOLD = 0.10
+
+ANCHOR_IDS = [0xC60E, 0xC511, 0xD29A, 0xD40F]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Đo một hàm: chạy `rounds` vòng, mỗi vòng `inner` lần; p50/p99 tính trên thời gian/lần của từng vòng
+def measure(fn: Callable[[], object], rounds: int = 200, inner: int = 50, warmup: int = 20) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    per_op = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        t0 = time.perf_counter_ns()
+        for _ in range(inner):
+            fn()
+        per_op.append((time.perf_counter_ns() - t0) / inner)
+    elapsed = time.perf_counter() - started
+    per_op.sort()
+    return {
+        "ops_per_s": rounds * inner / elapsed,
+        "p50_us": _percentile(per_op, 0.50) / 1000,
+        "p99_us": _percentile(per_op, 0.99) / 1000,
+    }
+
+
+# Dữ liệu mẫu cho từng bước của pipeline
+def sample_frames() -> Dict[str, bytes]:
+    mode_0 = struct.pack("<B i i i B", 0, 1234, 3456, 1100, 87)
+    distances = [(node_id, 2500 + 101 * k, 100) for k, node_id in enumerate(ANCHOR_IDS)]
+    mode_1 = struct.pack("<B", len(distances)) + b"".join(struct.pack("<H i B", *d) for d in distances)
+    mode_2 = make_mode_2_frame(1234, 3456, 1100, 87, distances)
+    proxy = struct.pack("<B", 5) + b"".join(
+        struct.pack("<H i i i B", 0xCE07 + i, 1000 * i, 2000 + i, 1100, 90) for i in range(5))
+    return {"mode_0": mode_0, "mode_1": mode_1, "mode_2": mode_2, "proxy": proxy}
+
+
+# Các benchmark micro: giải mã, payload, serialize
+def micro_benchmarks(rounds: int) -> Dict[str, Dict[str, float]]:
+    frames = sample_frames()
+    decoded = decode_location_mode_2(frames["mode_2"])
+    payloads = sample_payloads(50)
+
+    cases = {
+        "decode_location_mode_0": lambda: decode_location_mode_0(frames["mode_0"]),
+        "decode_location_mode_1": lambda: decode_location_mode_1(frames["mode_1"]),
+        "decode_location_mode_2": lambda: decode_location_mode_2(frames["mode_2"]),
+        "decode_proxy_positions_x5": lambda: decode_proxy_positions(frames["proxy"]),
+        "decode_operation_mode": lambda: decode_operation_mode(b"\x5c\x20"),
+        "build_payload": lambda: build_payload("DWCE07", "EB:52:53:F5:D5:90", "tag", "5c20", decoded,
+                                               "active", "2025-03-01 08:00:00"),
+    }
+    for name, serializer in SERIALIZERS.items():
+        cases[f"serialize_{name}"] = lambda s=serializer: s.dumps(payloads[0])
+        cases[f"serialize_{name}_batch50"] = lambda s=serializer: s.dumps(payloads)
+    batch_body = SERIALIZERS["json"].dumps(payloads)
+    cases["gzip_batch50"] = lambda: gzip_compress(batch_body)
+
+    results = {}
+    for name, fn in cases.items():
+        inner = 5 if "batch" in name else 50
+        results[name] = measure(fn, rounds=rounds, inner=inner)
+    return results
+
+
+# Benchmark đầu-cuối: notify_callback -> payload -> send_to_api tới server HTTP giả cục bộ
+async def pipeline_benchmark(tags: int = 20, samples_per_tag: int = 50) -> Dict[str, float]:
+    from aiohttp import web
+    import main
+    import uploader
+
+    received = 0
+
+    async def ingest(request: web.Request) -> web.Response:
+        nonlocal received
+        await request.read()
+        received += 1
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post("/{topic}", ingest)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    uploader.API_URL = f"http://127.0.0.1:{port}/bench"
+
+    frame = sample_frames()["mode_2"]
+    macs = [f"EB:52:53:F5:{i // 256:02X}:{i % 256:02X}" for i in range(tags)]
+    for i, mac in enumerate(macs):
+        main.module_info[mac] = {"name": f"DW{i:04X}", "type": "tag", "operation_hex": "5c20"}
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(samples_per_tag):
+        for mac in macs:
+            main.notify_callback(0, bytearray(frame), mac)
+
+        async def upload(mac: str, data: Dict):
+            info = main.module_info[mac]
+            payload = build_payload(info["name"], mac, info["type"], info["operation_hex"],
+                                    data["location"], "active", data["time"])
+            await uploader.send_to_api(payload)
+            latencies.append(time.perf_counter() - data["received"])
+
+        await asyncio.gather(*(upload(mac, data) for mac, data in main.sample_queue.drain()))
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+
+    latencies.sort()
+    return {
+        "ops_per_s": len(latencies) / elapsed,
+        "p50_us": _percentile(latencies, 0.50) * 1e6,
+        "p99_us": _percentile(latencies, 0.99) * 1e6,
+        "received": received,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Lưu kết quả theo commit để so sánh giữa các lần chạy
+def save_results(results: Dict[str, Dict[str, float]]) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = _git_commit()
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "python": sys.version.split()[0], "machine": platform.machine(),
+                   "time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, f, indent=2)
+    return path
+
+
+def load_results(path: str) -> Dict[str, Dict[str, float]]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+# File kết quả gần nhất trước file hiện tại (hoặc file khớp commit/tên được chỉ định)
+def find_baseline(reference: Optional[str], exclude: str) -> Optional[str]:
+    if reference and os.path.isfile(reference):
+        return reference
+    candidates = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if p != exclude)
+    if reference:
+        candidates = [p for p in candidates if reference in os.path.basename(p)]
+    return candidates[-1] if candidates else None
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None) -> int:
+    regressions = 0
+    print(f"{'benchmark':<32} {'ops/s':>12} {'p50 µs':>10} {'p99 µs':>10} {'so với trước':>14}")
+    for name, r in results.items():
+        delta = ""
+        if baseline and name in baseline and baseline[name]["ops_per_s"]:
+            change = r["ops_per_s"] / baseline[name]["ops_per_s"] - 1
+            delta = f"{change:+.1%}"
+            if change < -REGRESSION_THRESHOLD:
+                delta += " !"
+                regressions += 1
+        print(f"{name:<32} {r['ops_per_s']:>12,.0f} {r['p50_us']:>10.2f} {r['p99_us']:>10.2f} {delta:>14}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark các bước giải mã, payload và upload của gateway")
+    parser.add_argument("--rounds", type=int, default=200, help="Số vòng đo cho mỗi benchmark micro")
+    parser.add_argument("--tags", type=int, default=20, help="Số tag giả lập cho benchmark pipeline")
+    parser.add_argument("--samples", type=int, default=50, help="Số mẫu mỗi tag cho benchmark pipeline")
+    parser.add_argument("--skip-pipeline", action="store_true", help="Bỏ qua benchmark đầu-cuối")
+    parser.add_argument("--compare", help="File kết quả hoặc commit để so sánh (mặc định: lần chạy trước)")
+    parser.add_argument("--no-save", action="store_true", help="Không lưu kết quả vào bench-results/")
+    args = parser.parse_args()
+
+    results = micro_benchmarks(args.rounds)
+    if not args.skip_pipeline:
+        results["pipeline_notify_to_upload"] = asyncio.run(pipeline_benchmark(args.tags, args.samples))
+
+    saved = "" if args.no_save else save_results(results)
+    baseline_path = find_baseline(args.compare, saved)
+    regressions = print_results(results, load_results(baseline_path) if baseline_path else None)
+    if baseline_path:
+        print(f"So sánh với: {os.path.basename(baseline_path)}")
+    if saved:
+        print(f"Đã lưu: {saved}")
+    sys.exit(1 if regressions else 0)
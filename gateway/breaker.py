@@ -0,0 +1,147 @@
+import os
+import random
+import time
+from typing import Callable, Optional
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # số lỗi liên tiếp để mở mạch
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "2"))  # thời gian mở ban đầu
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "120"))  # thời gian mở tối đa
+# Lỗi cấu hình endpoint (404, 401, ...) : thử lại ít hơn nhiều
+BREAKER_ENDPOINT_OPEN_SECONDS = float(os.getenv("BREAKER_ENDPOINT_OPEN_SECONDS", "300"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = REGISTRY.gauge("gateway_breaker_state", "Trạng thái circuit breaker (0 closed, 1 half-open, 2 open)",
+                               ["name"])
+BREAKER_TRANSITIONS = REGISTRY.counter("gateway_breaker_transitions_total", "Số lần circuit breaker đổi trạng thái",
+                                       ["name", "state"])
+
+log = get_logger("gateway.breaker")
+
+
+# Circuit breaker closed -> open -> half-open: mở sau N lỗi liên tiếp, thời gian mở tăng theo cấp số nhân
+# (có jitter) mỗi lần probe thất bại; ở half-open chỉ cho một request probe đi qua.
+# Mỗi request được cho qua nhận một ticket (acquire); kết quả báo kèm ticket để lỗi trả về muộn của request cũ
+# không bị tính là probe thất bại, và release(ticket) trong finally để probe bị hủy không giữ half-open mãi
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, base_delay: float = BREAKER_OPEN_SECONDS,
+                 max_delay: float = BREAKER_MAX_OPEN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.consecutive_opens = 0
+        self.open_until = 0.0
+        self.tickets = 0  # số ticket đã cấp
+        self.closed_since = 1  # ticket đầu tiên của lần closed hiện tại
+        self.probe: Optional[int] = None  # ticket của probe đang chờ kết quả ở half-open
+        BREAKER_STATE.set(0, name=name)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUE[state], name=self.name)
+        BREAKER_TRANSITIONS.inc(name=self.name, state=state)
+        log.info(f"Circuit breaker {self.name}: {state}", extra=fields(stage="upload", breaker=state))
+
+    # Thời gian mở: backoff cấp số nhân, jitter trong nửa trên để các gateway không probe cùng lúc
+    def _backoff(self) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** self.consecutive_opens))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _open(self, delay: float):
+        self.open_until = self.clock() + delay
+        self.consecutive_opens += 1
+        self.probe = None
+        self._transition(OPEN)
+
+    # Xin gửi một request: trả về ticket, hoặc None nếu mạch đang mở.
+    # Hết thời gian mở thì cho đúng một request probe đi qua
+    def acquire(self) -> Optional[int]:
+        if self.state == OPEN and self.clock() >= self.open_until:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED or (self.state == HALF_OPEN and self.probe is None):
+            self.tickets += 1
+            if self.state == HALF_OPEN:
+                self.probe = self.tickets
+            return self.tickets
+        return None
+
+    # Có được gửi request không (không theo dõi kết quả theo ticket)
+    def allow(self) -> bool:
+        return self.acquire() is not None
+
+    def success(self, ticket: Optional[int] = None):
+        self.failures = 0
+        self.consecutive_opens = 0
+        self.probe = None
+        if self.state != CLOSED:
+            self.closed_since = self.tickets + 1
+        self._transition(CLOSED)
+
+    # Request kết thúc (gọi trong finally): nếu là probe chưa có kết quả (bị hủy, lỗi không phân loại được)
+    # thì bỏ probe để lần acquire sau cho probe mới
+    def release(self, ticket: Optional[int]):
+        if ticket is not None and ticket == self.probe:
+            self.probe = None
+
+    # Ghi nhận lỗi; endpoint=True là lỗi cấu hình phía server (404...) nên mở ngay với thời gian dài.
+    # Chỉ mở mạch (và tăng backoff) khi closed -> open hoặc khi chính probe ở half-open thất bại; lỗi trả về muộn
+    # của request gửi trước đó (mạch đang open, ticket không phải probe, ticket từ trước lần closed hiện tại)
+    # không kéo dài thời gian mở. ticket=None: không rõ request nào, ở half-open coi là probe
+    def failure(self, ticket: Optional[int] = None, endpoint: bool = False):
+        if self.state == OPEN:
+            return
+        if self.state == HALF_OPEN:
+            if self.probe is None or (ticket is not None and ticket != self.probe):
+                return
+        elif ticket is not None and ticket < self.closed_since:
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or endpoint or self.failures >= self.failure_threshold:
+            delay = self._backoff()
+            self._open(max(BREAKER_ENDPOINT_OPEN_SECONDS, delay) if endpoint else delay)
+
+
+if __name__ == "__main__":
+    # Kiểm tra: lỗi trả về muộn của các request đang bay khi mạch đã mở không kéo dài thời gian mở
+    # hoặc bị tính là probe thất bại; probe bị hủy không giữ half-open mãi
+    now = [0.0]
+    breaker = CircuitBreaker("check", failure_threshold=3, base_delay=2, max_delay=120, clock=lambda: now[0])
+    inflight = [breaker.acquire() for _ in range(32)]  # 32 request đồng thời
+    for ticket in inflight[:16]:
+        breaker.failure(ticket)
+    assert breaker.state == OPEN and breaker.consecutive_opens == 1 and breaker.open_until <= 2
+    breaker.failure(inflight[16], endpoint=True)
+    assert breaker.consecutive_opens == 1 and breaker.open_until <= 2
+    now[0] = 2.0
+    probe = breaker.acquire()
+    assert probe is not None and breaker.acquire() is None  # đúng một probe
+    for ticket in inflight[17:]:  # lỗi muộn của request cũ trong lúc probe đang chờ
+        breaker.failure(ticket)
+    assert breaker.state == HALF_OPEN and breaker.consecutive_opens == 1
+    breaker.release(probe)  # probe bị hủy: cho probe mới
+    probe = breaker.acquire()
+    assert probe is not None
+    breaker.failure(probe)
+    breaker.release(probe)
+    assert breaker.state == OPEN and breaker.consecutive_opens == 2 and breaker.open_until <= 6
+    now[0] = 6.0
+    probe = breaker.acquire()
+    breaker.success(probe)
+    assert breaker.state == CLOSED and breaker.consecutive_opens == 0
+    for ticket in inflight:  # ticket từ trước lần closed hiện tại không được tính
+        breaker.failure(ticket)
+    assert breaker.state == CLOSED and breaker.failures == 0
+    breaker.failure(breaker.acquire(), endpoint=True)
+    assert breaker.state == OPEN and breaker.open_until >= BREAKER_ENDPOINT_OPEN_SECONDS
+    print("breaker OK")
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bleak import BleakClient
+from bleak.exc import BleakError
+
+from global_var import LOCATION_DATA_CHAR_UUID, LOCATION_DATA_MODE_UUID
+from location import decode_location_data
+from logger import fields, get_logger, setup_logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Cấu hình qua biến môi trường
+ANCHORS_FILE = os.getenv("ANCHORS_FILE", "anchors.json")  # kết quả hiệu chuẩn (vị trí anchor + sai số)
+CALIBRATION_ROUNDS = int(os.getenv("CALIBRATION_ROUNDS", "20"))  # số lần đọc location data mỗi anchor
+CALIBRATION_INTERVAL = float(os.getenv("CALIBRATION_INTERVAL", "0.5"))  # giây giữa hai lần đọc
+CALIBRATION_MIN_QUALITY = int(os.getenv("CALIBRATION_MIN_QUALITY", "50"))  # bỏ khoảng cách có quality thấp hơn
+CALIBRATION_HEIGHT = float(os.getenv("CALIBRATION_HEIGHT", "0"))  # độ cao lắp đặt mặc định của anchor (m)
+CALIBRATION_MAX_RESIDUAL = float(os.getenv("CALIBRATION_MAX_RESIDUAL", "0.3"))  # m, cảnh báo cặp lệch nhiều
+CALIBRATION_MIN_KNOWN = int(os.getenv("CALIBRATION_MIN_KNOWN", "2"))  # số anchor đã biết vị trí cần để khớp hệ tọa độ
+
+log = get_logger("gateway.calibration")
+
+Pair = Tuple[int, int]
+
+
+# Node ID UWB suy ra từ tên module: DWC60E -> 0xC60E (4 ký tự hex cuối)
+def node_id_from_name(name: str) -> int:
+    return int(name[-4:], 16)
+
+
+def _pair(a: int, b: int) -> Pair:
+    return (a, b) if a < b else (b, a)
+
+
+# Đọc khoảng cách từ một anchor (initiator) tới các anchor khác qua characteristic location data.
+# Tạm chuyển location data mode sang 1 (chỉ khoảng cách) rồi khôi phục mode cũ.
+async def read_anchor_distances(mac: str, node_ids: Sequence[int], rounds: int = CALIBRATION_ROUNDS,
+                                interval: float = CALIBRATION_INTERVAL) -> Dict[int, List[float]]:
+    wanted = set(node_ids)
+    measured: Dict[int, List[float]] = {}
+    async with BleakClient(mac) as client:
+        original_mode = await client.read_gatt_char(LOCATION_DATA_MODE_UUID)
+        if original_mode[:1] != b"\x01":
+            await client.write_gatt_char(LOCATION_DATA_MODE_UUID, b"\x01")
+        try:
+            for _ in range(rounds):
+                location = decode_location_data(await client.read_gatt_char(LOCATION_DATA_CHAR_UUID))
+                for entry in (location or {}).get("Distances", []):
+                    if entry["Node ID"] in wanted and entry["Quality Factor"] >= CALIBRATION_MIN_QUALITY:
+                        measured.setdefault(entry["Node ID"], []).append(entry["Distance"])
+                await asyncio.sleep(interval)
+        finally:
+            if original_mode[:1] != b"\x01":
+                await client.write_gatt_char(LOCATION_DATA_MODE_UUID, bytes(original_mode))
+    return measured
+
+
+# Thu thập khoảng cách giữa mọi cặp anchor (tuần tự, mỗi lần một kết nối BLE)
+async def collect_distances(anchors: Sequence[Dict], rounds: int = CALIBRATION_ROUNDS,
+                            interval: float = CALIBRATION_INTERVAL) -> Dict[Pair, List[float]]:
+    node_ids = [node_id_from_name(anchor["name"]) for anchor in anchors]
+    samples: Dict[Pair, List[float]] = {}
+    for anchor, node_id in zip(anchors, node_ids):
+        log.info(f"Đang đo khoảng cách từ anchor {anchor['name']}", extra=fields(mac=anchor["id"], stage="calibrate"))
+        try:
+            measured = await read_anchor_distances(anchor["id"], [n for n in node_ids if n != node_id], rounds,
+                                                   interval)
+        except BleakError as e:
+            log.error(f"Lỗi BLE với anchor {anchor['name']}: {e}", extra=fields(mac=anchor["id"], stage="calibrate"))
+            continue
+        for other, distances in measured.items():
+            samples.setdefault(_pair(node_id, other), []).extend(distances)
+    return samples
+
+
+# Điền khoảng cách còn thiếu bằng đường đi ngắn nhất (Floyd-Warshall), chỉ dùng để khởi tạo MDS
+def _complete(distances: "np.ndarray") -> "np.ndarray":
+    completed = distances.copy()
+    for k in range(len(completed)):
+        completed = np.minimum(completed, completed[:, k, None] + completed[None, k, :])
+    return completed
+
+
+# Classical MDS: tọa độ ban đầu từ ma trận khoảng cách đầy đủ
+def _classical_mds(distances: "np.ndarray", dims: int) -> "np.ndarray":
+    n = len(distances)
+    centering = np.eye(n) - np.ones((n, n)) / n
+    gram = -0.5 * centering @ (distances ** 2) @ centering
+    values, vectors = np.linalg.eigh(gram)
+    order = np.argsort(values)[::-1][:dims]
+    return vectors[:, order] * np.sqrt(np.maximum(values[order], 0.0))
+
+
+# Levenberg-Marquardt trên các cặp đo được: min sum w * (|xi - xj| - dij)^2
+def _refine(points: "np.ndarray", i: "np.ndarray", j: "np.ndarray", measured: "np.ndarray", weights: "np.ndarray",
+            iterations: int = 100) -> "np.ndarray":
+    n, dims = points.shape
+    rows = np.arange(len(measured))
+    sqrt_w = np.sqrt(weights)
+    damping = 1e-3
+
+    def cost(p):
+        return float(np.sum(weights * (np.linalg.norm(p[i] - p[j], axis=1) - measured) ** 2))
+
+    current = cost(points)
+    for _ in range(iterations):
+        delta = points[i] - points[j]
+        norm = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+        residual = (norm - measured) * sqrt_w
+        unit = delta / norm[:, None] * sqrt_w[:, None]
+        jacobian = np.zeros((len(measured), n * dims))
+        for axis in range(dims):
+            jacobian[rows, i * dims + axis] = unit[:, axis]
+            jacobian[rows, j * dims + axis] = -unit[:, axis]
+        normal = jacobian.T @ jacobian
+        gradient = jacobian.T @ residual
+        while True:
+            step = np.linalg.solve(normal + damping * (np.diag(np.diag(normal)) + np.eye(n * dims)), -gradient)
+            candidate = points + step.reshape(n, dims)
+            candidate_cost = cost(candidate)
+            if candidate_cost < current:
+                points, damping = candidate, max(damping / 3, 1e-9)
+                break
+            damping *= 4
+            if damping > 1e9:
+                return points
+        improvement = current - candidate_cost
+        current = candidate_cost
+        if improvement < 1e-12:
+            break
+    return points
+
+
+# Đưa nghiệm về hệ tọa độ chuẩn: anchor đầu tiên ở gốc, anchor thứ hai trên trục +X, anchor thứ ba có Y > 0
+def _normalize(points: "np.ndarray") -> "np.ndarray":
+    points = points - points[0]
+    angle = np.arctan2(points[1, 1], points[1, 0])
+    rotation = np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+    points = points @ rotation.T
+    if len(points) > 2 and points[2, 1] < 0:
+        points[:, 1] = -points[:, 1]
+    return points
+
+
+# Khớp cứng (xoay + tịnh tiến, Kabsch) nghiệm vào hệ tọa độ của các anchor đã biết vị trí, tức hệ tọa độ của tag
+# và của các zone. Cho phép lật vì nghiệm từ khoảng cách chỉ xác định tới một phép đối xứng; với 2 anchor (hoặc các
+# anchor thẳng hàng) không phân biệt được ảnh gương nên giữ chiều của nghiệm.
+# Trả về (tọa độ, RMS lệch tại các anchor đã biết)
+def _align(points: "np.ndarray", known_index: Sequence[int], known_xy: "np.ndarray") -> Tuple["np.ndarray", float]:
+    source = points[list(known_index)]
+    source_center, target_center = source.mean(axis=0), known_xy.mean(axis=0)
+    u, singular, vt = np.linalg.svd((source - source_center).T @ (known_xy - target_center))
+    rotation = vt.T @ u.T
+    if np.linalg.det(rotation) < 0 and singular[1] < 1e-6 * max(singular[0], 1e-12):
+        rotation = vt.T @ np.diag([1.0, -1.0]) @ u.T
+    aligned = (points - source_center) @ rotation.T + target_center
+    error = float(np.sqrt(np.mean(np.sum((aligned[list(known_index)] - known_xy) ** 2, axis=1))))
+    return aligned, error
+
+
+# Giải vị trí các anchor (mặt phẳng XY) từ khoảng cách đo được giữa các cặp; độ cao Z đã biết.
+# known: vị trí (x, y) đã biết của một số anchor; nếu đủ CALIBRATION_MIN_KNOWN anchor thì nghiệm được khớp vào hệ tọa độ
+# đó, nếu không nghiệm ở hệ tọa độ riêng (anchor đầu tiên ở gốc) và các zone phải định nghĩa lại theo hệ này.
+# Trả về tọa độ, sai số từng cặp, RMS và hệ tọa độ ("aligned" / "local")
+def solve_constellation(node_ids: Sequence[int], samples: Dict[Pair, List[float]],
+                        heights: Optional[Dict[int, float]] = None,
+                        known: Optional[Dict[int, Tuple[float, float]]] = None) -> Dict:
+    if np is None:
+        raise RuntimeError("Cần cài numpy để hiệu chuẩn anchor")
+    n = len(node_ids)
+    if n < 3:
+        raise ValueError("Cần ít nhất 3 anchor để hiệu chuẩn")
+    heights = heights or {}
+    z = np.array([heights.get(node_id, CALIBRATION_HEIGHT) for node_id in node_ids], dtype=float)
+    position_of = {node_id: k for k, node_id in enumerate(node_ids)}
+
+    pairs = [(position_of[a], position_of[b], values) for (a, b), values in samples.items()
+             if a in position_of and b in position_of and values]
+    if len(pairs) < 2 * n - 3:
+        raise ValueError(f"Chỉ đo được {len(pairs)} cặp, cần ít nhất {2 * n - 3} cặp cho {n} anchor")
+    i = np.array([a for a, _, _ in pairs])
+    j = np.array([b for _, b, _ in pairs])
+    measured_3d = np.array([statistics.median(values) for _, _, values in pairs])
+    spread = np.array([statistics.pstdev(values) if len(values) > 1 else 0.0 for _, _, values in pairs])
+    # Khoảng cách 3D -> khoảng cách trên mặt phẳng XY
+    measured = np.sqrt(np.maximum(measured_3d ** 2 - (z[i] - z[j]) ** 2, 0.0))
+    weights = 1.0 / (spread ** 2 + 0.01 ** 2)
+    weights = weights / weights.mean()
+
+    matrix = np.full((n, n), np.inf)
+    np.fill_diagonal(matrix, 0.0)
+    matrix[i, j] = matrix[j, i] = measured
+    completed = _complete(matrix)
+    if np.isinf(completed).any():
+        raise ValueError("Đồ thị khoảng cách không liên thông, không thể giải")
+
+    points = _normalize(_refine(_classical_mds(completed, 2), i, j, measured, weights))
+    known_index = [position_of[node_id] for node_id in (known or {}) if node_id in position_of]
+    alignment_error = None
+    if len(known_index) >= max(CALIBRATION_MIN_KNOWN, 2):
+        known_xy = np.array([known[node_ids[k]][:2] for k in known_index], dtype=float)
+        points, alignment_error = _align(points, known_index, known_xy)
+    solved_3d = np.sqrt(np.sum((points[i] - points[j]) ** 2, axis=1) + (z[i] - z[j]) ** 2)
+    residuals = measured_3d - solved_3d
+    return {
+        "frame": "local" if alignment_error is None else "aligned",
+        "aligned_to": [node_ids[k] for k in known_index] if alignment_error is not None else [],
+        "alignment_rms": alignment_error,
+        "positions": {node_id: (float(points[k, 0]), float(points[k, 1]), float(z[k]))
+                      for k, node_id in enumerate(node_ids)},
+        "pairs": [{"a": node_ids[a], "b": node_ids[b], "measured": round(float(m), 4), "solved": round(float(s), 4),
+                   "residual": round(float(r), 4), "spread": round(float(d), 4), "samples": len(values)}
+                  for (a, b, values), m, s, r, d in zip(pairs, measured_3d, solved_3d, residuals, spread)],
+        "rms": float(np.sqrt(np.mean(residuals ** 2))),
+    }
+
+
+# Ghi kết quả hiệu chuẩn (kèm khoảng cách đo thô để giải lại sau này)
+def save_calibration(anchors: Sequence[Dict], samples: Dict[Pair, List[float]], result: Dict,
+                     path: str = ANCHORS_FILE):
+    by_node = {node_id_from_name(anchor["name"]): anchor for anchor in anchors}
+    document = {
+        "solved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rms": round(result["rms"], 4),
+        "frame": result["frame"],
+        "aligned_to": [by_node[node_id]["name"] for node_id in result["aligned_to"]],
+        "alignment_rms": None if result["alignment_rms"] is None else round(result["alignment_rms"], 4),
+        "anchors": [{"name": by_node[node_id]["name"], "id": by_node[node_id]["id"], "node_id": node_id,
+                     "position": [round(value, 4) for value in position]}
+                    for node_id, position in result["positions"].items()],
+        "pairs": result["pairs"],
+        "samples": [{"a": a, "b": b, "distances": values} for (a, b), values in samples.items()],
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=4)
+
+
+# Đọc vị trí anchor đã hiệu chuẩn: MAC -> (x, y, z); rỗng nếu chưa hiệu chuẩn
+# hoặc kết quả ở hệ tọa độ riêng (không khớp với hệ tọa độ của tag)
+def load_anchor_positions(path: str = ANCHORS_FILE) -> Dict[str, Tuple[float, float, float]]:
+    try:
+        with open(path, "r") as f:
+            document = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        log.error(f"Lỗi khi đọc file anchor {path}: {e}", extra=fields(stage="calibrate"))
+        return {}
+    if document.get("frame") == "local":
+        log.warning(f"Vị trí anchor trong {path} ở hệ tọa độ riêng, chưa khớp với hệ tọa độ của tag; bỏ qua",
+                    extra=fields(stage="calibrate"))
+        return {}
+    return {anchor["id"]: tuple(anchor["position"]) for anchor in document.get("anchors", [])}
+
+
+def print_report(anchors: Sequence[Dict], result: Dict):
+    names = {node_id_from_name(anchor["name"]): anchor["name"] for anchor in anchors}
+    print(f"RMS sai số khoảng cách: {result['rms']:.3f} m")
+    if result["frame"] == "aligned":
+        print(f"Đã khớp vào hệ tọa độ của {', '.join(names[n] for n in result['aligned_to'])} "
+              f"(lệch RMS {result['alignment_rms']:.3f} m)")
+    else:
+        print("Hệ tọa độ riêng: anchor đầu tiên ở gốc, anchor thứ hai trên trục +X. Khai báo \"position\" cho ít nhất "
+              f"{max(CALIBRATION_MIN_KNOWN, 2)} anchor trong module.json để khớp với hệ tọa độ của tag, "
+              "nếu không phải định nghĩa lại các zone theo hệ tọa độ này")
+    for node_id, (x, y, z) in result["positions"].items():
+        print(f"  {names[node_id]:<8} X={x:8.3f}  Y={y:8.3f}  Z={z:6.3f}")
+    for pair in sorted(result["pairs"], key=lambda p: -abs(p["residual"])):
+        marker = "  <-- kiểm tra lại" if abs(pair["residual"]) > CALIBRATION_MAX_RESIDUAL else ""
+        print(f"  {names[pair['a']]}-{names[pair['b']]}: đo {pair['measured']:.3f} m, giải {pair['solved']:.3f} m, "
+              f"lệch {pair['residual']:+.3f} m ({pair['samples']} mẫu, độ lệch chuẩn {pair['spread']:.3f}){marker}")
+
+
+async def calibrate(args):
+    with open("module.json", "r") as f:
+        anchors = [module for module in json.load(f) if module["type"] == "anchor" and module["status"] != "disable"]
+    if args.resolve:
+        with open(args.output, "r") as f:
+            samples = {_pair(entry["a"], entry["b"]): entry["distances"] for entry in json.load(f)["samples"]}
+    else:
+        samples = await collect_distances(anchors, args.rounds, args.interval)
+    heights = {node_id_from_name(anchor["name"]): float(anchor["height"]) for anchor in anchors if "height" in anchor}
+    # Vị trí đã biết: "position" khai báo trong module.json (vị trí đã cấu hình trên anchor), nếu không có thì
+    # kết quả hiệu chuẩn trước đó (đã ở hệ tọa độ của tag)
+    known = {node_id_from_name(anchor["name"]): tuple(anchor["position"]) for anchor in anchors if "position" in anchor}
+    if len(known) < max(CALIBRATION_MIN_KNOWN, 2):
+        previous = load_anchor_positions(args.output)
+        known = {node_id_from_name(anchor["name"]): previous[anchor["id"]] for anchor in anchors
+                 if anchor["id"] in previous}
+    result = solve_constellation([node_id_from_name(anchor["name"]) for anchor in anchors], samples, heights, known)
+    save_calibration(anchors, samples, result, args.output)
+    print_report(anchors, result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hiệu chuẩn vị trí anchor từ khoảng cách giữa các anchor")
+    parser.add_argument("--rounds", type=int, default=CALIBRATION_ROUNDS, help="Số lần đọc mỗi anchor")
+    parser.add_argument("--interval", type=float, default=CALIBRATION_INTERVAL, help="Giây giữa hai lần đọc")
+    parser.add_argument("--output", default=ANCHORS_FILE, help="File lưu kết quả")
+    parser.add_argument("--resolve", action="store_true",
+                        help="Giải lại từ khoảng cách đã lưu trong file kết quả, không đo lại")
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(calibrate(args))
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from array import array
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from location import decode_location_batch
+from logger import fields, get_logger
+from metrics import CPU_BUCKETS, QUEUE_DEPTH, REGISTRY
+from queues import QUEUE_SHED
+
+# Cấu hình qua biến môi trường
+CAPTURE = os.getenv("CAPTURE", "0") == "1"  # bật lớp capture gom notify theo lô
+CAPTURE_SLOTS = int(os.getenv("CAPTURE_SLOTS", "64"))  # số frame tối đa chờ xử lý của mỗi tag
+CAPTURE_SLOT_BYTES = int(os.getenv("CAPTURE_SLOT_BYTES", "128"))  # kích thước tối đa một frame (mode 2 ~ 15 anchor)
+CAPTURE_INTERVAL_MS = float(os.getenv("CAPTURE_INTERVAL_MS", "5"))  # chu kỳ lấy và giải mã frame
+CAPTURE_DRAIN_TIMEOUT = float(os.getenv("CAPTURE_DRAIN_TIMEOUT", "5"))  # giây chờ xử lý nốt frame khi dừng
+
+CAPTURE_BATCH_SIZE = REGISTRY.histogram("gateway_capture_batch_frames", "Số frame mỗi lần lấy từ ring buffer",
+                                        buckets=(1, 4, 16, 64, 256, 1024, 4096))
+CAPTURE_DECODE_SECONDS = REGISTRY.histogram("gateway_capture_decode_seconds", "Thời gian giải mã một lô frame",
+                                            buckets=CPU_BUCKETS)
+
+log = get_logger("gateway.capture")
+
+
+# Ring buffer cấp phát sẵn cho một tag: bytes của frame nằm trong một bytearray chung (mỗi frame một slot),
+# độ dài và thời điểm nhận trong array; đầy thì ghi đè frame cũ nhất
+class _Ring:
+    __slots__ = ("slots", "slot_bytes", "data", "lengths", "times", "head", "count")
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.data = bytearray(slots * slot_bytes)
+        self.lengths = array("H", [0]) * slots
+        self.times = array("d", [0.0]) * slots
+        self.head = 0
+        self.count = 0
+
+    # Trả về True nếu phải ghi đè frame cũ nhất
+    def append(self, data: bytes, received: float) -> bool:
+        overwritten = self.count == self.slots
+        if overwritten:
+            index = self.head
+            self.head = (self.head + 1) % self.slots
+        else:
+            index = (self.head + self.count) % self.slots
+            self.count += 1
+        offset = index * self.slot_bytes
+        self.data[offset:offset + len(data)] = data
+        self.lengths[index] = len(data)
+        self.times[index] = received
+        return overwritten
+
+    def drain(self, mac: str, frames: List[bytes], meta: List[Tuple[str, float]]):
+        for k in range(self.count):
+            index = (self.head + k) % self.slots
+            offset = index * self.slot_bytes
+            frames.append(bytes(self.data[offset:offset + self.lengths[index]]))
+            meta.append((mac, self.times[index]))
+        self.head = 0
+        self.count = 0
+
+
+# Lớp capture ở ranh giới callback BLE: callback chỉ chép bytes + thời điểm nhận vào ring buffer của tag,
+# một task duy nhất lấy frame của mọi tag mỗi CAPTURE_INTERVAL_MS và giải mã cả lô (decode_location_batch,
+# mode 0 giải mã bằng numpy), nên chi phí mỗi mẫu được chia đều cho cả lô
+class CaptureBuffer:
+    def __init__(self, on_decoded: Callable[[str, bytes, object, float], None], executor: Optional[Executor] = None,
+                 slots: int = CAPTURE_SLOTS, slot_bytes: int = CAPTURE_SLOT_BYTES,
+                 interval: float = CAPTURE_INTERVAL_MS / 1000):
+        self.on_decoded = on_decoded
+        self.executor = executor
+        self.slots = max(1, slots)
+        self.slot_bytes = slot_bytes
+        self.interval = interval
+        self.rings: Dict[str, _Ring] = {}
+        self.dirty: Set[str] = set()  # các tag có frame chờ, để không phải duyệt mọi ring
+        self.pending = 0
+        self._consumer: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        self._consumer = asyncio.create_task(self._consume())
+
+    # Gọi từ notify callback: không giải mã, không cấp phát (trừ lần đầu của mỗi tag)
+    def append(self, mac: str, data: bytes, received: float):
+        if len(data) > self.slot_bytes:
+            QUEUE_SHED.inc(queue="capture", reason="oversize")
+            log.warning(f"Frame {len(data)} bytes lớn hơn CAPTURE_SLOT_BYTES", extra=fields(mac=mac, stage="capture"))
+            return
+        ring = self.rings.get(mac)
+        if ring is None:
+            ring = self.rings[mac] = _Ring(self.slots, self.slot_bytes)
+        if ring.append(data, received):
+            QUEUE_SHED.inc(queue="capture", reason="evicted")
+        else:
+            self.pending += 1
+        self.dirty.add(mac)
+
+    # Lấy toàn bộ frame đang chờ, theo thứ tự nhận trong từng tag
+    def drain(self) -> Tuple[List[bytes], List[Tuple[str, float]]]:
+        frames: List[bytes] = []
+        meta: List[Tuple[str, float]] = []
+        for mac in self.dirty:
+            self.rings[mac].drain(mac, frames, meta)
+        self.dirty.clear()
+        self.pending = 0
+        return frames, meta
+
+    # Mỗi CAPTURE_INTERVAL_MS xử lý các frame đang chờ; khi stop() thì xử lý nốt lần cuối rồi dừng
+    async def _consume(self):
+        while not self._stopping:
+            await asyncio.sleep(self.interval)
+            await self._process()
+        await self._process()
+
+    async def _process(self):
+        QUEUE_DEPTH.set(self.pending, queue="capture")
+        if not self.pending:
+            return
+        frames, meta = self.drain()
+        started = time.perf_counter()
+        # Frame lỗi được decode_location_batch đánh dấu "invalid_data" riêng từng frame
+        if self.executor is None:
+            locations = decode_location_batch(frames)
+        else:
+            try:
+                locations = await asyncio.get_running_loop().run_in_executor(self.executor, decode_location_batch,
+                                                                             frames)
+            except Exception as e:
+                # Pool hỏng (tiến trình con chết...): giải mã lại trên event loop
+                log.error(f"Lỗi khi giải mã lô frame trong pool: {e}", extra=fields(stage="capture", batch=len(frames)))
+                locations = decode_location_batch(frames)
+        CAPTURE_DECODE_SECONDS.observe(time.perf_counter() - started)
+        CAPTURE_BATCH_SIZE.observe(len(frames))
+        for data, (mac, received), location in zip(frames, meta, locations):
+            try:
+                self.on_decoded(mac, data, location, received)
+            except Exception as e:
+                # Lỗi khi xử lý một frame không được làm dừng task capture
+                log.exception(f"Lỗi khi xử lý frame: {e}", extra=fields(mac=mac, stage="capture"))
+
+    # Xử lý nốt các frame còn trong ring buffer rồi dừng (tối đa timeout giây)
+    async def stop(self, timeout: float = CAPTURE_DRAIN_TIMEOUT):
+        self._stopping = True
+        if self._consumer is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._consumer), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Hết thời gian chờ xử lý nốt frame", extra=fields(stage="capture", pending=self.pending))
+        finally:
+            self._consumer.cancel()
+
+
+# Tạo lớp capture nếu CAPTURE=1; executor (offload.py) dùng để giải mã ngoài event loop nếu có
+def open_capture(on_decoded: Callable[[str, bytes, object, float], None],
+                 executor: Optional[Executor] = None) -> Optional[CaptureBuffer]:
+    if not CAPTURE:
+        return None
+    capture = CaptureBuffer(on_decoded, executor)
+    capture.start()
+    log.info("Bật capture gom notify theo lô", extra=fields(stage="capture", slots=capture.slots,
+                                                             interval_ms=CAPTURE_INTERVAL_MS))
+    return capture
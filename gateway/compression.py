@@ -0,0 +1,260 @@
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường
+COMPRESSION = os.getenv("COMPRESSION", "0") == "1"
+COMPRESS_DEADBAND = float(os.getenv("COMPRESS_DEADBAND", "0.1"))  # m, bỏ qua dao động nhỏ quanh điểm đã gửi
+COMPRESS_MAX_ERROR = float(os.getenv("COMPRESS_MAX_ERROR", "0.15"))  # m, sai số vị trí tối đa sau khi nén
+COMPRESS_MAX_SILENCE = float(os.getenv("COMPRESS_MAX_SILENCE", "10"))  # giây, gửi ít nhất một mẫu mỗi khoảng này
+COMPRESS_WINDOW = int(os.getenv("COMPRESS_WINDOW", "32"))  # số mẫu tối đa trong cửa sổ
+
+COMPRESSION_INPUT = REGISTRY.counter("gateway_compression_input_total", "Số mẫu vị trí đưa vào bộ nén")
+COMPRESSION_OUTPUT = REGISTRY.counter("gateway_compression_output_total", "Số mẫu vị trí được giữ lại để gửi")
+COMPRESSION_RATIO = REGISTRY.gauge("gateway_compression_ratio", "Tỉ lệ nén (mẫu vào / mẫu ra)")
+
+Point = Tuple[float, float, float]
+
+
+def _distance(a: Point, b: Point) -> float:
+    return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2)
+
+
+# Khoảng cách Euclid đồng bộ thời gian (SED): sai lệch giữa vị trí thật tại thời điểm t
+# và vị trí nội suy tuyến tính trên đoạn (t0, p0) -> (t1, p1)
+def _sed(t0: float, p0: Point, t1: float, p1: Point, t: float, p: Point) -> float:
+    ratio = 0.0 if t1 == t0 else (t - t0) / (t1 - t0)
+    return _distance(p, (p0[0] + (p1[0] - p0[0]) * ratio, p0[1] + (p1[1] - p0[1]) * ratio,
+                         p0[2] + (p1[2] - p0[2]) * ratio))
+
+
+# Bộ nén quỹ đạo cho một tag: dead-band + cửa sổ mở (Douglas-Peucker trực tuyến) với SED.
+# Mọi mẫu bị bỏ đều nằm trong max(deadband, max_error) so với quỹ đạo nội suy từ các mẫu được gửi:
+# mẫu trong cửa sổ được kiểm tra SED <= max_error; mẫu đứng yên chỉ được bỏ khi cách anchor < max(deadband,
+# max_error) / 2 và mẫu đứng yên cuối cùng luôn được gửi trước mẫu kế tiếp, nên đoạn nội suy anchor -> mẫu đó
+# nằm trọn trong hình cầu bán kính đó quanh anchor và sai số < max(deadband, max_error).
+class TrackCompressor:
+    def __init__(self, deadband: float = COMPRESS_DEADBAND, max_error: float = COMPRESS_MAX_ERROR,
+                 max_silence: float = COMPRESS_MAX_SILENCE, window: int = COMPRESS_WINDOW):
+        self.deadband = deadband
+        # Bán kính quanh anchor để coi là đứng yên: hai điểm trong hình cầu này cách nhau < max(deadband, max_error)
+        self.still_radius = max(deadband, max_error) / 2 if deadband > 0 else 0.0
+        self.max_error = max_error
+        self.max_silence = max_silence
+        self.window_size = max(1, window)
+        self.anchor: Optional[Tuple[float, Point, Any]] = None  # mẫu gửi gần nhất
+        self.window: List[Tuple[float, Point, Any]] = []  # các mẫu chưa gửi kể từ anchor
+        self.window_deviation = 0.0  # khoảng cách lớn nhất từ anchor tới các mẫu trong cửa sổ
+        self.still: Optional[Tuple[float, Point, Any]] = None  # mẫu cuối bị bỏ do dead-band
+        self.received = 0
+        self.emitted = 0
+
+    def _emit(self, sample: Tuple[float, Point, Any]) -> List[Any]:
+        self.anchor = sample
+        self.still = None
+        self.emitted += 1
+        return [sample[2]]
+
+    def _fits(self, ts: float, position: Point) -> bool:
+        anchor_ts, anchor_position, _ = self.anchor
+        return all(_sed(anchor_ts, anchor_position, ts, position, t, p) <= self.max_error for t, p, _ in self.window)
+
+    # Đưa vào một mẫu (thời gian giây, vị trí m, bản ghi gốc); trả về các bản ghi cần gửi
+    def offer(self, ts: float, position: Point, record: Any) -> List[Any]:
+        self.received += 1
+        sample = (ts, position, record)
+        if self.anchor is None:
+            return self._emit(sample)
+        anchor_ts, anchor_position, _ = self.anchor
+
+        deviation = _distance(position, anchor_position)
+        resting = deviation < self.still_radius and self.window_deviation < self.still_radius
+
+        if ts - anchor_ts >= self.max_silence:
+            # Quá lâu chưa gửi: gửi mẫu hiện tại (kèm mẫu cuối cửa sổ nếu đoạn thẳng không còn đủ chính xác,
+            # hoặc mẫu đứng yên cuối nếu mẫu hiện tại đã ra khỏi dead-band)
+            if self.still is not None and not resting:
+                emitted = self._emit(self.still)
+            elif self._fits(ts, position):
+                emitted = []
+            else:
+                emitted = self._emit(self.window[-1])
+            self.window = []
+            self.window_deviation = 0.0
+            return emitted + self._emit(sample)
+
+        if resting:
+            # Vẫn đứng yên quanh điểm đã gửi
+            self.window = []
+            self.window_deviation = 0.0
+            self.still = sample
+            return []
+
+        emitted = []
+        if self.still is not None and not self.window:
+            # Bắt đầu di chuyển sau khi đứng yên: gửi mẫu đứng yên cuối để đoạn thẳng không kéo dài qua lúc dừng
+            emitted = self._emit(self.still)
+            anchor_position = self.anchor[1]
+            deviation = _distance(position, anchor_position)
+
+        if len(self.window) < self.window_size and self._fits(ts, position):
+            self.window.append(sample)
+            self.window_deviation = max(self.window_deviation, deviation)
+            return emitted
+
+        # Không thể kéo dài đoạn thẳng nữa: gửi mẫu cuối còn hợp lệ làm anchor mới
+        last = self.window[-1]
+        emitted = self._emit(last)
+        self.window = [sample]
+        self.window_deviation = _distance(position, last[1])
+        return emitted
+
+    # Có mẫu đang bị giữ lại (trong cửa sổ hoặc mẫu đứng yên cuối) chưa gửi
+    @property
+    def pending(self) -> bool:
+        return bool(self.window) or self.still is not None
+
+    # Gửi mẫu cuối cùng còn giữ lại khi không còn mẫu mới (tag im lặng, mất kết nối, gateway dừng).
+    # Mẫu cuối cửa sổ đã được kiểm tra SED cho cả cửa sổ, mẫu đứng yên cuối nằm trong dead-band, nên giới hạn sai số
+    # vẫn đúng; sau đó bộ nén tiếp tục bình thường với mẫu này làm anchor
+    def flush(self) -> List[Any]:
+        if self.window:
+            last = self.window[-1]
+        elif self.still is not None:
+            last = self.still
+        else:
+            return []
+        self.window = []
+        self.window_deviation = 0.0
+        return self._emit(last)
+
+    @property
+    def ratio(self) -> float:
+        return self.received / self.emitted if self.emitted else 0.0
+
+
+# Quản lý bộ nén cho mọi tag
+class TrajectoryCompression:
+    def __init__(self, **options):
+        self.options = options
+        self.tracks: Dict[str, TrackCompressor] = {}
+        self.received = 0
+        self.emitted = 0
+
+    def offer(self, mac: str, ts: float, position: Point, record: Any) -> List[Any]:
+        track = self.tracks.get(mac)
+        if track is None:
+            track = self.tracks[mac] = TrackCompressor(**self.options)
+        self.received += 1
+        COMPRESSION_INPUT.inc()
+        return self._count(track.offer(ts, position, record))
+
+    def _count(self, kept: List[Any]) -> List[Any]:
+        if kept:
+            self.emitted += len(kept)
+            COMPRESSION_OUTPUT.inc(len(kept))
+            COMPRESSION_RATIO.set(self.ratio)
+        return kept
+
+    # Tag mất kết nối: gửi các mẫu còn giữ lại và bỏ bộ nén của tag (lần kết nối sau bắt đầu lại từ đầu)
+    def flush(self, mac: str) -> List[Any]:
+        track = self.tracks.pop(mac, None)
+        return self._count(track.flush()) if track is not None else []
+
+    # Gọi định kỳ: tag có mẫu bị giữ lại mà đã quá max_silence kể từ mẫu gửi gần nhất thì gửi luôn,
+    # không chờ mẫu kế tiếp. Trả về danh sách (mac, bản ghi)
+    def flush_idle(self, now: float) -> List[Tuple[str, Any]]:
+        flushed = []
+        for mac, track in self.tracks.items():
+            if track.pending and now - track.anchor[0] >= track.max_silence:
+                flushed += [(mac, record) for record in self._count(track.flush())]
+        return flushed
+
+    # Gateway dừng: gửi mọi mẫu còn giữ lại
+    def flush_all(self) -> List[Tuple[str, Any]]:
+        flushed = []
+        for mac, track in self.tracks.items():
+            flushed += [(mac, record) for record in self._count(track.flush())]
+        return flushed
+
+    @property
+    def ratio(self) -> float:
+        return self.received / self.emitted if self.emitted else 0.0
+
+
+# Tạo bộ nén theo cấu hình (None nếu tắt)
+def open_compression() -> Optional[TrajectoryCompression]:
+    return TrajectoryCompression() if COMPRESSION else None
+
+
+if __name__ == "__main__":
+    # Mô phỏng: tag đứng yên có nhiễu, đi thẳng, rẽ, rồi đứng yên (10 Hz), kiểm tra sai số tối đa
+    import random
+
+    random.seed(2)
+    samples = []
+    ts = 0.0
+    for phase, duration, velocity in (("still", 60, (0, 0)), ("straight", 20, (1.0, 0)), ("turn", 10, (0, 0.8)),
+                                      ("still", 60, (0, 0))):
+        for _ in range(int(duration * 10)):
+            ts += 0.1
+            last = samples[-1][1] if samples else (0.0, 0.0, 1.0)
+            true = (last[0] + velocity[0] * 0.1, last[1] + velocity[1] * 0.1, 1.0)
+            samples.append((ts, true))
+    compressor = TrackCompressor()
+    received, kept = [], []
+    for ts, true in samples:
+        noisy = (true[0] + random.gauss(0, 0.02), true[1] + random.gauss(0, 0.02), true[2])
+        received.append((ts, noisy))
+        kept += compressor.offer(ts, noisy, (ts, noisy))
+    kept += compressor.flush()
+
+    def worst_error(kept, received) -> float:
+        worst = 0.0
+        for (t0, p0), (t1, p1) in zip(kept, kept[1:]):
+            for ts, position in received:
+                if t0 <= ts <= t1:
+                    worst = max(worst, _sed(t0, p0, t1, p1, ts, position))
+        return worst
+
+    print(f"{compressor.received} mẫu -> {compressor.emitted} mẫu (tỉ lệ {compressor.ratio:.1f}x), "
+          f"sai số lớn nhất so với mẫu gốc: {worst_error(kept, received):.3f} m")
+
+    # Kiểm tra ngẫu nhiên giới hạn sai số max(deadband, max_error): đứng yên, dao động nhỏ, nhảy xa,
+    # khoảng cách mẫu và cấu hình (max_silence, window) khác nhau
+    for deadband in (0.0, 0.1, 0.3):
+        bound = max(deadband, COMPRESS_MAX_ERROR)
+        worst = 0.0
+        for seed in range(300):
+            rng = random.Random(seed)
+            compressor = TrackCompressor(deadband=deadband, max_error=COMPRESS_MAX_ERROR,
+                                         max_silence=rng.choice([2.0, 5.0, 10.0]), window=rng.choice([4, 16, 32]))
+            ts, true, received, kept = 0.0, [0.0, 0.0], [], []
+            for _ in range(rng.randrange(50, 600)):
+                ts += rng.choice([0.1, 0.1, 0.2, 1.0])
+                mode = rng.random()
+                if mode < 0.5:
+                    step = (0.0, 0.0)
+                elif mode < 0.8:
+                    step = (rng.gauss(0, 0.1), rng.gauss(0, 0.1))
+                else:
+                    step = (rng.uniform(-1, 1), rng.uniform(-1, 1))
+                true = [true[0] + step[0], true[1] + step[1]]
+                noisy = (true[0] + rng.gauss(0, 0.03), true[1] + rng.gauss(0, 0.03), 1.0)
+                received.append((ts, noisy))
+                kept += compressor.offer(ts, noisy, (ts, noisy))
+            kept += compressor.flush()  # luồng kết thúc (tag im lặng / mất kết nối): gửi mẫu còn giữ lại
+            assert kept[-1] == received[-1] and not compressor.pending
+            worst = max(worst, worst_error(kept, received))
+        assert worst <= bound + 1e-9, f"deadband {deadband}: sai số {worst:.4f} m > {bound} m"
+        print(f"deadband {deadband}: sai số lớn nhất {worst:.4f} m <= {bound} m")
+
+    # flush_idle: tag đang di chuyển rồi im lặng, mẫu trong cửa sổ được gửi sau max_silence mà không cần mẫu mới
+    compression = TrajectoryCompression(max_silence=2.0)
+    sent = [record for i in range(10) for record in compression.offer("tag", i * 0.1, (i * 0.1, 0.0, 1.0), i)]
+    assert sent == [0] and compression.flush_idle(1.0) == []
+    assert compression.flush_idle(2.0) == [("tag", 9)] and compression.flush_idle(10.0) == []
+    assert compression.offer("tag", 3.0, (5.0, 0.0, 1.0), 10) == [10] and compression.flush("tag") == []
+    print("flush OK")
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from global_var import LOCATION_DATA_MODE_UUID, OPERATION_MODE_UUID, UPDATE_RATE_UUID
+from logger import fields, get_logger, setup_logging
+from opmode import OperationMode, decode_operation_mode, encode_operation_mode
+from sharding import BLE_BACKEND, get_backend
+
+# Cấu hình qua biến môi trường
+FLEET_FILE = os.getenv("FLEET_FILE", "fleet.json")  # trạng thái mong muốn
+FLEET_CACHE_FILE = os.getenv("FLEET_CACHE_FILE", "fleet-cache.json")  # giá trị đọc được lần trước
+FLEET_CACHE_TTL = float(os.getenv("FLEET_CACHE_TTL", "86400"))  # giây; cache cũ hơn thì đọc lại
+FLEET_CONCURRENCY = int(os.getenv("FLEET_CONCURRENCY", "3"))  # số kết nối BLE đồng thời
+FLEET_RETRIES = int(os.getenv("FLEET_RETRIES", "3"))
+FLEET_SCAN_TIMEOUT = float(os.getenv("FLEET_SCAN_TIMEOUT", "10"))
+
+log = get_logger("gateway.fleet")
+
+
+# Mỗi thiết lập: UUID characteristic, hàm chuyển giá trị cấu hình -> bytes, bytes -> giá trị hiển thị
+def _encode_update_rate(value) -> bytes:
+    u1, u2 = value
+    return struct.pack("<II", int(u1), int(u2))
+
+
+def _decode_update_rate(data: bytes):
+    return list(struct.unpack("<II", data[:8]))
+
+
+SETTINGS = {
+    "update_rate": (UPDATE_RATE_UUID, _encode_update_rate, _decode_update_rate),
+    "location_mode": (LOCATION_DATA_MODE_UUID, lambda value: bytes([int(value)]), lambda data: data[0]),
+    "operation_mode": (OPERATION_MODE_UUID, lambda value: bytes.fromhex(value), lambda data: data.hex()),
+}
+# Thiết lập chỉ áp dụng cho tag
+TAG_ONLY = {"update_rate"}
+
+
+def load_json(path: str, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+# Trạng thái mong muốn của từng module: defaults theo loại, ghi đè theo MAC
+# {"defaults": {"tag": {"update_rate": [100, 1000], "location_mode": 0}}, "modules": {"EB:52:...": {...}}}
+def desired_state(modules: List[Dict], config: Dict) -> Dict[str, Dict]:
+    defaults = config.get("defaults", {})
+    overrides = {mac.upper(): values for mac, values in config.get("modules", {}).items()}
+    desired = {}
+    for module in modules:
+        if module["status"] == "disable":
+            continue
+        mac = module["id"].upper()
+        values = dict(defaults.get(module["type"], {}))
+        values.update(overrides.get(mac, {}))
+        if module["type"] != "tag":
+            for name in TAG_ONLY:
+                values.pop(name, None)
+        unknown = set(values) - set(SETTINGS)
+        if isinstance(values.get("operation_mode"), dict):
+            unknown |= set(values["operation_mode"]) - set(OperationMode._fields)
+        if unknown:
+            raise ValueError(f"Thiết lập không hỗ trợ cho {mac}: {sorted(unknown)}")
+        if values:
+            desired[mac] = values
+    return desired
+
+
+# Giá trị mong muốn dạng hex. operation_mode có thể là hex hoặc dict các trường cần đổi
+# ({"led_enable": false}); khi đó các trường khác và bit reserved giữ như giá trị hiện tại
+def _encoded(name: str, value, current_hex: Optional[str]) -> Optional[str]:
+    if name == "operation_mode" and isinstance(value, dict):
+        if current_hex is None:
+            return None
+        current = bytes.fromhex(current_hex)
+        return encode_operation_mode(decode_operation_mode(current)._replace(**value), current).hex()
+    return SETTINGS[name][1](value).hex()
+
+
+# Các thiết lập cần ghi: so giá trị hiện tại (hex) với giá trị mong muốn (None nếu chưa biết giá trị hiện tại)
+def diff(current: Dict[str, str], desired: Dict) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    changes = {}
+    for name, value in desired.items():
+        wanted = _encoded(name, value, current.get(name))
+        if wanted is None or current.get(name) != wanted:
+            changes[name] = (current.get(name), wanted)
+    return changes
+
+
+def _display(name: str, hex_value: Optional[str]):
+    if hex_value is None:
+        return None
+    return SETTINGS[name][2](bytes.fromhex(hex_value))
+
+
+# Cấu hình một module: đọc giá trị hiện tại, chỉ ghi các thiết lập khác, đọc lại để xác nhận.
+# device: thiết bị từ lần quét chung; kết nối bằng device để bleak không phải quét lại cho từng module
+async def configure_module(client_class, module: Dict, desired: Dict, semaphore: asyncio.Semaphore,
+                           dry_run: bool = False, device=None) -> Dict:
+    mac = module["id"].upper()
+    result = {"id": mac, "name": module["name"], "status": "failed", "changes": {}, "error": None, "current": {}}
+    for attempt in range(1, FLEET_RETRIES + 1):
+        try:
+            async with semaphore:
+                async with client_class(device if device is not None else mac) as client:
+                    current = {}
+                    for name in desired:
+                        current[name] = bytes(await client.read_gatt_char(SETTINGS[name][0])).hex()
+                    result["current"] = current
+                    changes = diff(current, desired)
+                    result["changes"] = {name: {"from": _display(name, old), "to": _display(name, new)}
+                                         for name, (old, new) in changes.items()}
+                    if not changes:
+                        result["status"] = "unchanged"
+                        return result
+                    if dry_run:
+                        result["status"] = "pending"
+                        return result
+                    for name, (_, new) in changes.items():
+                        await client.write_gatt_char(SETTINGS[name][0], bytes.fromhex(new), response=True)
+                    for name, (_, new) in changes.items():
+                        current[name] = bytes(await client.read_gatt_char(SETTINGS[name][0])).hex()
+                    mismatched = diff(current, {name: desired[name] for name in changes})
+                    if mismatched:
+                        result["error"] = f"Xác nhận thất bại: {sorted(mismatched)}"
+                        return result
+                    result["status"] = "updated"
+                    return result
+        except Exception as e:
+            result["error"] = str(e)
+            log.warning(f"Lỗi cấu hình {module['name']} (lần {attempt}): {e}",
+                        extra=fields(mac=mac, stage="fleet", attempt=attempt))
+            if attempt < FLEET_RETRIES:
+                await asyncio.sleep(1)
+    return result
+
+
+# Quét một lần, so với cache, cấu hình đồng thời các module cần thay đổi
+async def apply_fleet(config: Dict, modules: List[Dict], use_cache: bool = True, dry_run: bool = False,
+                      concurrency: int = FLEET_CONCURRENCY, backend: str = BLE_BACKEND) -> List[Dict]:
+    client_class, scanner_class = get_backend(backend)
+    desired = desired_state(modules, config)
+    by_mac = {module["id"].upper(): module for module in modules}
+    cache = load_json(FLEET_CACHE_FILE, {}) if use_cache else {}
+    now = time.time()
+
+    report, todo = [], []
+    for mac, values in desired.items():
+        cached = cache.get(mac)
+        if cached and now - cached["read_at"] < FLEET_CACHE_TTL and not diff(cached["values"], values):
+            report.append({"id": mac, "name": by_mac[mac]["name"], "status": "cached", "changes": {}, "error": None})
+        else:
+            todo.append(mac)
+
+    if todo:
+        log.info(f"Quét BLE cho {len(todo)} module cần kiểm tra", extra=fields(stage="fleet"))
+        devices = await scanner_class.discover(timeout=FLEET_SCAN_TIMEOUT)
+        found = {device.address.upper(): device for device in devices}
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = []
+        for mac in todo:
+            if mac in found:
+                tasks.append(configure_module(client_class, by_mac[mac], desired[mac], semaphore, dry_run,
+                                              found[mac]))
+            else:
+                report.append({"id": mac, "name": by_mac[mac]["name"], "status": "missing", "changes": {},
+                               "error": None})
+        for result in await asyncio.gather(*tasks):
+            current = result.pop("current")
+            if result["status"] in ("updated", "unchanged"):
+                entry = cache.setdefault(result["id"], {"values": {}})
+                entry["values"].update(current)
+                entry["read_at"] = time.time()
+            report.append(result)
+
+    if not dry_run:
+        with open(FLEET_CACHE_FILE, "w") as f:
+            json.dump(cache, f, indent=4)
+    return sorted(report, key=lambda entry: entry["name"])
+
+
+def print_report(report: List[Dict]):
+    counts: Dict[str, int] = {}
+    for entry in report:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        changes = ", ".join(f"{name}: {change['from']} -> {change['to']}" for name, change in entry["changes"].items())
+        detail = changes or entry["error"] or ""
+        print(f"{entry['name']:<10} {entry['id']:<18} {entry['status']:<10} {detail}")
+    print("Tổng kết: " + ", ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cấu hình hàng loạt update rate / location mode / operation mode")
+    parser.add_argument("--config", default=FLEET_FILE, help="File trạng thái mong muốn")
+    parser.add_argument("--modules", default="module.json", help="Danh sách module")
+    parser.add_argument("--no-cache", action="store_true", help="Đọc lại mọi module, không dùng cache")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đọc và liệt kê thay đổi, không ghi")
+    parser.add_argument("--concurrency", type=int, default=FLEET_CONCURRENCY, help="Số kết nối đồng thời")
+    parser.add_argument("--report", help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    setup_logging()
+    with open(args.config, "r") as f:
+        fleet_config = json.load(f)
+    with open(args.modules, "r") as f:
+        managed_modules = json.load(f)
+    fleet_report = asyncio.run(apply_fleet(fleet_config, managed_modules, not args.no_cache, args.dry_run,
+                                           args.concurrency))
+    print_report(fleet_report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(fleet_report, f, indent=4, ensure_ascii=False)
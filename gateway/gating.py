@@ -0,0 +1,139 @@
+import json
+import math
+import os
+from typing import Dict, Optional, Tuple
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường
+GATING_FILE = os.getenv("GATING_FILE", "gating.json")
+GATE_MODE = os.getenv("GATE_MODE", "drop")  # drop: bỏ mẫu; flag: vẫn gửi nhưng đánh dấu lý do
+GATE_RESYNC_SAMPLES = int(os.getenv("GATE_RESYNC_SAMPLES", "5"))  # số mẫu bị loại liên tiếp trước khi chấp nhận lại
+GATE_RESET_SECONDS = float(os.getenv("GATE_RESET_SECONDS", "10"))  # mất tín hiệu lâu hơn thì bỏ trạng thái cũ
+
+GATE_TOTAL = REGISTRY.counter("gateway_gate_total", "Số mẫu vị trí qua bộ lọc hợp lệ", ["result"])
+
+log = get_logger("gateway.gating")
+
+Bounds = Tuple[Tuple[float, float, float], Tuple[float, float, float]]
+
+
+# Trạng thái động học của một tag: mẫu được chấp nhận gần nhất và vận tốc tương ứng
+class _Track:
+    __slots__ = ("x", "y", "z", "ts", "vx", "vy", "vz", "rejected")
+
+    def __init__(self, x: float, y: float, z: float, ts: float):
+        self.x, self.y, self.z, self.ts = x, y, z, ts
+        self.vx = self.vy = self.vz = None
+        self.rejected = 0
+
+
+# Loại mẫu vị trí không hợp lý: chất lượng thấp, ngoài khu vực, vượt tốc độ / gia tốc tối đa theo loại tag.
+# Mỗi tag chỉ giữ một mẫu và một vận tốc, nên mỗi lần kiểm tra là O(1)
+class PositionGate:
+    def __init__(self, min_quality: int = 0, bounds: Optional[Bounds] = None, anchor_margin: Optional[float] = None,
+                 limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 resync: int = GATE_RESYNC_SAMPLES, reset: float = GATE_RESET_SECONDS):
+        self.min_quality = min_quality
+        self.bounds = bounds
+        self.anchor_margin = anchor_margin
+        self.limits = limits or {}
+        self.resync = max(1, resync)
+        self.reset = reset
+        self.kinds: Dict[str, str] = {}
+        self.anchors: Dict[str, Tuple[float, float, float]] = {}
+        self.anchor_bounds: Optional[Bounds] = None
+        self.tracks: Dict[str, _Track] = {}
+
+    # Gán loại (kind) cho từng MAC, dùng để chọn giới hạn tốc độ / gia tốc
+    def set_kinds(self, kinds: Dict[str, str]):
+        self.kinds.update(kinds)
+
+    # Ghi nhận vị trí anchor; vị trí tag phải nằm trong hộp bao các anchor nới thêm anchor_margin
+    def set_anchor(self, mac: str, x: float, y: float, z: float):
+        self.anchors[mac] = (x, y, z)
+        if self.anchor_margin is None or len(self.anchors) < 3:
+            return
+        m = self.anchor_margin
+        points = self.anchors.values()
+        self.anchor_bounds = (tuple(min(p[i] for p in points) - m for i in range(3)),
+                              tuple(max(p[i] for p in points) + m for i in range(3)))
+
+    def _limit(self, mac: str, name: str) -> Optional[float]:
+        limits = self.limits.get(self.kinds.get(mac, "tag")) or self.limits.get("default") or {}
+        return limits.get(name)
+
+    # Kiểm tra một mẫu; trả về lý do loại (None nếu hợp lệ)
+    def check(self, mac: str, x: float, y: float, z: float, quality: int, ts: float) -> Optional[str]:
+        reason = self._static(x, y, z, quality) or self._kinematic(mac, x, y, z, ts)
+        GATE_TOTAL.inc(result=reason or "accepted")
+        return reason
+
+    def _static(self, x: float, y: float, z: float, quality: int) -> Optional[str]:
+        if quality < self.min_quality:
+            return "quality"
+        for name, bounds in (("bounds", self.bounds), ("anchors", self.anchor_bounds)):
+            if bounds is not None:
+                low, high = bounds
+                if not (low[0] <= x <= high[0] and low[1] <= y <= high[1] and low[2] <= z <= high[2]):
+                    return name
+        return None
+
+    def _kinematic(self, mac: str, x: float, y: float, z: float, ts: float) -> Optional[str]:
+        track = self.tracks.get(mac)
+        if track is None or ts - track.ts > self.reset:
+            self.tracks[mac] = _Track(x, y, z, ts)
+            return None
+        dt = ts - track.ts
+        if dt <= 0:
+            return None
+        vx, vy, vz = (x - track.x) / dt, (y - track.y) / dt, (z - track.z) / dt
+        reason = None
+        max_speed = self._limit(mac, "max_speed")
+        if max_speed is not None and math.sqrt(vx * vx + vy * vy + vz * vz) > max_speed:
+            reason = "speed"
+        max_accel = self._limit(mac, "max_accel")
+        if reason is None and max_accel is not None and track.vx is not None:
+            ax, ay, az = (vx - track.vx) / dt, (vy - track.vy) / dt, (vz - track.vz) / dt
+            if math.sqrt(ax * ax + ay * ay + az * az) > max_accel:
+                reason = "accel"
+        if reason is not None:
+            track.rejected += 1
+            if track.rejected < self.resync:
+                return reason
+            # Liên tục bị loại: có thể tag thật sự đã dịch chuyển (mất tín hiệu rồi bắt lại), chấp nhận vị trí mới
+            self.tracks[mac] = _Track(x, y, z, ts)
+            return None
+        track.x, track.y, track.z, track.ts = x, y, z, ts
+        track.vx, track.vy, track.vz = vx, vy, vz
+        track.rejected = 0
+        return None
+
+
+# Đọc cấu hình bộ lọc:
+# {"min_quality": 30, "bounds": {"min": [x, y, z], "max": [x, y, z]}, "anchor_margin": 5,
+#  "kinds": {"default": {"max_speed": 5, "max_accel": 10}, "forklift": {"max_speed": 8}}}
+def load_gating_config(path: str = GATING_FILE) -> Optional[Dict]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        log.error(f"Lỗi khi đọc file gating {path}: {e}", extra=fields(stage="gating"))
+        return None
+
+
+# Tạo PositionGate từ file cấu hình (None nếu không có cấu hình)
+def open_position_gate(path: str = GATING_FILE) -> Optional[PositionGate]:
+    config = load_gating_config(path)
+    if not config:
+        return None
+    bounds = None
+    if "bounds" in config:
+        bounds = (tuple(config["bounds"]["min"]), tuple(config["bounds"]["max"]))
+    gate = PositionGate(int(config.get("min_quality", 0)), bounds, config.get("anchor_margin"),
+                        config.get("kinds", {}))
+    log.info("Bật bộ lọc vị trí không hợp lệ", extra=fields(stage="gating", mode=GATE_MODE))
+    return gate
@@ -0,0 +1,251 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường (HISTORY_DB rỗng để tắt)
+HISTORY_DB = os.getenv("HISTORY_DB", "history.sqlite3")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))  # giây
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "100000"))
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "7"))
+# Dữ liệu cũ hơn HISTORY_DOWNSAMPLE_AFTER giờ chỉ giữ 1 mẫu mỗi HISTORY_DOWNSAMPLE_BUCKET giây cho mỗi tag
+HISTORY_DOWNSAMPLE_AFTER = float(os.getenv("HISTORY_DOWNSAMPLE_AFTER", "24"))
+HISTORY_DOWNSAMPLE_BUCKET = float(os.getenv("HISTORY_DOWNSAMPLE_BUCKET", "10"))
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "600"))  # giây
+
+HISTORY_ROWS = REGISTRY.counter("gateway_history_rows_total", "Số dòng đã ghi vào history", ["table"])
+HISTORY_DROPPED = REGISTRY.counter("gateway_history_dropped_total", "Số mẫu bị bỏ do queue history đầy")
+HISTORY_FLUSH_SECONDS = REGISTRY.histogram("gateway_history_flush_seconds", "Thời gian ghi một lô vào SQLite")
+
+log = get_logger("gateway.history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    mac TEXT NOT NULL,
+    ts REAL NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL NOT NULL,
+    quality INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS positions_mac_ts ON positions (mac, ts);
+CREATE INDEX IF NOT EXISTS positions_ts ON positions (ts);
+CREATE TABLE IF NOT EXISTS distances (
+    mac TEXT NOT NULL,
+    ts REAL NOT NULL,
+    node_id INTEGER NOT NULL,
+    distance REAL NOT NULL,
+    quality INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS distances_mac_ts ON distances (mac, ts);
+CREATE INDEX IF NOT EXISTS distances_ts ON distances (ts);
+"""
+
+_STOP = object()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Kho lịch sử vị trí/khoảng cách: record() chỉ đưa mẫu vào queue (không chặn event loop),
+# một luồng nền gom mẫu thành lô và ghi trong một transaction
+class HistoryStore:
+    def __init__(self, path: str = HISTORY_DB, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL, queue_size: int = HISTORY_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._reader_local = threading.local()
+        self._last_maintenance = time.time()
+        with _connect(path) as conn:
+            conn.executescript(SCHEMA)
+
+    def start(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._writer.start()
+
+    # Dừng luồng ghi sau khi đã ghi hết các mẫu còn trong queue
+    def stop(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+
+    # Ghi nhận một kết quả giải mã (dict từ location.py) cho một MAC
+    def record(self, mac: str, ts: float, location):
+        if not isinstance(location, dict):
+            return
+        try:
+            self._queue.put_nowait((mac, ts, location))
+        except queue.Full:
+            HISTORY_DROPPED.inc()
+
+    def _run(self):
+        conn = _connect(self.path)
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(conn, pending)
+                conn.close()
+                return
+            if item is not None:
+                pending.append(item)
+            if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(conn, pending)
+                pending = []
+                deadline = time.monotonic() + self.flush_interval
+                if time.time() - self._last_maintenance >= HISTORY_MAINTENANCE_INTERVAL:
+                    self.maintain(conn)
+
+    def _flush(self, conn: sqlite3.Connection, items: List):
+        if not items:
+            return
+        started = time.perf_counter()
+        positions, distances = [], []
+        for mac, ts, location in items:
+            position = location.get("Position")
+            if position:
+                positions.append((mac, ts, position["X"], position["Y"], position["Z"], position["Quality Factor"]))
+            for distance in location.get("Distances", ()):
+                distances.append((mac, ts, distance["Node ID"], distance["Distance"], distance["Quality Factor"]))
+        try:
+            with conn:
+                conn.executemany("INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?)", positions)
+                conn.executemany("INSERT INTO distances VALUES (?, ?, ?, ?, ?)", distances)
+        except sqlite3.Error as e:
+            log.error(f"Lỗi khi ghi history: {e}", extra=fields(stage="history", rows=len(items)))
+            return
+        HISTORY_ROWS.inc(len(positions), table="positions")
+        HISTORY_ROWS.inc(len(distances), table="distances")
+        HISTORY_FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    # Xóa dữ liệu quá hạn và giảm mẫu dữ liệu cũ
+    def maintain(self, conn: Optional[sqlite3.Connection] = None, now: Optional[float] = None):
+        own = conn is None
+        conn = conn or _connect(self.path)
+        now = now or time.time()
+        retention_cutoff = now - HISTORY_RETENTION_DAYS * 86400
+        downsample_cutoff = now - HISTORY_DOWNSAMPLE_AFTER * 3600
+        try:
+            with conn:
+                for table in ("positions", "distances"):
+                    conn.execute(f"DELETE FROM {table} WHERE ts < ?", (retention_cutoff,))
+                    group = "mac, CAST(ts / ? AS INTEGER)" + (", node_id" if table == "distances" else "")
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE ts < ? AND rowid NOT IN "
+                        f"(SELECT MIN(rowid) FROM {table} WHERE ts < ? GROUP BY {group})",
+                        (downsample_cutoff, downsample_cutoff, HISTORY_DOWNSAMPLE_BUCKET))
+        except sqlite3.Error as e:
+            log.error(f"Lỗi khi dọn dẹp history: {e}", extra=fields(stage="history"))
+        finally:
+            if own:
+                conn.close()
+        self._last_maintenance = now
+
+    # Mỗi luồng đọc dùng một kết nối riêng (WAL cho phép đọc song song với luồng ghi)
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._reader_local, "conn", None)
+        if conn is None:
+            conn = self._reader_local.conn = _connect(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def _select(self, table: str, columns: str, mac: Optional[str], start: Optional[float],
+                end: Optional[float], limit: Optional[int]) -> List[Dict]:
+        where, params = [], []
+        if mac is not None:
+            where.append("mac = ?")
+            params.append(mac)
+        if start is not None:
+            where.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("ts < ?")
+            params.append(end)
+        sql = f"SELECT {columns} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self._reader().execute(sql, params)]
+
+    # Truy vấn vị trí theo tag và/hoặc khoảng thời gian [start, end)
+    def positions(self, mac: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+                  limit: Optional[int] = None) -> List[Dict]:
+        return self._select("positions", "mac, ts, x, y, z, quality", mac, start, end, limit)
+
+    # Truy vấn khoảng cách tới anchor theo tag và/hoặc khoảng thời gian [start, end)
+    def distances(self, mac: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+                  limit: Optional[int] = None) -> List[Dict]:
+        return self._select("distances", "mac, ts, node_id, distance, quality", mac, start, end, limit)
+
+    # Danh sách MAC có dữ liệu
+    def macs(self) -> List[str]:
+        return [row[0] for row in self._reader().execute("SELECT DISTINCT mac FROM positions")]
+
+    # Bản async của truy vấn: chạy trong thread pool để không chặn event loop
+    async def positions_async(self, *args, **kwargs) -> List[Dict]:
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.positions(*args, **kwargs))
+
+    async def distances_async(self, *args, **kwargs) -> List[Dict]:
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.distances(*args, **kwargs))
+
+
+# Tạo kho history theo cấu hình (None nếu bị tắt)
+def open_history(path: str = HISTORY_DB) -> Optional[HistoryStore]:
+    if not path:
+        return None
+    store = HistoryStore(path)
+    store.start()
+    return store
+
+
+if __name__ == "__main__":
+    # Benchmark: ghi 100k mẫu mode 2 rồi truy vấn theo tag và theo khoảng thời gian
+    import tempfile
+
+    from location import decode_location_mode_2
+    from serializer import make_mode_2_frame
+
+    location = decode_location_mode_2(make_mode_2_frame(1200, 3400, 1100, 90, [(0xC60E, 2500, 100),
+                                                                             (0xC511, 3100, 100)]))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_history(os.path.join(tmp, "bench.sqlite3"))
+        total, tags = 100000, 200
+        base = time.time() - total / tags
+        started = time.perf_counter()
+        for i in range(total):
+            store.record(f"EB:52:53:F5:00:{i % tags:02X}", base + i / tags, location)
+        enqueued = time.perf_counter() - started
+        store.stop()
+        written = time.perf_counter() - started
+        print(f"record(): {total / enqueued:,.0f} mẫu/s (phía event loop), ghi xong: {total / written:,.0f} mẫu/s")
+
+        started = time.perf_counter()
+        rows = store.positions(mac="EB:52:53:F5:00:07", start=base + 100, end=base + 200)
+        print(f"Truy vấn 1 tag trong 100 s: {len(rows)} dòng, {(time.perf_counter() - started) * 1000:.2f} ms")
+        started = time.perf_counter()
+        rows = store.positions(start=base + 100, end=base + 110)
+        print(f"Truy vấn mọi tag trong 10 s: {len(rows)} dòng, {(time.perf_counter() - started) * 1000:.2f} ms")
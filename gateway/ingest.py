@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from logger import fields, get_logger, setup_logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Cấu hình qua biến môi trường
+INGEST_HOST = os.getenv("INGEST_HOST", "127.0.0.1")
+INGEST_PORT = int(os.getenv("INGEST_PORT", "8080"))
+
+# Các trường bắt buộc của payload gateway gửi lên (payload.py)
+REQUIRED_FIELDS = ("name", "id", "type", "location", "status", "time")
+
+log = get_logger("gateway.ingest")
+
+
+# Server giả lập thay cho SV_URL:PORT/TOPIC để đo upload offline: nhận payload đơn (object) và theo lô (mảng)
+# đúng định dạng gateway gửi (json/orjson, msgpack, gzip), có thể thêm độ trễ, lỗi 5xx, 404,
+# ghi lại payload đã nhận (jsonl) và đếm theo mã trạng thái. Có thể đổi lỗi khi đang chạy qua POST /_control
+class IngestStub:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, not_found_rate: float = 0.0, record: Optional[str] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.not_found_rate = not_found_rate
+        self.record_path = record
+        self._record = open(record, "a", encoding="utf-8") if record else None
+        self.requests: Dict[str, int] = {}  # theo mã trạng thái trả về
+        self.payloads = 0  # số payload được chấp nhận
+        self.batches = 0
+        self.bytes = 0
+        self.invalid = 0
+        self.started = time.time()
+
+    # Đổi lỗi / độ trễ khi đang chạy (dùng cho kịch bản mất kết nối trong loadgen.py)
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if name not in ("latency_ms", "jitter_ms", "error_rate", "error_status", "not_found_rate"):
+                raise ValueError(f"Thiết lập không hỗ trợ: {name}")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def stats(self) -> Dict:
+        return {
+            "requests": dict(self.requests),
+            "payloads": self.payloads,
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "invalid": self.invalid,
+            "uptime": round(time.time() - self.started, 3),
+        }
+
+    def _count(self, status: int) -> web.Response:
+        self.requests[str(status)] = self.requests.get(str(status), 0) + 1
+        return web.Response(status=status, text="ok" if status == 200 else "error")
+
+    @staticmethod
+    def decode(body: bytes, content_type: str, encoding: str):
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        if content_type == "application/msgpack":
+            if msgpack is None:
+                raise ValueError("msgpack chưa được cài")
+            return msgpack.unpackb(body)
+        return json.loads(body)
+
+    async def handle_ingest(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        self.bytes += len(body)
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if random.random() < self.not_found_rate:
+            return self._count(404)
+        if random.random() < self.error_rate:
+            return self._count(self.error_status)
+        try:
+            data = self.decode(body, request.content_type, request.headers.get("Content-Encoding", ""))
+        except (ValueError, OSError) as e:
+            self.invalid += 1
+            log.warning(f"Body không giải mã được: {e}", extra=fields(stage="ingest"))
+            return self._count(400)
+        payloads: List = data if isinstance(data, list) else [data]
+        if not payloads or not all(isinstance(payload, dict) and all(key in payload for key in REQUIRED_FIELDS)
+                                   for payload in payloads):
+            self.invalid += 1
+            return self._count(400)
+        self.payloads += len(payloads)
+        if isinstance(data, list):
+            self.batches += 1
+        if self._record is not None:
+            received = time.time()
+            topic = request.match_info["topic"]
+            for payload in payloads:
+                self._record.write(json.dumps({"received": received, "topic": topic, "payload": payload},
+                                              ensure_ascii=False) + "\n")
+        return self._count(200)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def handle_control(self, request: web.Request) -> web.Response:
+        try:
+            self.configure(**(await request.json()))
+        except (ValueError, TypeError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response({"ok": True})
+
+    def close(self):
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+
+def create_app(stub: IngestStub) -> web.Application:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get("/_stats", stub.handle_stats)
+    app.router.add_post("/_control", stub.handle_control)
+    app.router.add_post("/{topic}", stub.handle_ingest)
+    return app
+
+
+# Chạy stub trong event loop hiện tại; port=0 để chọn port trống. Trả về (runner, port)
+async def start_ingest(stub: IngestStub, host: str = INGEST_HOST, port: int = INGEST_PORT):
+    runner = web.AppRunner(create_app(stub), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    log.info("Ingest stub đang chạy", extra=fields(stage="ingest", host=host, port=port))
+    return runner, port
+
+
+async def _serve(stub: IngestStub, host: str, port: int):
+    runner, _ = await start_ingest(stub, host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        stub.close()
+        print(json.dumps(stub.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server ingest giả lập cho upload của gateway")
+    parser.add_argument("--host", default=INGEST_HOST)
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Độ trễ trả lời trung bình")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Độ trễ dao động +/-")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả lỗi --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--not-found-rate", type=float, default=0.0, help="Tỉ lệ request trả 404")
+    parser.add_argument("--record", help="Ghi payload đã nhận ra file jsonl")
+    args = parser.parse_args()
+
+    setup_logging()
+    ingest_stub = IngestStub(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                             args.not_found_rate, args.record)
+    try:
+        asyncio.run(_serve(ingest_stub, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
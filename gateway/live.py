@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from metrics import REGISTRY
+from serializer import get_serializer
+
+# Số MAC tối đa đang chờ gửi cho mỗi subscriber; vượt quá thì bỏ cập nhật cũ nhất
+LIVE_BUFFER_SIZE = int(os.getenv("LIVE_BUFFER_SIZE", "256"))
+
+LIVE_SUBSCRIBERS = REGISTRY.gauge("gateway_live_subscribers", "Số subscriber WebSocket/SSE đang kết nối",
+                                  ["transport"])
+LIVE_PUBLISHED = REGISTRY.counter("gateway_live_published_total", "Số cập nhật vị trí được phát")
+LIVE_COALESCED = REGISTRY.counter("gateway_live_coalesced_total",
+                                  "Số cập nhật bị thay thế bởi cập nhật mới hơn trước khi kịp gửi")
+LIVE_DROPPED = REGISTRY.counter("gateway_live_dropped_total", "Số cập nhật bị bỏ do buffer subscriber đầy")
+
+_serializer = get_serializer(os.getenv("LIVE_SERIALIZER", "auto"))
+
+
+# Một subscriber: buffer có giới hạn, mỗi MAC chỉ giữ cập nhật mới nhất (coalescing)
+class Subscriber:
+    def __init__(self, transport: str, macs: Optional[Iterable[str]] = None, zones: Optional[Iterable[str]] = None,
+                 capacity: int = LIVE_BUFFER_SIZE):
+        self.transport = transport
+        self.macs: Optional[Set[str]] = set(macs) if macs else None
+        self.zones: Optional[Set[str]] = set(zones) if zones else None
+        self.capacity = capacity
+        self.pending: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self.ready = asyncio.Event()
+        self.sent = 0
+
+    def wants(self, mac: str, zones: Iterable[str]) -> bool:
+        if self.macs is not None and mac not in self.macs:
+            return False
+        if self.zones is not None and self.zones.isdisjoint(zones):
+            return False
+        return True
+
+    # Gọi từ event loop khi có cập nhật; O(1), không bao giờ chờ client
+    def offer(self, mac: str, body: bytes):
+        if mac in self.pending:
+            del self.pending[mac]
+            LIVE_COALESCED.inc()
+        elif len(self.pending) >= self.capacity:
+            self.pending.popitem(last=False)
+            LIVE_DROPPED.inc()
+        self.pending[mac] = body
+        self.ready.set()
+
+    # Chờ và lấy toàn bộ cập nhật đang chờ (mỗi MAC một bản mới nhất)
+    async def next_batch(self) -> List[bytes]:
+        await self.ready.wait()
+        self.ready.clear()
+        batch = list(self.pending.values())
+        self.pending.clear()
+        self.sent += len(batch)
+        return batch
+
+
+# Phát cập nhật tới mọi subscriber: mã hóa một lần, dùng chung bytes cho mọi client
+class LiveHub:
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+
+    def subscribe(self, transport: str, macs: Optional[Iterable[str]] = None,
+                  zones: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(transport, macs, zones)
+        self.subscribers.add(subscriber)
+        LIVE_SUBSCRIBERS.inc(transport=transport)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.discard(subscriber)
+            LIVE_SUBSCRIBERS.dec(transport=subscriber.transport)
+
+    def publish(self, mac: str, update: Dict, zones: Iterable[str] = ()):
+        if not self.subscribers:
+            return
+        body = None
+        for subscriber in self.subscribers:
+            if subscriber.wants(mac, zones):
+                if body is None:
+                    body = _serializer.dumps(update)
+                    LIVE_PUBLISHED.inc()
+                subscriber.offer(mac, body)
+
+
+LIVE_HUB = LiveHub()
+
+
+# Đọc bộ lọc ?mac=a,b&zone=z1,z2 từ query string
+def parse_filters(query) -> Dict[str, Optional[List[str]]]:
+    macs = [mac.strip().upper() for mac in query["mac"].split(",") if mac.strip()] if "mac" in query else None
+    zones = [zone.strip() for zone in query["zone"].split(",") if zone.strip()] if "zone" in query else None
+    return {"macs": macs, "zones": zones}
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+# uploader đọc địa chỉ server lúc import; loadgen trỏ lại sang ingest stub sau khi import
+os.environ.setdefault("SV_URL", "http://127.0.0.1")
+os.environ.setdefault("PORT", "0")
+os.environ.setdefault("TOPIC", "loadgen")
+os.environ.setdefault("LOCAL_API_PORT", "0")
+
+from ingest import IngestStub, start_ingest
+from logger import setup_logging
+from metrics import REGISTRY
+from mqtt_stub import MqttBrokerStub, start_broker
+from serializer import sample_payloads
+
+# Metric in ra trong báo cáo
+REPORT_PREFIXES = ("gateway_upload_total", "gateway_upload_buffered", "gateway_upload_dropped_total",
+                   "gateway_upload_replayed_total", "gateway_breaker_state", "gateway_breaker_transitions_total",
+                   "gateway_queue_shed_total", "gateway_sample_age_seconds_count", "gateway_sample_age_seconds_sum",
+                   "gateway_mqtt_published_total", "gateway_mqtt_pending")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# Kịch bản mất kết nối "bắt_đầu:thời_gian" (giây), ví dụ "5:10"
+def parse_outage(value: str) -> Tuple[float, float]:
+    start, duration = value.split(":")
+    return float(start), float(duration)
+
+
+async def _outage(stub: IngestStub, start: float, duration: float, status: int):
+    await asyncio.sleep(start)
+    if status == 404:
+        stub.configure(not_found_rate=1.0)
+    else:
+        stub.configure(error_rate=1.0, error_status=status)
+    print(f"[{start:.1f}s] server trả {status}")
+    await asyncio.sleep(duration)
+    stub.configure(error_rate=0.0, not_found_rate=0.0)
+    print(f"[{start + duration:.1f}s] server hoạt động lại")
+
+
+# Chế độ direct: gửi payload thẳng qua uploader (send_to_api / send_batch_to_api), tags * rate payload mỗi giây
+async def run_direct(tags: int, rate: float, duration: float, batch: int, concurrency: int) -> Dict:
+    import uploader
+
+    templates = sample_payloads(tags)
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    sends = set()
+    late = 0
+
+    async def send(payloads: List[Dict]):
+        async with slots:
+            started = time.perf_counter()
+            if len(payloads) == 1:
+                await uploader.send_to_api(payloads[0])
+            else:
+                await uploader.send_batch_to_api(payloads)
+            latencies.append(time.perf_counter() - started)
+
+    period = 1.0 / rate
+    started = time.perf_counter()
+    ticks = int(duration * rate)
+    for tick in range(ticks):
+        payloads = [dict(template, time=time.strftime("%Y-%m-%d %H:%M:%S")) for template in templates]
+        for i in range(0, len(payloads), batch):
+            task = asyncio.create_task(send(payloads[i:i + batch]))
+            sends.add(task)
+            task.add_done_callback(sends.discard)
+        delay = started + (tick + 1) * period - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            late += 1
+    await asyncio.gather(*sends)
+    latencies.sort()
+    return {
+        "offered": ticks * tags,
+        "late_ticks": late,
+        "request_p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "request_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def _tag_macs(tags: int) -> List[str]:
+    return [f"EB:52:53:F5:{i // 256:02X}:{i % 256:02X}" for i in range(tags)]
+
+
+# Chế độ pipeline: frame mode 0 đi qua notify_callback của main.py (giải mã, hàng đợi, upload worker)
+async def run_pipeline(tags: int, rate: float, duration: float) -> Dict:
+    import main
+    import uploader
+
+    macs = _tag_macs(tags)
+    for i, mac in enumerate(macs):
+        main.module_info[mac] = {"name": f"DW{i:04X}", "type": "tag", "operation_hex": "5c20"}
+    worker = asyncio.create_task(main.upload_worker())
+    period = 1.0 / rate
+    started = time.perf_counter()
+    ticks = int(duration * rate)
+    late = 0
+    for tick in range(ticks):
+        for i, mac in enumerate(macs):
+            frame = struct.pack("<B i i i B", 0, 1000 + i * 10 + tick, 2000 + i * 10, 1100, 90)
+            main.notify_callback(0, bytearray(frame), mac)
+        delay = started + (tick + 1) * period - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            late += 1
+    # Chờ upload worker lấy nốt hàng đợi và client MQTT nhận hết ack
+    await asyncio.sleep(uploader.UPLOAD_INTERVAL + 0.5)
+    deadline = time.perf_counter() + 5
+    while main.publisher is not None and main.publisher.pending and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    worker.cancel()
+    return {"offered": ticks * tags, "late_ticks": late}
+
+
+def report_metrics() -> List[str]:
+    return [line for line in REGISTRY.render().splitlines() if line.startswith(REPORT_PREFIXES)]
+
+
+async def run(args) -> Dict:
+    import uploader
+
+    stub: Optional[IngestStub] = None
+    runner = None
+    if args.url:
+        url = args.url
+    else:
+        stub = IngestStub(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.not_found_rate,
+                          args.record)
+        runner, port = await start_ingest(stub, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{port}/loadgen"
+    uploader.API_URL = uploader.BATCH_URL = url
+
+    # Output MQTT (pipeline): publish tới broker stub trong tiến trình, cùng hoặc thay cho HTTP
+    outputs = {part.strip() for part in args.output.split(",")}
+    broker: Optional[MqttBrokerStub] = None
+    broker_server = None
+    if "mqtt" in outputs:
+        if args.mode != "pipeline":
+            raise SystemExit("--output mqtt chỉ dùng với --mode pipeline")
+        import main
+        from mqtt_output import MqttPublisher
+
+        broker = MqttBrokerStub(args.ack_delay_ms)
+        broker_server, broker_port = await start_broker(broker, "127.0.0.1", 0)
+        modules = [{"id": mac, "type": "tag"} for mac in _tag_macs(args.tags)]
+        main.publisher = MqttPublisher(modules, port=broker_port, client_id="loadgen", qos=args.qos)
+        main.publisher.start()
+        main.HTTP_OUTPUT = "http" in outputs
+
+    outage = None
+    if args.outage:
+        if stub is None:
+            raise SystemExit("--outage chỉ dùng được với ingest stub chạy trong tiến trình (không có --url)")
+        outage = asyncio.create_task(_outage(stub, *parse_outage(args.outage), args.outage_status))
+
+    started = time.perf_counter()
+    if args.mode == "pipeline":
+        result = await run_pipeline(args.tags, args.rate, args.duration)
+    else:
+        result = await run_direct(args.tags, args.rate, args.duration, args.batch, args.concurrency)
+    elapsed = time.perf_counter() - started
+    if outage is not None:
+        outage.cancel()
+
+    # Chờ buffer cục bộ được gửi lại (breaker half-open -> closed) trước khi tổng kết
+    deadline = time.perf_counter() + args.drain
+    while uploader.buffered() and time.perf_counter() < deadline:
+        await uploader.flush_buffer()
+        await asyncio.sleep(0.1)
+
+    result.update({
+        "mode": args.mode,
+        "tags": args.tags,
+        "rate": args.rate,
+        "elapsed_s": round(elapsed, 3),
+        "offered_per_s": round(result["offered"] / elapsed, 1),
+        "buffered_left": uploader.buffered(),
+    })
+    if stub is not None:
+        result["server"] = stub.stats()
+        result["delivered_ratio"] = round(stub.payloads / result["offered"], 4) if result["offered"] else 0.0
+        stub.close()
+    if runner is not None:
+        await runner.cleanup()
+    if broker is not None:
+        import main
+
+        main.publisher.stop()
+        result["broker"] = broker.stats()
+        result["mqtt_delivered_ratio"] = (round(broker.stats()["messages"] / result["offered"], 4)
+                                          if result["offered"] else 0.0)
+        broker_server.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo tải cho đường upload của gateway (dùng ingest stub)")
+    parser.add_argument("--mode", choices=["direct", "pipeline"], default="direct",
+                        help="direct: gọi uploader trực tiếp; pipeline: frame đi qua notify_callback của main.py")
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=1.0, help="Số payload mỗi tag mỗi giây")
+    parser.add_argument("--duration", type=float, default=10.0, help="Giây")
+    parser.add_argument("--batch", type=int, default=1, help="Số payload mỗi request (direct)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Số request đồng thời (direct)")
+    parser.add_argument("--output", default="http", help="http, mqtt hoặc http,mqtt (mqtt dùng broker stub)")
+    parser.add_argument("--qos", type=int, default=1, help="QoS MQTT")
+    parser.add_argument("--ack-delay-ms", type=float, default=0.0, help="Độ trễ PUBACK của broker stub")
+    parser.add_argument("--url", help="Gửi tới server này thay vì ingest stub trong tiến trình")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--outage", help="Server lỗi trong khoảng 'bắt_đầu:thời_gian' (giây), ví dụ 5:10")
+    parser.add_argument("--outage-status", type=int, default=503, help="Mã lỗi trong lúc mất kết nối (503, 404...)")
+    parser.add_argument("--drain", type=float, default=30.0, help="Giây tối đa chờ gửi lại buffer sau khi chạy")
+    parser.add_argument("--record", help="Ghi payload server nhận được ra file jsonl")
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    setup_logging()
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"{key:<16} {value}")
+        print()
+        print("\n".join(report_metrics()))
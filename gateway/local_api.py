@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from aiohttp import WSMsgType, web
+
+from live import LIVE_HUB, parse_filters
+from logger import fields, get_logger
+from metrics import REGISTRY
+from module_state import STATE_INDEX
+from serializer import get_serializer
+
+# Địa chỉ HTTP nội bộ của gateway (LOCAL_API_PORT=0 để tắt)
+LOCAL_API_HOST = os.getenv("LOCAL_API_HOST", "127.0.0.1")
+LOCAL_API_PORT = int(os.getenv("LOCAL_API_PORT", "9100"))
+
+log = get_logger("gateway.api")
+_serializer = get_serializer("auto")
+
+
+# GET /metrics: xuất metric theo định dạng text của Prometheus
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+
+def _json_response(body: bytes, status: int = 200) -> web.Response:
+    return web.Response(body=body, status=status, content_type="application/json")
+
+
+# GET /modules: trạng thái mới nhất của mọi module, lọc theo ?type=&status=&mac=a,b&since=<epoch>
+async def handle_modules(request: web.Request) -> web.Response:
+    query = request.query
+    if not query:
+        return _json_response(STATE_INDEX.encoded_all())
+    try:
+        since = float(query["since"]) if "since" in query else None
+    except ValueError:
+        return _json_response(_serializer.dumps({"error": "since phải là số (epoch giây)"}), status=400)
+    macs = [mac.strip().upper() for mac in query["mac"].split(",")] if "mac" in query else None
+    states = STATE_INDEX.query(module_type=query.get("type"), status=query.get("status"), macs=macs, since=since)
+    return _json_response(_serializer.dumps(states))
+
+
+# GET /modules/{mac}: trạng thái mới nhất của một module
+async def handle_module(request: web.Request) -> web.Response:
+    state = STATE_INDEX.get(request.match_info["mac"].upper())
+    if state is None:
+        return _json_response(b'{"error":"not found"}', status=404)
+    return _json_response(_serializer.dumps(state))
+
+
+# GET /analytics: tốc độ, hướng, dwell, vị trí làm mượt của mọi tag từ lịch sử gần đây (recent.py), ?n=<số mẫu>
+async def handle_analytics(request: web.Request) -> web.Response:
+    recent = request.app["recent"]
+    if recent is None:
+        return _json_response(b'{"error":"recent history disabled"}', status=404)
+    try:
+        n = int(request.query["n"]) if "n" in request.query else None
+    except ValueError:
+        return _json_response(_serializer.dumps({"error": "n phải là số nguyên"}), status=400)
+    if n is not None and n < 2:
+        return _json_response(_serializer.dumps({"error": "n phải >= 2"}), status=400)
+    return _json_response(_serializer.dumps(recent.analytics(n)))
+
+
+# GET /aggregates: số liệu tổng hợp của kỳ đang chạy (aggregates.py), không bắt đầu kỳ mới
+async def handle_aggregates(request: web.Request) -> web.Response:
+    aggregator = request.app["aggregator"]
+    if aggregator is None:
+        return _json_response(b'{"error":"aggregates disabled"}', status=404)
+    tags, zones = aggregator.report(time.time(), reset=False)
+    return _json_response(_serializer.dumps({"tags": tags, "zones": zones}))
+
+
+# GET /ws: WebSocket nhận vị trí trực tiếp; mỗi frame là mảng JSON các cập nhật mới nhất theo MAC
+async def handle_websocket(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    subscriber = LIVE_HUB.subscribe("websocket", **parse_filters(request.query))
+
+    async def drain_incoming():
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            subscriber.ready.set()  # đánh thức vòng gửi để phát hiện client đã đóng
+
+    reader = asyncio.create_task(drain_incoming())
+    try:
+        while True:
+            batch = await subscriber.next_batch()
+            if ws.closed or reader.done():
+                break
+            if batch:
+                await ws.send_str((b"[" + b",".join(batch) + b"]").decode("utf-8"))
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        LIVE_HUB.unsubscribe(subscriber)
+        reader.cancel()
+    return ws
+
+
+# GET /events: Server-Sent Events, mỗi sự kiện là một cập nhật vị trí
+# (client đóng kết nối được phát hiện ở lần ghi kế tiếp)
+async def handle_events(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    subscriber = LIVE_HUB.subscribe("sse", **parse_filters(request.query))
+    try:
+        while True:
+            batch = await subscriber.next_batch()
+            await response.write(b"".join(b"data: " + body + b"\n\n" for body in batch))
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        LIVE_HUB.unsubscribe(subscriber)
+    return response
+
+
+# Tạo ứng dụng HTTP nội bộ
+def create_app(recent=None, aggregator=None) -> web.Application:
+    app = web.Application()
+    app["recent"] = recent
+    app["aggregator"] = aggregator
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/modules", handle_modules)
+    app.router.add_get("/modules/{mac}", handle_module)
+    app.router.add_get("/analytics", handle_analytics)
+    app.router.add_get("/aggregates", handle_aggregates)
+    app.router.add_get("/ws", handle_websocket)
+    app.router.add_get("/events", handle_events)
+    return app
+
+
+# Khởi động HTTP server nội bộ trên event loop hiện tại
+async def start_local_api(host: str = LOCAL_API_HOST, port: int = LOCAL_API_PORT,
+                          recent=None, aggregator=None) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    runner = web.AppRunner(create_app(recent, aggregator), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    log.info("HTTP nội bộ đang chạy", extra=fields(stage="api", host=host, port=port))
+    return runner
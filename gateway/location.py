@@ -1,22 +1,30 @@
 import struct
 
+from logger import get_logger
+
+# numpy chỉ cần khi giải mã theo lô; nạp ở lần gọi đầu tiên (_load_numpy) để không làm chậm lúc khởi động
+np = None
+_numpy_checked = False
+
+log = get_logger("gateway.frame")
+
 def decode_location_data(data):
     try:
         mode = data[0]
         if mode == 0:
             if len(data) <= 13:
-                print("Invalid Type 0 data: Expected 13 bytes")
+                log.warning("Invalid Type 0 data: Expected 13 bytes")
                 return None
             return decode_location_mode_0(data)
         elif mode == 1:
-            return decode_location_mode_1(data)
+            return decode_location_mode_1(data[1:])
         elif mode == 2:
             return decode_location_mode_2(data)
         else:
-            print(f"Unknown location mode: {mode}")
+            log.warning(f"Unknown location mode: {mode}")
 
     except Exception as e:
-        print(f"Error decoding location: {e}")
+        log.warning(f"Error decoding location: {e}")
         return None
 
 
@@ -34,7 +42,7 @@ def decode_location_mode_0(data):
     }
     return result
 
-# Distances Only
+# Distances Only; data bắt đầu từ byte số lượng khoảng cách (bỏ byte mode, như data[14:] của mode 2)
 def decode_location_mode_1(data):
     result = {}
     distances = []
@@ -61,6 +69,95 @@ def decode_location_mode_2(data):
     return result
 
 
+# Giải mã Proxy Positions (anchor): 1 byte số phần tử, mỗi phần tử gồm
+# 2 bytes node ID + 13 bytes vị trí (X, Y, Z mm, quality factor)
+def decode_proxy_positions(data):
+    positions = []
+    num_elements = data[0]
+    offset = 1
+    for i in range(num_elements):
+        if offset + 15 > len(data):  # Không đủ dữ liệu cho 1 tag position
+            log.warning("Error: Incomplete data for a tag position")
+            break
+        node_id, x, y, z, quality = struct.unpack("<H i i i B", data[offset:offset + 15])
+        offset += 15
+        positions.append({
+            "Node ID": node_id,
+            "Position": {
+                "X": x / 1000,  # mm -> m
+                "Y": y / 1000,
+                "Z": z / 1000,
+                "Quality Factor": quality
+            }
+        })
+    return positions
+
+
+# Bố cục frame mode 0 (14 bytes) để giải mã cả lô bằng numpy
+_MODE_0_DTYPE = None
+
+
+# Nạp numpy một lần; False nếu không cài
+def _load_numpy() -> bool:
+    global np, _numpy_checked, _MODE_0_DTYPE
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+        _MODE_0_DTYPE = np.dtype([("mode", "u1"), ("x", "<i4"), ("y", "<i4"), ("z", "<i4"), ("quality", "u1")])
+    return np is not None
+
+
+# Giải mã một lô frame notify, cùng kết quả như giải mã từng frame (kể cả "no_data" / "invalid_data").
+# Các frame mode 0 được giải mã một lần bằng numpy; các mode khác giải mã từng frame.
+def decode_location_batch(frames):
+    results = [None] * len(frames)
+    mode_0 = []
+    vectorized = _load_numpy()
+    for i, data in enumerate(frames):
+        if not data:
+            results[i] = "no_data"
+            continue
+        mode = data[0]
+        try:
+            if mode == 0 and len(data) == 14:
+                if vectorized:
+                    mode_0.append(i)
+                else:
+                    results[i] = decode_location_mode_0(data)
+            elif mode == 1:
+                results[i] = decode_location_mode_1(data[1:])
+            elif mode == 2 and len(data) >= 14:
+                results[i] = decode_location_mode_2(data)
+            else:
+                results[i] = "invalid_data"
+        except (struct.error, IndexError, ValueError):
+            results[i] = "invalid_data"
+    if mode_0:
+        records = np.frombuffer(b"".join(frames[i] for i in mode_0), dtype=_MODE_0_DTYPE)
+        xyz = (np.stack([records["x"], records["y"], records["z"]], axis=1) / 1000).tolist()
+        for i, (x, y, z), quality in zip(mode_0, xyz, records["quality"].tolist()):
+            results[i] = {"Position": {"X": x, "Y": y, "Z": z, "Quality Factor": quality}}
+    return results
+
+
+if __name__ == "__main__":
+    # Frame thật từ tag (mode 2: vị trí + 4 khoảng cách); frame mode 1 tương ứng chỉ gồm byte mode và phần khoảng cách
+    mode_2 = bytes(b'\x02\xc3\x02\x00\x00\x1e\x02\x00\x00i\x04\x00\x008\x04\x0f\xd4\x0e\t\x00\x00d\x9a\xd2y\x06'
+                   b'\x00\x00d\x11\xc5-\x08\x00\x00d\x0e\xc6\xed\x08\x00\x00d')
+    mode_1 = b"\x01" + mode_2[14:]
+    expected = [(0xD40F, 2.318), (0xD29A, 1.657), (0xC511, 2.093), (0xC60E, 2.285)]
+    for frame in (mode_1, mode_2):
+        decoded = decode_location_data(frame)
+        assert [(d["Node ID"], d["Distance"]) for d in decoded["Distances"]] == expected, decoded
+        assert decode_location_batch([frame]) == [decoded]
+    assert decode_location_data(mode_2)["Position"] == {"X": 0.707, "Y": 0.542, "Z": 1.129, "Quality Factor": 56}
+    print("mode 1:", decode_location_data(mode_1))
+    print("mode 2:", decode_location_data(mode_2))
+
 
 # data = bytearray(b'\x02\xc3\x02\x00\x00\x1e\x02\x00\x00i\x04\x00\x008\x04\x0f')
 # data_1 =  bytearray(b'\x02\xc3\x02\x00\x00\x1e\x02\x00\x00i\x04\x00\x008\x04\x0f\xd4\x0e\t\x00\x00d\x9a\xd2y\x06\x00\x00d\x11\xc5-\x08\x00\x00d\x0e\xc6\xed\x08\x00\x00d')
@@ -0,0 +1,127 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional
+
+# Cấu hình qua biến môi trường
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Giới hạn log theo từng frame: tối đa FRAME_LOG_RATE bản ghi/giây cho mỗi MAC,
+# và chỉ giữ 1 trên FRAME_LOG_SAMPLE bản ghi
+FRAME_LOG_RATE = float(os.getenv("FRAME_LOG_RATE", "1"))
+FRAME_LOG_SAMPLE = int(os.getenv("FRAME_LOG_SAMPLE", "1"))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+# Tạo dict "extra" chứa các trường có cấu trúc (mac, module, stage, latency...)
+def fields(**kwargs) -> Dict:
+    return {"fields": kwargs}
+
+
+# Lấy logger của gateway
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+# Định dạng log: dòng text "key=value" hoặc một object JSON mỗi dòng
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.json_output = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        extra = getattr(record, "fields", None) or {}
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        if self.json_output:
+            entry = {"time": f"{created}.{int(record.msecs):03d}", "level": record.levelname,
+                     "logger": record.name, "msg": record.getMessage()}
+            entry.update(extra)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        line = f"{created}.{int(record.msecs):03d} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+# QueueHandler không định dạng trong luồng gọi và không bao giờ chặn:
+# việc format + ghi stdout do luồng của QueueListener đảm nhận, queue đầy thì bỏ bản ghi
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Bộ lọc lấy mẫu + giới hạn tốc độ theo khóa (mặc định theo trường "mac")
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float = 1.0, sample_every: int = 1, key: str = "mac"):
+        super().__init__()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.sample_every = max(1, sample_every)
+        self.key = key
+        self._state: Dict[object, list] = {}  # key -> [số bản ghi đã thấy, lần ghi cuối, số bị bỏ]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (getattr(record, "fields", None) or {}).get(self.key)
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = [0, 0.0, 0]
+        state[0] += 1
+        now = record.created
+        if state[0] % self.sample_every or now - state[1] < self.interval:
+            state[2] += 1
+            return False
+        if state[2]:
+            record.fields = dict(record.fields, suppressed=state[2])
+            state[2] = 0
+        state[1] = now
+        return True
+
+
+# Khởi tạo logging: mọi bản ghi đi qua queue, một luồng nền ghi ra stdout
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> logging.handlers.QueueListener:
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(fmt))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.handlers[:] = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    # Log theo từng frame BLE (rất nhiều) được lấy mẫu và giới hạn tốc độ
+    logging.getLogger("gateway.frame").addFilter(RateLimitFilter(FRAME_LOG_RATE, FRAME_LOG_SAMPLE))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+# Dừng luồng ghi log, xả hết các bản ghi còn trong queue
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,39 +1,77 @@
+import startup  # mốc thời gian khởi động: import trước mọi module khác
+
+import argparse
 import asyncio
+import importlib
 import json
+import logging
+import os
 import time
-from typing import Dict, List, Any
-from xml.etree.ElementTree import indent
+from typing import Dict, List, Any, Optional
 
-import aiohttp
+from aggregates import AGGREGATE_INTERVAL, RAW_STREAM, open_aggregator
 from bleak import BleakScanner, BleakClient
 from bleak.exc import BleakError
+from capture import open_capture
+from compression import open_compression
 from datetime import datetime
-from global_var import *
-from location import *
-from dotenv import load_dotenv
-import os
+from gating import GATE_MODE, open_position_gate
+from location import decode_location_mode_0, decode_location_mode_1, decode_location_mode_2
+from history import open_history
+from live import LIVE_HUB
+from logger import fields, get_logger, setup_logging
+from metrics import (CONNECT_TOTAL, CONNECTED, DECODE_ERRORS, DECODE_SECONDS, DISCONNECT_TOTAL, NOTIFY_TOTAL,
+                     RECONNECT_TOTAL, SAMPLE_AGE_SECONDS, SCAN_DEVICES, SCAN_MODULES, SCAN_SECONDS, SLOT_WAIT_SECONDS)
+from module_state import STATE_INDEX
+from mqtt_output import HTTP_OUTPUT, open_mqtt
+from offload import DecodeOffload, close_offload, open_offload
+from opmode import node_type
+from payload import build_event_payload, build_payload
+from profiler import run_profiled, timed
+from proximity import open_proximity_engine
+from queues import (EVENT_QUEUE_POLICY, EVENT_QUEUE_SIZE, HIGH, NORMAL, SAMPLE_QUEUE_POLICY, SAMPLE_QUEUE_SIZE,
+                    TRACK_QUEUE_POLICY, TRACK_QUEUE_SIZE, ShedQueue)
+from sharding import SHARDING, Coordinator
+from zones import ZONE_EVENTS_ONLY, open_zone_engine
 
 import pytz
 
 
-load_dotenv()
-sv_url = os.getenv("SV_URL") + ":" + os.getenv("PORT") + "/" + os.getenv("TOPIC")
 # UUID của BLE service và characteristic
 NETWORK_NODE_SERVICE_UUID = "680c21d9-c946-4c1f-9c11-baa1c21329e7"
 LABEL_CHAR_UUID = "00002a00-0000-1000-8000-00805f9b34fb"
 OPERATION_MODE_CHAR_UUID = "3f0afd88-7770-46b0-b5e7-9fc099598964"
 LOCATION_DATA_CHAR_UUID = "003bbdf2-c634-4b3d-ab56-7ec889b89a37"
 
-# Địa chỉ API endpoint
-API_URL = sv_url
-
-# Danh sách lưu trữ dữ liệu từ notify của các tag
-tag_data_storage = {}
+# Hàng đợi có giới hạn giữa xử lý và upload (queues.py): mẫu thô theo tag, mẫu đã nén, sự kiện / trạng thái anchor
+sample_queue = ShedQueue("samples", SAMPLE_QUEUE_SIZE, SAMPLE_QUEUE_POLICY)
+track_queue = ShedQueue("track", TRACK_QUEUE_SIZE, TRACK_QUEUE_POLICY)
+event_queue = ShedQueue("events", EVENT_QUEUE_SIZE, EVENT_QUEUE_POLICY)
 module_info = {}  # Thêm dictionary để lưu thông tin tĩnh
+history = None  # Kho lịch sử mẫu vị trí/khoảng cách (history.py), mở trong main()
+zone_engine = None  # Bộ máy sự kiện zone (zones.py), nạp từ zones.json trong main()
+proximity_engine = None  # Phát hiện tag ở gần nhau (proximity.py), nạp từ proximity.json trong main()
+compression = None  # Nén quỹ đạo trước khi gửi (compression.py), bật bằng COMPRESSION=1
+gate = None  # Bộ lọc vị trí không hợp lệ (gating.py), nạp từ gating.json trong main()
+decode_offload = None  # Giải mã theo lô trong thread/process pool (offload.py), bật bằng OFFLOAD
+capture = None  # Gom notify vào ring buffer theo tag, giải mã theo lô (capture.py), bật bằng CAPTURE=1
+recent = None  # Lịch sử gần đây theo tag trong ring buffer numpy (recent.py), tắt bằng RECENT=0
+aggregator = None  # Tổng hợp quãng đường, thời gian di chuyển, zone (aggregates.py), bật bằng AGGREGATES=1
+publisher = None  # Publish lên MQTT broker (mqtt_output.py), bật bằng OUTPUT=mqtt hoặc OUTPUT=http,mqtt
+
+TIMEZONE = pytz.timezone('Asia/Ho_Chi_Minh')
+_time_cache = [0, ""]  # [giây, chuỗi thời gian đã định dạng]
 
 # Giới hạn số lượng kết nối đồng thời
 MAX_CONCURRENT_CONNECTIONS = 2
+SCAN_TIMEOUT = float(os.getenv("SCAN_TIMEOUT", "10"))  # quét tối đa; dừng sớm khi đã thấy đủ module
+MODULE_CACHE_FILE = os.getenv("MODULE_CACHE_FILE", "module-cache.json")  # label / operation mode đọc lần trước
+SHUTDOWN_FLUSH_TIMEOUT = float(os.getenv("SHUTDOWN_FLUSH_TIMEOUT", "5"))  # giây chờ gửi nốt các hàng đợi khi dừng
 semaphore = asyncio.Semaphore(MAX_CONCURRENT_CONNECTIONS)
+upload_stop = asyncio.Event()  # báo upload_worker gửi nốt các hàng đợi rồi dừng
+
+log = get_logger("gateway.main")
+frame_log = get_logger("gateway.frame")  # log theo từng frame, được lấy mẫu/giới hạn tốc độ
 
 
 # Hàm tải danh sách module từ file module.json
@@ -42,18 +80,39 @@ def load_modules() -> List[Dict]:
         with open("module.json", "r") as f:
             return json.load(f)
     except FileNotFoundError:
-        print("Không tìm thấy file module.json. Bắt đầu với danh sách rỗng.")
+        log.warning("Không tìm thấy file module.json. Bắt đầu với danh sách rỗng.")
         return []
     except json.JSONDecodeError:
-        print("Lỗi khi giải mã file module.json.")
+        log.error("Lỗi khi giải mã file module.json.")
         return []
 
 
-# Giải mã operation mode để xác định loại thiết bị
-def decode_operation_mode(op_mode: bytes) -> str:
-    first_byte = op_mode[0]
-    tag_or_anchor_bit = (first_byte >> 7) & 0x01
-    return "anchor" if tag_or_anchor_bit == 1 else "tag"
+# Thời gian hiện tại (hoặc ts, giây epoch) giờ Việt Nam dạng chuỗi; chuỗi chỉ đổi mỗi giây nên chỉ định dạng lại
+# khi sang giây mới
+def current_time_string(ts: Optional[float] = None) -> str:
+    now = int(time.time() if ts is None else ts)
+    if now != _time_cache[0]:
+        _time_cache[0] = now
+        _time_cache[1] = datetime.fromtimestamp(now, TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    return _time_cache[1]
+
+
+# Thông tin tĩnh (label, loại, operation mode) đã đọc ở lần chạy trước, để tag gửi được vị trí ngay khi kết nối
+def load_module_cache() -> Dict[str, Dict]:
+    try:
+        with open(MODULE_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_module_cache():
+    known = {mac: info for mac, info in module_info.items() if info["type"] != "unknown"}
+    try:
+        with open(MODULE_CACHE_FILE, "w") as f:
+            json.dump(known, f, indent=4, ensure_ascii=False)
+    except OSError as e:
+        log.warning(f"Không ghi được {MODULE_CACHE_FILE}: {e}", extra=fields(stage="startup"))
 
 
 # Chuyển dữ liệu bytes thành chuỗi hex
@@ -69,77 +128,236 @@ def process_location_data(data: bytes):
     if mode == 0 and len(data) == 14:
         return decode_location_mode_0(data)
     elif mode == 1:
-        return decode_location_mode_1(data)
+        return decode_location_mode_1(data[1:])
     elif mode == 2 and len(data) >= 14:
         return decode_location_mode_2(data)
     else:
-        print(f"Định dạng dữ liệu không mong đợi: {bytes_to_hex(data)}")
+        DECODE_ERRORS.inc()
+        frame_log.warning("Định dạng dữ liệu không mong đợi", extra=fields(stage="decode", raw=bytes_to_hex(data)))
         return "invalid_data"
 
 
-# Gửi dữ liệu lên server qua API với kiểm tra lỗi chi tiết
-async def send_to_api(payload: json):
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(API_URL, json=payload) as response:
-                if response.status == 200:
-                    print(f"Gửi dữ liệu thành công cho {payload['name']}")
-                else:
-                    print(f"Gửi dữ liệu thất bại cho {payload['name']}: Mã lỗi {response.status}")
-                    if response.status == 404:
-                        print("Endpoint không tồn tại. Vui lòng kiểm tra cấu hình server.")
-        except aiohttp.ClientError as e:
-            print(f"Lỗi khi gửi dữ liệu tới API: {e}")
-
-
 # Callback xử lý dữ liệu từ notify
 def notify_callback(sender: int, data: bytearray, mac: str):
+    if frame_log.isEnabledFor(logging.DEBUG):
+        frame_log.debug("Nhận frame", extra=fields(mac=mac, stage="notify", raw=data.hex()))
+    NOTIFY_TOTAL.inc(mac=mac)
+    received = time.perf_counter()
+    if capture is not None:
+        capture.append(mac, data, received)
+        return
+    if decode_offload is not None:
+        decode_offload.submit(mac, data, received)
+        return
     location = process_location_data(data)
-    tz = pytz.timezone('Asia/Ho_Chi_Minh')
-    current_time = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
+    DECODE_SECONDS.observe(time.perf_counter() - received, mode=data[0] if data else "")
+    handle_location(mac, location, received)
+
+
+# Nhận kết quả giải mã theo lô từ pool (offload.py) hoặc lớp capture (capture.py)
+def on_offloaded(mac: str, data: bytes, location, received: float):
+    if location == "invalid_data":
+        DECODE_ERRORS.inc()
+        frame_log.warning("Định dạng dữ liệu không mong đợi", extra=fields(stage="decode", raw=bytes_to_hex(data)))
+    handle_location(mac, location, received)
+
 
-    tag_data_storage[mac] = {
+# Xử lý vị trí đã giải mã: lọc, nén, cập nhật trạng thái, zone, proximity, live, lịch sử.
+# received: time.perf_counter() lúc nhận notify; mọi bước dùng thời điểm nhận frame chứ không phải lúc xử lý,
+# vì frame đi qua capture / offload được xử lý theo lô, cùng một lúc
+def handle_location(mac: str, location, received: float):
+    seen = time.time() - (time.perf_counter() - received)
+    current_time = current_time_string(seen)
+
+    sample = {
         "location": location,
-        "time": current_time
+        "time": current_time,
+        "received": received
     }
+    startup.mark("first_position")
+    send_raw = raw_stream()
+    if gate is not None and isinstance(location, dict) and "Position" in location:
+        position = location["Position"]
+        reason = gate.check(mac, position["X"], position["Y"], position["Z"], position["Quality Factor"], seen)
+        if reason is not None:
+            if GATE_MODE == "drop":
+                return
+            # Chế độ flag: vẫn gửi lên server kèm lý do, nhưng không đưa vào bảng trạng thái, zone, lịch sử
+            location["Gate"] = reason
+            if send_raw:
+                sample_queue.put((mac, sample), key=mac)
+            return
+    if compression is not None and isinstance(location, dict) and "Position" in location:
+        # Chỉ giữ các mẫu cần thiết để dựng lại quỹ đạo trong sai số cho phép
+        position = location["Position"]
+        kept = compression.offer(mac, seen, (position["X"], position["Y"], position["Z"]), sample)
+        if send_raw:
+            for data in kept:
+                track_queue.put((mac, data))
+    elif send_raw:
+        sample_queue.put((mac, sample), key=mac)
+    state = STATE_INDEX.update_location(mac, location, seen)
+    zones = ()
+    if isinstance(location, dict) and "Position" in location:
+        position = location["Position"]
+        info = module_info.get(mac)
+        if recent is not None:
+            recent.append(mac, seen, position["X"], position["Y"], position["Z"], position["Quality Factor"])
+        if zone_engine is not None:
+            for event in zone_engine.update(mac, position["X"], position["Y"], position["Z"], seen):
+                queue_event(mac, info, event, location, current_time, NORMAL)
+            zones = zone_engine.zones_of(mac)
+        if proximity_engine is not None:
+            # Cảnh báo tiếp cận được ưu tiên khi hàng đợi sự kiện đầy
+            for event in proximity_engine.update(mac, position["X"], position["Y"], position["Z"], seen):
+                queue_event(mac, info, event, location, current_time, HIGH)
+        if aggregator is not None:
+            aggregator.update(mac, seen, position["X"], position["Y"], position["Z"], zones, location)
+    LIVE_HUB.publish(mac, state, zones)
+    if history is not None:
+        history.record(mac, seen, location)
+
+
+# Có gửi vị trí thô (từng mẫu / mẫu đã nén) lên server không
+def raw_stream() -> bool:
+    return RAW_STREAM and not (ZONE_EVENTS_ONLY and zone_engine is not None)
+
+
+# Đưa các mẫu bộ nén còn giữ lại vào hàng đợi gửi: [(mac, mẫu)]
+def queue_flushed(flushed: List):
+    if raw_stream():
+        for mac, data in flushed:
+            track_queue.put((mac, data))
+
+
+# Tag mất kết nối: gửi các mẫu bộ nén còn giữ lại của tag, không chờ mẫu kế tiếp
+def flush_track(mac: str):
+    if compression is not None:
+        queue_flushed([(mac, data) for data in compression.flush(mac)])
+
+
+def queue_event(mac: str, info, event: Dict, location, event_time: str, priority: int):
+    if info is None:
+        return
+    event_queue.put(build_event_payload(info["name"], mac, info["type"], event, location, event_time),
+                    priority=priority)
+
+
+def _sample_payload(mac: str, data: Dict):
+    info = module_info.get(mac)
+    if info is None:
+        return None
+    return build_payload(info["name"], mac, info["type"], info["operation_hex"], data["location"], "active",
+                         data["time"])
+
+
+async def _send_chunks(payloads: List[Dict]):
+    from uploader import UPLOAD_FLUSH_BATCH, send_batch_to_api, send_to_api
+
+    if publisher is not None:
+        publisher.publish_many(payloads)
+    if not HTTP_OUTPUT:
+        return
+    for i in range(0, len(payloads), UPLOAD_FLUSH_BATCH):
+        chunk = payloads[i:i + UPLOAD_FLUSH_BATCH]
+        if len(chunk) == 1:
+            await send_to_api(chunk[0])
+        else:
+            await send_batch_to_api(chunk)
+
 
+# Task upload duy nhất: mỗi UPLOAD_INTERVAL lấy hết các hàng đợi (sự kiện / anchor trước, rồi mẫu) và gửi.
+# Khi server chậm, lần lấy sau đến muộn hơn và các hàng đợi bỏ mẫu theo chính sách thay vì tăng bộ nhớ.
+# Khi upload_stop được đặt: gửi nốt các hàng đợi một lần rồi dừng
+@timed("upload_worker")
+async def upload_worker():
+    from uploader import UPLOAD_CONCURRENCY, UPLOAD_INTERVAL, send_to_api
+
+    slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def send_sample(payload: Dict, received: float):
+        if publisher is not None:
+            publisher.publish(payload)
+        if HTTP_OUTPUT:
+            async with slots:
+                await send_to_api(payload)
+        SAMPLE_AGE_SECONDS.observe(time.perf_counter() - received)
 
-# Task gửi dữ liệu lên server mỗi giây
-async def send_tag_data_periodically(mac: str, name: str):
     while True:
-        if mac in tag_data_storage and mac in module_info:
-            data = tag_data_storage[mac]
-            payload = {
-                "name": module_info[mac]["name"],
-                "id": mac,
-                "type": module_info[mac]["type"],
-                "operation": module_info[mac]["operation_hex"],
-                "location": data["location"],
-                "status": "active",
-                "time": data["time"]
-            }
-            print(payload)
-            json.dump(payload)
-            await send_to_api(payload)
-            del tag_data_storage[mac]
-        await asyncio.sleep(1)
+        started = time.perf_counter()
+        if compression is not None:
+            # Tag im lặng quá COMPRESS_MAX_SILENCE: gửi mẫu bộ nén còn giữ lại
+            queue_flushed(compression.flush_idle(time.time()))
+        await _send_chunks(event_queue.drain())
+        sends = []
+        for mac, data in sample_queue.drain():
+            payload = _sample_payload(mac, data)
+            if payload is not None:
+                sends.append(send_sample(payload, data["received"]))
+        await asyncio.gather(*sends)
+        samples = track_queue.drain()
+        payloads = [payload for payload in (_sample_payload(mac, data) for mac, data in samples) if payload]
+        if payloads:
+            await _send_chunks(payloads)
+            now = time.perf_counter()
+            for _, data in samples:
+                SAMPLE_AGE_SECONDS.observe(now - data["received"])
+        if upload_stop.is_set():
+            return
+        try:
+            await asyncio.wait_for(upload_stop.wait(), max(0.0, UPLOAD_INTERVAL - (time.perf_counter() - started)))
+        except asyncio.TimeoutError:
+            pass
+
+
+# Mỗi AGGREGATE_INTERVAL gửi số liệu tổng hợp của kỳ: một payload "aggregate" cho mỗi tag thấy trong kỳ
+# và một payload "occupancy" cho mỗi zone (type "zone", id là tên zone), gửi theo lô như các hàng đợi
+async def aggregate_worker():
+    while True:
+        await asyncio.sleep(AGGREGATE_INTERVAL)
+        tags, zones = aggregator.report(time.time())
+        current_time = current_time_string()
+        payloads = []
+        for mac, data in tags.items():
+            info = module_info.get(mac)
+            if info is None:
+                continue
+            location = data.pop("location")
+            payloads.append(build_event_payload(info["name"], mac, info["type"], dict(data, event="aggregate"),
+                                                location, current_time))
+        for zone, data in zones.items():
+            payloads.append(build_event_payload(zone, zone, "zone", dict(data, event="occupancy"), None,
+                                                current_time))
+        if payloads:
+            await _send_chunks(payloads)
 
 
 # Xử lý kết nối và notify cho tag với semaphore
+@timed("handle_tag")
 async def handle_tag(module: Dict):
+    wait_started = time.perf_counter()
     async with semaphore:
+        SLOT_WAIT_SECONDS.observe(time.perf_counter() - wait_started, module="tag")
         mac = module["id"]
         name = module["name"]
-        print(f"Đang kết nối tới tag {name} ({mac})...")
+        log.info(f"Đang kết nối tới tag {name}", extra=fields(mac=mac, module="tag", stage="connect"))
         try:
             client = BleakClient(mac)
             await client.connect()
-            print(f"Đã kết nối tới tag {name}")
+            CONNECT_TOTAL.inc(module="tag", result="ok")
+            CONNECTED.inc(module="tag")
+            log.info(f"Đã kết nối tới tag {name}", extra=fields(mac=mac, module="tag", stage="connect"))
+            startup.mark("connected")
+
+            # Đã có thông tin từ cache: bật notify ngay, label / operation mode đọc lại ngay sau đó
+            cached = module_info.get(mac)
+            if cached is not None:
+                await client.start_notify(LOCATION_DATA_CHAR_UUID, lambda sender, data: notify_callback(sender, data, mac))
 
             # Đọc label và operation_mode sau khi kết nối
             label = await client.read_gatt_char(LABEL_CHAR_UUID)
             operation_mode = await client.read_gatt_char(OPERATION_MODE_CHAR_UUID)
-            decoded_type = decode_operation_mode(operation_mode)
+            decoded_type = node_type(operation_mode)
             operation_hex = bytes_to_hex(operation_mode)
             name = label.decode("utf-8", errors="ignore") if label else module["name"]
 
@@ -149,34 +367,73 @@ async def handle_tag(module: Dict):
                 "type": decoded_type,
                 "operation_hex": operation_hex
             }
+            STATE_INDEX.update_info(mac, name, decoded_type, operation_hex, "active")
+            if module_info[mac] != cached:
+                save_module_cache()
 
-            await client.start_notify(LOCATION_DATA_CHAR_UUID, lambda sender, data: notify_callback(sender, data, mac))
-            send_task = asyncio.create_task(send_tag_data_periodically(mac, name))
+            if cached is None:
+                await client.start_notify(LOCATION_DATA_CHAR_UUID, lambda sender, data: notify_callback(sender, data, mac))
             while True:
                 await asyncio.sleep(1)
                 if not client.is_connected:
-                    print(f"Kết nối với tag {name} đã bị ngắt")
+                    DISCONNECT_TOTAL.inc(mac=mac)
+                    STATE_INDEX.update_info(mac, status="disconnected")
+                    CONNECTED.dec(module="tag")
+                    log.warning(f"Kết nối với tag {name} đã bị ngắt", extra=fields(mac=mac, module="tag", stage="disconnect"))
+                    flush_track(mac)
                     break
-            send_task.cancel()
         except BleakError as e:
-            print(f"Lỗi BLE với tag {name}: {e}")
+            CONNECT_TOTAL.inc(module="tag", result="error")
+            log.error(f"Lỗi BLE với tag {name}: {e}", extra=fields(mac=mac, module="tag", stage="connect"))
             module_info[mac] = {
                 "name": module["name"],
                 "type": "unknown",
                 "operation_hex": "unknown"
             }
         except Exception as e:
-            print(f"Lỗi không mong đợi với tag {name}: {e}")
+            log.exception(f"Lỗi không mong đợi với tag {name}: {e}", extra=fields(mac=mac, module="tag"))
         finally:
             await asyncio.sleep(0.5)  # Thêm độ trễ sau khi kết nối
 
 
+# Xử lý dữ liệu đã đọc từ anchor và gửi payload với status "active"
+async def report_anchor(mac: str, name: str, operation_mode: bytes, location_data: bytes):
+    decoded_type = node_type(operation_mode)
+    operation_hex = bytes_to_hex(operation_mode)
+    location_hex = process_location_data(location_data)
+
+    current_time = current_time_string()
+
+    seen = time.time()
+    STATE_INDEX.update_info(mac, name, decoded_type, operation_hex, "active")
+    if gate is not None and isinstance(location_hex, dict) and "Position" in location_hex:
+        position = location_hex["Position"]
+        gate.set_anchor(mac, position["X"], position["Y"], position["Z"])
+    LIVE_HUB.publish(mac, STATE_INDEX.update_location(mac, location_hex, seen))
+    if history is not None:
+        history.record(mac, seen, location_hex)
+
+    payload = build_payload(name, mac, decoded_type, operation_hex, location_hex, "active", current_time)
+    event_queue.put(payload, priority=HIGH)
+
+
+# Gửi payload với status "disable" cho anchor không kết nối / đọc được
+async def report_anchor_disabled(mac: str, name: str):
+    current_time = current_time_string()
+    payload = build_payload(name, mac, "unknown", "unknown", "unknown", "disable", current_time)
+    STATE_INDEX.update_info(mac, name, status="disable")
+    event_queue.put(payload, priority=HIGH)
+
+
 # Xử lý module anchor (đọc dữ liệu một lần) với semaphore
+@timed("handle_anchor")
 async def handle_anchor(module: Dict):
+    wait_started = time.perf_counter()
     async with semaphore:  # Giả sử semaphore đã được định nghĩa ở ngoài
+        SLOT_WAIT_SECONDS.observe(time.perf_counter() - wait_started, module="anchor")
         mac = module["id"]
         name = module["name"]
-        print(f"Đang kết nối tới anchor {name} ({mac})...")
+        log.info(f"Đang kết nối tới anchor {name}", extra=fields(mac=mac, module="anchor", stage="connect"))
 
         # Thiết lập số lần thử kết nối
         retry_count = 5
@@ -187,29 +444,21 @@ async def handle_anchor(module: Dict):
             try:
                 client = BleakClient(mac)
                 await client.connect()
-                print(f"Đã kết nối tới anchor {name} sau {3 - retry_count + 1} lần thử")
+                CONNECT_TOTAL.inc(module="anchor", result="ok")
+                log.info(f"Đã kết nối tới anchor {name}", extra=fields(mac=mac, module="anchor", stage="connect", attempt=6 - retry_count))
                 break  # Thoát vòng lặp nếu kết nối thành công
             except BleakError as e:
-                print(f"Lỗi kết nối tới anchor {name}: {e}")
+                log.warning(f"Lỗi kết nối tới anchor {name}: {e}", extra=fields(mac=mac, module="anchor", stage="connect"))
+                CONNECT_TOTAL.inc(module="anchor", result="error")
                 retry_count -= 1
                 if retry_count > 0:
-                    print(f"Thử lại sau 3 giây... ({retry_count} lần thử còn lại)")
+                    RECONNECT_TOTAL.inc(mac=mac)
+                    log.info("Thử lại sau 3 giây", extra=fields(mac=mac, module="anchor", stage="connect", retries_left=retry_count))
                     await asyncio.sleep(3)
                 else:
-                    print(f"Không thể kết nối tới anchor {name} sau 3 lần thử")
+                    log.error(f"Không thể kết nối tới anchor {name}", extra=fields(mac=mac, module="anchor", stage="connect"))
                     # Gửi payload với status "disable" nếu hết lượt thử
-                    tz = pytz.timezone('Asia/Ho_Chi_Minh')
-                    current_time = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-                    payload = {
-                        "name": name,
-                        "id": mac,
-                        "type": "unknown",
-                        "operation": "unknown",
-                        "location": "unknown",
-                        "status": "disable",
-                        "time": current_time
-                    }
-                    await send_to_api(payload)  # Giả sử hàm này đã được định nghĩa
+                    await report_anchor_disabled(mac, name)
                     return
 
         # Nếu kết nối thành công, đọc dữ liệu và xử lý
@@ -218,77 +467,219 @@ async def handle_anchor(module: Dict):
                 label = await client.read_gatt_char(LABEL_CHAR_UUID)  # UUID giả định
                 operation_mode = await client.read_gatt_char(OPERATION_MODE_CHAR_UUID)
                 location_data = await client.read_gatt_char(LOCATION_DATA_CHAR_UUID)
-
-                decoded_type = decode_operation_mode(operation_mode)  # Giả sử hàm này đã định nghĩa
-                operation_hex = bytes_to_hex(operation_mode)  # Giả sử hàm này đã định nghĩa
-                location_hex = process_location_data(location_data)  # Giả sử hàm này đã định nghĩa
-
-                tz = pytz.timezone('Asia/Ho_Chi_Minh')
-                current_time = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
                 name = label.decode("utf-8", errors="ignore") if label else name
-
-                # Tạo payload với status "active"
-                payload = {
-                    "name": name,
-                    "id": mac,
-                    "type": decoded_type,
-                    "operation": operation_hex,
-                    "location": location_hex,
-                    "status": "active",
-                    "time": current_time
-                }
-                await send_to_api(payload)
+                await report_anchor(mac, name, operation_mode, location_data)
 
             except BleakError as e:
-                print(f"Lỗi BLE khi đọc dữ liệu từ anchor {name}: {e}")
+                log.error(f"Lỗi BLE khi đọc dữ liệu từ anchor {name}: {e}", extra=fields(mac=mac, module="anchor", stage="read"))
                 # Gửi payload với status "disable" nếu đọc dữ liệu thất bại
-                tz = pytz.timezone('Asia/Ho_Chi_Minh')
-                current_time = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-                payload = {
-                    "name": name,
-                    "id": mac,
-                    "type": "unknown",
-                    "operation": "unknown",
-                    "location": "unknown",
-                    "status": "disable",
-                    "time": current_time
-                }
-                await send_to_api(payload)
+                await report_anchor_disabled(mac, name)
 
             finally:
                 # Ngắt kết nối sau khi hoàn tất
                 await client.disconnect()
                 await asyncio.sleep(3)
 
-# Quét và kết nối tới các module
-async def scan_and_connect():
-    print("Đang quét các thiết bị BLE...")
-    devices = await BleakScanner.discover(timeout=10.0)
-    managed_modules = load_modules()
+# Ngưỡng tiếp cận / giới hạn tốc độ theo loại: dùng trường "kind" trong module.json (mặc định là "type")
+def apply_kinds(managed_modules: List[Dict]):
+    kinds = {module["id"]: module.get("kind", module["type"]) for module in managed_modules}
+    if proximity_engine is not None:
+        proximity_engine.set_kinds(kinds)
+    if gate is not None:
+        gate.set_kinds(kinds)
+
+
+# Quét BLE tới khi thấy đủ các module active trong module.json (tối đa SCAN_TIMEOUT giây)
+# thay vì luôn chờ hết thời gian quét; trả về các MAC (chữ hoa) đã thấy
+async def discover_modules(managed_modules: List[Dict], timeout: float = SCAN_TIMEOUT) -> set:
+    log.info("Đang quét các thiết bị BLE...", extra=fields(stage="scan"))
+    remaining = {module["id"].upper() for module in managed_modules if module["status"] != "disable"}
+    seen = set()
+    complete = asyncio.Event()
+
+    def on_detect(device, advertisement_data):
+        address = device.address.upper()
+        seen.add(address)
+        remaining.discard(address)
+        if not remaining:
+            complete.set()
+
+    with SCAN_SECONDS.time():
+        async with BleakScanner(detection_callback=on_detect):
+            try:
+                await asyncio.wait_for(complete.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    SCAN_DEVICES.set(len(seen))
+    startup.mark("scan")
+    return seen
+
+
+# Kết nối tới các module đã tìm thấy
+async def scan_and_connect(managed_modules: List[Dict], scanning: "asyncio.Task"):
+    devices = await scanning
+    apply_kinds(managed_modules)
+    scan_result = {"found": 0, "missing": 0, "disabled": 0}
     tasks = []
     for module in managed_modules:
         if module["status"] == "disable":
-            print(f"Bỏ qua module bị vô hiệu hóa: {module['name']} ({module['id']})")
+            scan_result["disabled"] += 1
+            log.info(f"Bỏ qua module bị vô hiệu hóa: {module['name']}", extra=fields(mac=module["id"], stage="scan"))
             continue
-        for device in devices:
-            if device.address.lower() == module["id"].lower():
-                if module["type"] == "tag":
-                    tasks.append(handle_tag(module))
-                elif module["type"] == "anchor":
-                    tasks.append(handle_anchor(module))
-                break
+        if module["id"].upper() in devices:
+            scan_result["found"] += 1
+            if module["type"] == "tag":
+                tasks.append(handle_tag(module))
+            elif module["type"] == "anchor":
+                tasks.append(handle_anchor(module))
         else:
-            print(f"Không tìm thấy module {module['name']} ({module['id']}) trong quá trình quét.")
+            scan_result["missing"] += 1
+            log.warning(f"Không tìm thấy module {module['name']} trong quá trình quét.", extra=fields(mac=module["id"], stage="scan"))
+    for result, count in scan_result.items():
+        SCAN_MODULES.set(count, result=result)
     if tasks:
         await asyncio.gather(*tasks)
     else:
-        print("Không có module active nào để kết nối.")
+        log.warning("Không có module active nào để kết nối.", extra=fields(stage="scan"))
+
+
+# Chạy với nhiều adapter (sharding.py): mỗi adapter một tiến trình worker giữ kết nối BLE,
+# frame được gửi về đây và đi qua cùng pipeline giải mã / upload / metrics như chế độ một adapter
+async def run_sharded(managed_modules: List[Dict]):
+    managed_modules = [module for module in managed_modules if module["status"] != "disable"]
+    apply_kinds(managed_modules)
+    background = set()
+
+    def spawn(coro):
+        task = asyncio.create_task(coro)
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+    def on_info(mac: str, name: str, operation_mode: bytes):
+        decoded_type = node_type(operation_mode)
+        operation_hex = bytes_to_hex(operation_mode)
+        module_info[mac] = {"name": name, "type": decoded_type, "operation_hex": operation_hex}
+        STATE_INDEX.update_info(mac, name, decoded_type, operation_hex, "active")
+        CONNECT_TOTAL.inc(module="tag", result="ok")
+        startup.mark("connected")
+
+    def on_lost(mac: str):
+        DISCONNECT_TOTAL.inc(mac=mac)
+        STATE_INDEX.update_info(mac, status="disconnected")
+        flush_track(mac)
+
+    coordinator = Coordinator(
+        on_frame=lambda mac, data: notify_callback(0, data, mac),
+        on_info=on_info,
+        on_anchor=lambda mac, name, operation_mode, location: spawn(
+            report_anchor(mac, name, operation_mode, location)),
+        on_lost=on_lost,
+        on_failed=lambda mac, name: spawn(report_anchor_disabled(mac, name)),
+    )
+    try:
+        await coordinator.run(managed_modules)
+    finally:
+        coordinator.stop()
+
+
+# Bộ lọc vị trí kèm vị trí anchor đã hiệu chuẩn (calibration.py), dùng ngay không cần chờ đọc từ từng anchor
+def open_gate_with_anchors():
+    position_gate = open_position_gate()
+    if position_gate is not None:
+        from calibration import load_anchor_positions
+
+        for mac, (x, y, z) in load_anchor_positions().items():
+            position_gate.set_anchor(mac, x, y, z)
+    return position_gate
+
+
+# Lịch sử gần đây (recent.py) cần numpy; nạp trong thread, song song với quét BLE
+def open_recent_history():
+    from recent import open_recent
+
+    return open_recent()
 
 
 # Hàm chính
 async def main():
-    await scan_and_connect()
+    global history, zone_engine, proximity_engine, compression, gate, decode_offload, capture, publisher, recent
+    global aggregator
+    startup.mark("imports")
+    managed_modules = load_modules()
+    scanning = None
+    if not SHARDING:
+        # Quét BLE ngay, song song với nạp cấu hình, cache thông tin module và import aiohttp (uploader, local_api)
+        scanning = asyncio.create_task(discover_modules(managed_modules))
+    history = open_history()
+    gate, compression, zone_engine, proximity_engine, recent, cached_info, _, local_api = await asyncio.gather(
+        asyncio.to_thread(open_gate_with_anchors),
+        asyncio.to_thread(open_compression),
+        asyncio.to_thread(open_zone_engine),
+        asyncio.to_thread(open_proximity_engine),
+        asyncio.to_thread(open_recent_history),
+        asyncio.to_thread(load_module_cache),
+        asyncio.to_thread(importlib.import_module, "uploader"),
+        asyncio.to_thread(importlib.import_module, "local_api"),
+    )
+    for mac, info in cached_info.items():
+        module_info.setdefault(mac, info)
+    executor = open_offload()
+    capture = open_capture(on_offloaded, executor)
+    if executor is not None and capture is None:
+        decode_offload = DecodeOffload(executor, on_offloaded)
+        decode_offload.start()
+    aggregator = open_aggregator([zone.name for zone in zone_engine.zones] if zone_engine is not None else ())
+    runner = await local_api.start_local_api(recent=recent, aggregator=aggregator)
+    publisher = open_mqtt(managed_modules)
+    uploading = asyncio.create_task(upload_worker())
+    aggregating = asyncio.create_task(aggregate_worker()) if aggregator is not None else None
+    startup.mark("config")
+    try:
+        if SHARDING:
+            await run_sharded(managed_modules)
+        else:
+            await scan_and_connect(managed_modules, scanning)
+    finally:
+        # Xử lý nốt các frame đã nhận trước khi gửi nốt bộ nén và các hàng đợi
+        if capture is not None:
+            await capture.stop()
+        if decode_offload is not None:
+            await decode_offload.stop()
+        if compression is not None:
+            queue_flushed(compression.flush_all())
+        # Gửi nốt các hàng đợi (kể cả mẫu bộ nén vừa gửi ra) trước khi dừng upload
+        upload_stop.set()
+        try:
+            await asyncio.wait_for(uploading, SHUTDOWN_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Hết thời gian gửi nốt dữ liệu khi dừng", extra=fields(stage="upload"))
+        except Exception as e:
+            log.exception(f"Lỗi trong upload worker: {e}", extra=fields(stage="upload"))
+        if aggregating is not None:
+            aggregating.cancel()
+        if publisher is not None:
+            publisher.stop()
+        if scanning is not None:
+            scanning.cancel()
+        if runner is not None:
+            await runner.cleanup()
+        if history is not None:
+            history.stop()
+        close_offload()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="UWB BLE gateway")
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=["cprofile", "stack"],
+                        help="Bật profile event loop (cprofile hoặc lấy mẫu stack dạng collapsed)")
+    parser.add_argument("--profile-output", default="gateway-profile",
+                        help="Tiền tố file báo cáo profile (.txt, .pstats, .collapsed)")
+    parser.add_argument("--slow-callback-ms", type=float, default=50.0,
+                        help="Ngưỡng cảnh báo callback chậm (ms)")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.profile:
+        run_profiled(main, args.profile, args.profile_output, args.slow_callback_ms)
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Các bucket mặc định cho histogram thời gian (giây)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Bucket cho các bước CPU ngắn (giải mã, mã hóa): từ 1 µs tới 10 ms
+CPU_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# Lớp cơ sở cho metric có nhãn (labels)
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+# Bộ đếm tăng dần (số notify, số lần upload, số lần kết nối lại...)
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+# Giá trị tức thời (độ sâu hàng đợi, số kết nối đang mở...)
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+# Histogram với bucket cố định: observe() là O(log số bucket)
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [số lượng theo từng bucket (+Inf ở cuối), tổng, số mẫu]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    # Đo thời gian một khối lệnh: with histogram.time(stage="decode"): ...
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_label_key(self.labelnames, labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, n) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# Tập hợp các metric, xuất ra định dạng text của Prometheus
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Các metric của pipeline gateway: notify -> decode -> lưu tạm -> upload
+NOTIFY_TOTAL = REGISTRY.counter("gateway_notify_total", "Số notification BLE nhận được", ["mac"])
+DECODE_SECONDS = REGISTRY.histogram("gateway_decode_seconds", "Thời gian giải mã location data", ["mode"],
+                                    buckets=CPU_BUCKETS)
+DECODE_ERRORS = REGISTRY.counter("gateway_decode_errors_total", "Số frame location data không hợp lệ")
+QUEUE_DEPTH = REGISTRY.gauge("gateway_queue_depth", "Số mẫu đang chờ upload", ["queue"])
+UPLOAD_SECONDS = REGISTRY.histogram("gateway_upload_seconds", "Độ trễ gửi dữ liệu lên server", ["kind"])
+UPLOAD_TOTAL = REGISTRY.counter("gateway_upload_total", "Số request upload theo mã trạng thái", ["kind", "status"])
+SAMPLE_AGE_SECONDS = REGISTRY.histogram("gateway_sample_age_seconds",
+                                        "Thời gian từ lúc nhận notify tới khi upload xong")
+CONNECT_TOTAL = REGISTRY.counter("gateway_connect_total", "Số lần kết nối BLE theo kết quả", ["module", "result"])
+RECONNECT_TOTAL = REGISTRY.counter("gateway_reconnect_total", "Số lần thử kết nối lại", ["mac"])
+DISCONNECT_TOTAL = REGISTRY.counter("gateway_disconnect_total", "Số lần mất kết nối", ["mac"])
+CONNECTED = REGISTRY.gauge("gateway_connected_modules", "Số module đang kết nối", ["module"])
+SLOT_WAIT_SECONDS = REGISTRY.histogram("gateway_connection_slot_wait_seconds",
+                                       "Thời gian chờ slot kết nối (semaphore)", ["module"])
+SCAN_SECONDS = REGISTRY.histogram("gateway_scan_seconds", "Thời gian quét BLE")
+SCAN_DEVICES = REGISTRY.gauge("gateway_scan_devices", "Số thiết bị BLE thấy được ở lần quét gần nhất")
+SCAN_MODULES = REGISTRY.gauge("gateway_scan_modules", "Số module được quản lý theo kết quả quét", ["result"])
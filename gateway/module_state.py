@@ -0,0 +1,104 @@
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from serializer import get_serializer
+
+# Ngưỡng tốc độ (m/s) để coi là đang di chuyển, giống moving-test.py
+MOTION_SPEED_THRESHOLD = float(os.getenv("MOTION_SPEED_THRESHOLD", "0.5"))
+
+_serializer = get_serializer("auto")
+
+
+# Bảng trạng thái mới nhất của từng module (vị trí, chất lượng, chuyển động, trạng thái, lần cuối thấy),
+# có chỉ mục phụ theo loại và trạng thái để lọc nhanh
+class ModuleStateIndex:
+    def __init__(self):
+        self.states: Dict[str, Dict] = {}
+        self.by_type: Dict[str, Set[str]] = {}
+        self.by_status: Dict[str, Set[str]] = {}
+        self.version = 0
+        self._cached_version = -1
+        self._cached_body = b""
+
+    def _reindex(self, index: Dict[str, Set[str]], mac: str, old, new):
+        if old == new:
+            return
+        if old is not None:
+            index.get(old, set()).discard(mac)
+        index.setdefault(new, set()).add(mac)
+
+    # Cập nhật thông tin tĩnh (tên, loại, operation, trạng thái)
+    def update_info(self, mac: str, name: Optional[str] = None, module_type: Optional[str] = None,
+                    operation: Optional[str] = None, status: Optional[str] = None):
+        state = self.states.get(mac)
+        if state is None:
+            state = self.states[mac] = {"id": mac, "name": name or mac, "type": "unknown", "operation": "unknown",
+                                        "status": "unknown", "position": None, "quality": None,
+                                        "motion": "unknown", "speed": None, "last_seen": None}
+            self._reindex(self.by_type, mac, None, "unknown")
+            self._reindex(self.by_status, mac, None, "unknown")
+        if name is not None:
+            state["name"] = name
+        if operation is not None:
+            state["operation"] = operation
+        if module_type is not None:
+            self._reindex(self.by_type, mac, state["type"], module_type)
+            state["type"] = module_type
+        if status is not None:
+            self._reindex(self.by_status, mac, state["status"], status)
+            state["status"] = status
+        self.version += 1
+        return state
+
+    # Cập nhật từ kết quả giải mã location (dict của location.py); trả về state mới
+    def update_location(self, mac: str, location, seen: Optional[float] = None) -> Dict:
+        seen = seen if seen is not None else time.time()
+        state = self.states.get(mac) or self.update_info(mac)
+        position = location.get("Position") if isinstance(location, dict) else None
+        if position is not None:
+            previous, previous_seen = state["position"], state["last_seen"]
+            if previous is not None and previous_seen is not None and seen > previous_seen:
+                distance = math.sqrt((position["X"] - previous[0]) ** 2 + (position["Y"] - previous[1]) ** 2 +
+                                     (position["Z"] - previous[2]) ** 2)
+                state["speed"] = distance / (seen - previous_seen)
+                state["motion"] = "moving" if state["speed"] > MOTION_SPEED_THRESHOLD else "stationary"
+            state["position"] = (position["X"], position["Y"], position["Z"])
+            state["quality"] = position["Quality Factor"]
+        if state["status"] != "active":
+            self._reindex(self.by_status, mac, state["status"], "active")
+            state["status"] = "active"
+        state["last_seen"] = seen
+        self.version += 1
+        return state
+
+    def get(self, mac: str) -> Optional[Dict]:
+        return self.states.get(mac)
+
+    # Lọc theo loại, trạng thái, danh sách MAC và thời điểm thấy gần nhất (since, epoch giây)
+    def query(self, module_type: Optional[str] = None, status: Optional[str] = None,
+              macs: Optional[Iterable[str]] = None, since: Optional[float] = None) -> List[Dict]:
+        candidates: Optional[Set[str]] = None
+        for index, key in ((self.by_type, module_type), (self.by_status, status)):
+            if key is not None:
+                matched = index.get(key, set())
+                candidates = matched if candidates is None else candidates & matched
+        if macs is not None:
+            wanted = set(macs)
+            candidates = wanted if candidates is None else candidates & wanted
+        states = self.states.values() if candidates is None else (
+            self.states[mac] for mac in candidates if mac in self.states)
+        if since is not None:
+            return [state for state in states if state["last_seen"] is not None and state["last_seen"] >= since]
+        return list(states)
+
+    # Toàn bộ bảng đã được mã hóa sẵn; chỉ mã hóa lại khi có thay đổi
+    def encoded_all(self) -> bytes:
+        if self._cached_version != self.version:
+            self._cached_body = _serializer.dumps(list(self.states.values()))
+            self._cached_version = self.version
+        return self._cached_body
+
+
+STATE_INDEX = ModuleStateIndex()
@@ -0,0 +1,161 @@
+import os
+import socket
+import threading
+from typing import Dict, List, Optional
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+from serializer import get_serializer
+
+# paho-mqtt (tùy chọn) chỉ cần khi OUTPUT có "mqtt"; nạp lúc tạo publisher (_load_paho) vì import mất ~100 ms
+mqtt = None
+
+# Cấu hình qua biến môi trường
+OUTPUT = os.getenv("OUTPUT", "http")  # http | mqtt | http,mqtt
+OUTPUTS = {part.strip().lower() for part in OUTPUT.split(",") if part.strip()}
+HTTP_OUTPUT = "http" in OUTPUTS
+MQTT_OUTPUT = "mqtt" in OUTPUTS
+
+MQTT_HOST = os.getenv("MQTT_HOST", "127.0.0.1")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", f"uwb-gateway-{socket.gethostname()}")  # cố định để giữ session
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "")
+MQTT_QOS = int(os.getenv("MQTT_QOS", "1"))
+MQTT_RETAIN = os.getenv("MQTT_RETAIN", "1") == "1"  # giữ vị trí / trạng thái cuối cùng trên broker
+MQTT_CLEAN_SESSION = os.getenv("MQTT_CLEAN_SESSION", "0") == "1"  # 0: session bền, broker giữ subscription / QoS>0
+MQTT_KEEPALIVE = int(os.getenv("MQTT_KEEPALIVE", "30"))
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "100"))  # số message QoS>0 chưa được ack gửi đồng thời
+MQTT_MAX_QUEUED = int(os.getenv("MQTT_MAX_QUEUED", "10000"))  # message chờ gửi khi mất kết nối; 0 = không giới hạn
+# Topic theo từng module (trường lấy từ module.json): {site} {type} {kind} {mac} {name}; sự kiện thêm "/events"
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "{site}/{type}/{mac}")
+MQTT_SITE = os.getenv("MQTT_SITE", "site")
+
+MQTT_CONNECTED = REGISTRY.gauge("gateway_mqtt_connected", "1 khi đang kết nối tới MQTT broker")
+MQTT_PUBLISHED = REGISTRY.counter("gateway_mqtt_published_total", "Số message MQTT theo kết quả", ["result"])
+MQTT_PENDING = REGISTRY.gauge("gateway_mqtt_pending", "Số message đã giao cho client MQTT nhưng chưa gửi xong / chưa ack")
+
+SERIALIZER = get_serializer(os.getenv("SERIALIZER", "auto"))
+
+log = get_logger("gateway.mqtt")
+
+
+def _load_paho() -> bool:
+    global mqtt
+    if mqtt is None:
+        try:
+            import paho.mqtt.client as client
+        except ImportError:
+            return False
+        mqtt = client
+    return True
+
+
+def _topic_mac(mac: str) -> str:
+    return mac.replace(":", "").lower()
+
+
+# Publish payload (cùng định dạng với send_to_api, payload.py) lên MQTT broker: mỗi module một topic,
+# payload vị trí / trạng thái được retain để subscriber mới nhận ngay vị trí cuối cùng, sự kiện thì không.
+# Client chạy network loop trong thread riêng (paho), publish không chặn event loop; nhiều message QoS>0
+# được gửi liên tiếp không chờ ack (tối đa max_inflight), mất kết nối thì xếp hàng tới max_queued
+class MqttPublisher:
+    def __init__(self, modules: List[Dict], host: str = MQTT_HOST, port: int = MQTT_PORT,
+                 client_id: str = MQTT_CLIENT_ID, qos: int = MQTT_QOS, retain: bool = MQTT_RETAIN,
+                 clean_session: bool = MQTT_CLEAN_SESSION, keepalive: int = MQTT_KEEPALIVE,
+                 max_inflight: int = MQTT_MAX_INFLIGHT, max_queued: int = MQTT_MAX_QUEUED,
+                 topic_template: str = MQTT_TOPIC, site: str = MQTT_SITE,
+                 username: str = MQTT_USERNAME, password: str = MQTT_PASSWORD):
+        if not _load_paho():
+            raise RuntimeError("Cần cài paho-mqtt để dùng OUTPUT=mqtt")
+        if qos not in (0, 1, 2):
+            raise ValueError(f"MQTT QoS không hợp lệ: {qos}")
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.retain = retain
+        self.keepalive = keepalive
+        self.topic_template = topic_template
+        self.site = site
+        self.topics: Dict[str, str] = {}
+        for module in modules:
+            self.topics[module["id"].upper()] = self._format_topic(module["id"], module.get("type", "unknown"),
+                                                                   module.get("kind"), module.get("name"),
+                                                                   module.get("site"))
+        self.pending = 0
+        self._lock = threading.Lock()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                                  clean_session=clean_session)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.max_queued_messages_set(max_queued)
+        self.client.reconnect_delay_set(1, 30)
+        if username:
+            self.client.username_pw_set(username, password or None)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+
+    def _format_topic(self, mac: str, module_type: str, kind: Optional[str], name: Optional[str],
+                      site: Optional[str]) -> str:
+        return self.topic_template.format(site=site or self.site, type=module_type, kind=kind or module_type,
+                                          mac=_topic_mac(mac), name=name or _topic_mac(mac))
+
+    def topic(self, payload: Dict) -> str:
+        mac = payload["id"].upper()
+        base = self.topics.get(mac)
+        if base is None:
+            base = self.topics[mac] = self._format_topic(mac, payload.get("type", "unknown"), None,
+                                                         payload.get("name"), None)
+        return base + "/events" if "event" in payload else base
+
+    def start(self):
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        log.info("Bật output MQTT", extra=fields(stage="mqtt", host=self.host, port=self.port, qos=self.qos))
+
+    def publish(self, payload: Dict) -> bool:
+        info = self.client.publish(self.topic(payload), SERIALIZER.dumps(payload), qos=self.qos,
+                                   retain=self.retain and "event" not in payload)
+        # Khi chưa kết nối, message QoS>0 vẫn được xếp hàng (MQTT_ERR_NO_CONN) và gửi lại sau khi kết nối
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0):
+            with self._lock:
+                self.pending += 1
+                MQTT_PENDING.set(self.pending)
+            MQTT_PUBLISHED.inc(result="queued")
+            return True
+        MQTT_PUBLISHED.inc(result="dropped")
+        return False
+
+    def publish_many(self, payloads: List[Dict]) -> int:
+        return sum(self.publish(payload) for payload in payloads)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log.error(f"MQTT broker từ chối kết nối: {reason_code}", extra=fields(stage="mqtt"))
+            return
+        MQTT_CONNECTED.set(1)
+        log.info("Đã kết nối MQTT broker", extra=fields(stage="mqtt", session_present=flags.session_present))
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        MQTT_CONNECTED.set(0)
+        log.warning(f"Mất kết nối MQTT broker: {reason_code}", extra=fields(stage="mqtt"))
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        with self._lock:
+            self.pending = max(0, self.pending - 1)
+            MQTT_PENDING.set(self.pending)
+        MQTT_PUBLISHED.inc(result="acked" if self.qos else "sent")
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+        MQTT_CONNECTED.set(0)
+
+
+# Tạo publisher nếu OUTPUT có "mqtt"; topic lấy theo module.json
+def open_mqtt(modules: List[Dict]) -> Optional[MqttPublisher]:
+    if not MQTT_OUTPUT:
+        return None
+    publisher = MqttPublisher(modules)
+    publisher.start()
+    return publisher
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from logger import fields, get_logger, setup_logging
+
+# Cấu hình qua biến môi trường
+MQTT_STUB_HOST = os.getenv("MQTT_STUB_HOST", "127.0.0.1")
+MQTT_STUB_PORT = int(os.getenv("MQTT_STUB_PORT", "1883"))
+
+# Loại packet MQTT 3.1.1
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+log = get_logger("gateway.mqtt_stub")
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from("!H", data, offset)
+    return data[offset + 2:offset + 2 + length].decode("utf-8"), offset + 2 + length
+
+
+def _encode_string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack("!H", len(raw)) + raw
+
+
+# Topic filter với + và # theo chuẩn MQTT
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_parts, topic_parts = topic_filter.split("/"), topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class _Session:
+    def __init__(self, client_id: str, clean: bool):
+        self.client_id = client_id
+        self.clean = clean
+        self.subscriptions: Dict[str, int] = {}
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+
+# Broker MQTT 3.1.1 tối giản chạy trong tiến trình để thử output MQTT mà không cần broker thật:
+# CONNECT (session bền khi clean session = 0), PUBLISH QoS 0/1/2, retained message, SUBSCRIBE với + / #,
+# PING, ghi lại và đếm message nhận được; ack_delay_ms làm chậm PUBACK để thấy tác dụng của in-flight pipelining
+class MqttBrokerStub:
+    def __init__(self, ack_delay_ms: float = 0.0, record: Optional[str] = None):
+        self.ack_delay_ms = ack_delay_ms
+        self.sessions: Dict[str, _Session] = {}
+        self.retained: Dict[str, bytes] = {}
+        self.received: Dict[str, int] = {}  # số message theo topic
+        self.by_qos: Dict[int, int] = {}
+        self.connections = 0
+        self.resumed = 0
+        self._record = open(record, "a", encoding="utf-8") if record else None
+
+    def stats(self) -> Dict:
+        return {
+            "messages": sum(self.received.values()),
+            "topics": len(self.received),
+            "by_qos": {str(qos): count for qos, count in sorted(self.by_qos.items())},
+            "retained": len(self.retained),
+            "connections": self.connections,
+            "sessions_resumed": self.resumed,
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session: Optional[_Session] = None
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type, flags = header[0] >> 4, header[0] & 0x0F
+                if packet_type == CONNECT:
+                    session = self._connect(body, writer)
+                elif session is None:
+                    break
+                elif packet_type == PUBLISH:
+                    self._publish(flags, body, writer)
+                elif packet_type == PUBREL:
+                    writer.write(_packet(PUBCOMP, 0, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    self._subscribe(session, body, writer)
+                elif packet_type == UNSUBSCRIBE:
+                    self._unsubscribe(session, body, writer)
+                elif packet_type == PINGREQ:
+                    writer.write(_packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # client ngắt kết nối hoặc broker dừng
+        finally:
+            if session is not None and session.writer is writer:
+                session.writer = None
+                if session.clean:
+                    self.sessions.pop(session.client_id, None)
+            writer.close()
+
+    def _connect(self, body: bytes, writer: asyncio.StreamWriter) -> _Session:
+        _, offset = _string(body, 0)  # "MQTT"
+        connect_flags = body[offset + 1]
+        client_id, _ = _string(body, offset + 4)
+        clean = bool(connect_flags & 0x02) or not client_id
+        client_id = client_id or f"anonymous-{id(writer)}"
+        if clean:
+            self.sessions.pop(client_id, None)
+        present = client_id in self.sessions
+        if present:
+            self.resumed += 1
+        session = self.sessions.setdefault(client_id, _Session(client_id, clean))
+        session.writer = writer
+        self.connections += 1
+        writer.write(_packet(CONNACK, 0, bytes([1 if present else 0, 0])))
+        log.info("Client MQTT kết nối", extra=fields(stage="mqtt_stub", client=client_id, session_present=present))
+        return session
+
+    def _publish(self, flags: int, body: bytes, writer: asyncio.StreamWriter):
+        qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+        topic, offset = _string(body, 0)
+        packet_id = None
+        if qos:
+            (packet_id,) = struct.unpack_from("!H", body, offset)
+            offset += 2
+        payload = body[offset:]
+        self.received[topic] = self.received.get(topic, 0) + 1
+        self.by_qos[qos] = self.by_qos.get(qos, 0) + 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        if self._record is not None:
+            self._record.write(json.dumps({"topic": topic, "qos": qos, "retain": retain,
+                                           "payload": payload.decode("utf-8", errors="replace")},
+                                          ensure_ascii=False) + "\n")
+        self._deliver(topic, payload)
+        if qos:
+            # Ack trễ không chặn việc đọc các PUBLISH tiếp theo, như broker thật trên đường mạng có độ trễ
+            ack = _packet(PUBACK if qos == 1 else PUBREC, 0, struct.pack("!H", packet_id))
+            if self.ack_delay_ms:
+                asyncio.get_running_loop().call_later(self.ack_delay_ms / 1000, self._send, writer, ack)
+            else:
+                writer.write(ack)
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, data: bytes):
+        if not writer.is_closing():
+            writer.write(data)
+
+    # Chuyển message tới các subscriber (QoS 0)
+    def _deliver(self, topic: str, payload: bytes):
+        for session in self.sessions.values():
+            if session.writer is None:
+                continue
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.writer.write(_packet(PUBLISH, 0, _encode_string(topic) + payload))
+
+    def _subscribe(self, session: _Session, body: bytes, writer: asyncio.StreamWriter):
+        packet_id, offset = body[:2], 2
+        granted = bytearray()
+        filters: List[str] = []
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            session.subscriptions[topic_filter] = body[offset]
+            filters.append(topic_filter)
+            granted.append(0)  # stub chỉ chuyển tiếp QoS 0
+            offset += 1
+        writer.write(_packet(SUBACK, 0, packet_id + bytes(granted)))
+        for topic, payload in self.retained.items():
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                writer.write(_packet(PUBLISH, 1, _encode_string(topic) + payload))
+
+    def _unsubscribe(self, session: _Session, body: bytes, writer: asyncio.StreamWriter):
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            session.subscriptions.pop(topic_filter, None)
+        writer.write(_packet(UNSUBACK, 0, body[:2]))
+
+    def close(self):
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+
+# Chạy broker stub trong event loop hiện tại; port=0 để chọn port trống. Trả về (server, port)
+async def start_broker(broker: MqttBrokerStub, host: str = MQTT_STUB_HOST, port: int = MQTT_STUB_PORT):
+    server = await asyncio.start_server(broker.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    log.info("MQTT broker stub đang chạy", extra=fields(stage="mqtt_stub", host=host, port=port))
+    return server, port
+
+
+async def _serve(broker: MqttBrokerStub, host: str, port: int):
+    server, _ = await start_broker(broker, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        broker.close()
+        print(json.dumps(broker.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MQTT broker giả lập để thử output MQTT của gateway")
+    parser.add_argument("--host", default=MQTT_STUB_HOST)
+    parser.add_argument("--port", type=int, default=MQTT_STUB_PORT)
+    parser.add_argument("--ack-delay-ms", type=float, default=0.0, help="Độ trễ trước PUBACK / PUBREC")
+    parser.add_argument("--record", help="Ghi message nhận được ra file jsonl")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        asyncio.run(_serve(MqttBrokerStub(args.ack_delay_ms, args.record), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
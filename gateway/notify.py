@@ -1,15 +1,21 @@
 import asyncio
+import logging
 import struct
 from bleak import BleakClient
 from location import *
 from global_var import *
+from logger import fields, get_logger, setup_logging
 
+log = get_logger("gateway.notify")
+frame_log = get_logger("gateway.frame")  # log theo từng frame, được lấy mẫu/giới hạn tốc độ
 
-# Hàm xử lý dữ liệu nhận được từ notification
-def notification_handler(sender, data):
-    print(f"Nhận dữ liệu từ {sender}: {data.hex()}")
+
+# Hàm xử lý dữ liệu nhận được từ notification; mac để giới hạn tốc độ log theo từng tag
+def notification_handler(sender, data, mac=None):
     decoded_data = decode_location_data(data)
-    print(f"Dữ liệu giải mã: {decoded_data}")
+    if frame_log.isEnabledFor(logging.INFO):
+        frame_log.info("Dữ liệu giải mã", extra=fields(mac=mac, sender=sender, stage="notify", raw=data.hex(),
+                                                        location=decoded_data))
 
 # Hàm kết nối và đăng ký notification
 async def setup_notifications(address):
@@ -18,29 +24,30 @@ async def setup_notifications(address):
         try:
             # Kiểm tra kết nối
             if not await client.is_connected():
-                print(f"Không thể kết nối tới {address}")
+                log.error("Không thể kết nối", extra=fields(mac=address, stage="connect"))
                 return
 
-            print(f"Đã kết nối tới {address}")
+            log.info("Đã kết nối", extra=fields(mac=address, stage="connect"))
 
             # Đọc Location Data Mode để biết mode hiện tại
             loc_mode_data = await client.read_gatt_char(LOCATION_DATA_MODE_UUID)
             loc_mode = int(loc_mode_data[0])
-            print(f"Location Data Mode: {loc_mode}")
+            log.info(f"Location Data Mode: {loc_mode}", extra=fields(mac=address))
 
             # Đăng ký nhận notification từ LOCATION_DATA_UUID
-            await client.start_notify(LOCATION_DATA_UUID, notification_handler)
-            print(f"Đã đăng ký notification cho {LOCATION_DATA_UUID}")
+            await client.start_notify(LOCATION_DATA_UUID,
+                                      lambda sender, data: notification_handler(sender, data, address))
+            log.info(f"Đã đăng ký notification cho {LOCATION_DATA_UUID}", extra=fields(mac=address))
 
             # Giữ kết nối trong 60 giây để nhận dữ liệu
             await asyncio.sleep(6000)
 
             # Dừng notification (tùy chọn)
             await client.stop_notify(LOCATION_DATA_UUID)
-            print("Đã dừng notification")
+            log.info("Đã dừng notification", extra=fields(mac=address))
 
         except Exception as e:
-            print(f"Lỗi: {e}")
+            log.exception(f"Lỗi: {e}", extra=fields(mac=address))
 
 # Hàm chính
 async def main():
@@ -49,4 +56,5 @@ async def main():
     await setup_notifications(module_address)
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(main())
\ No newline at end of file
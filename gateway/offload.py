@@ -0,0 +1,163 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from location import decode_location_batch
+from logger import fields, get_logger
+from metrics import REGISTRY
+from queues import DROP_OLDEST, ShedQueue
+
+# Cấu hình qua biến môi trường
+OFFLOAD = os.getenv("OFFLOAD", "off")  # off | thread | process
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", str(os.cpu_count() or 2)))
+OFFLOAD_BATCH = int(os.getenv("OFFLOAD_BATCH", "256"))  # số frame tối đa mỗi lô
+OFFLOAD_BATCH_MS = float(os.getenv("OFFLOAD_BATCH_MS", "20"))  # thời gian gom lô tối đa (ms)
+OFFLOAD_MAX_INFLIGHT = int(os.getenv("OFFLOAD_MAX_INFLIGHT", "4"))  # số lô tối đa đang nằm trong pool
+OFFLOAD_QUEUE_SIZE = int(os.getenv("OFFLOAD_QUEUE_SIZE", "4096"))  # frame chờ gom lô; đầy thì bỏ frame cũ nhất
+OFFLOAD_ENCODE_MIN = int(os.getenv("OFFLOAD_ENCODE_MIN", "50"))  # lô upload từ bao nhiêu payload thì mã hóa ngoài loop
+OFFLOAD_DRAIN_TIMEOUT = float(os.getenv("OFFLOAD_DRAIN_TIMEOUT", "5"))  # giây chờ xử lý nốt các lô khi dừng
+
+OFFLOAD_BATCH_SIZE = REGISTRY.histogram("gateway_offload_batch_frames", "Số frame mỗi lô giải mã",
+                                        buckets=(1, 4, 16, 64, 256, 1024))
+OFFLOAD_SECONDS = REGISTRY.histogram("gateway_offload_batch_seconds",
+                                     "Thời gian từ lúc gửi lô sang pool tới khi có kết quả")
+OFFLOAD_PENDING = REGISTRY.gauge("gateway_offload_pending_batches", "Số lô đang xử lý trong pool")
+
+log = get_logger("gateway.offload")
+
+_executor: Optional[Executor] = None
+
+
+# Pool dùng chung cho các bước tốn CPU (None nếu OFFLOAD=off)
+def get_executor() -> Optional[Executor]:
+    return _executor
+
+
+def _create_executor(mode: str, workers: int) -> Optional[Executor]:
+    if mode == "thread":
+        return ThreadPoolExecutor(workers, thread_name_prefix="offload")
+    if mode == "process":
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    return None
+
+
+# Giải mã frame notify theo lô trong pool: gom frame trong OFFLOAD_BATCH_MS (hoặc tới OFFLOAD_BATCH frame),
+# gửi cả lô sang pool, nhận kết quả theo đúng thứ tự đã nhận để các bước có trạng thái theo tag
+# (gating, nén, zone) vẫn thấy mẫu theo thứ tự thời gian. Khi pool không theo kịp (đã có max_inflight lô),
+# frame chờ trong hàng đợi có giới hạn thay vì tạo thêm lô
+class DecodeOffload:
+    def __init__(self, executor: Executor, on_decoded: Callable[[str, bytes, object, float], None],
+                 batch: int = OFFLOAD_BATCH, interval: float = OFFLOAD_BATCH_MS / 1000,
+                 max_inflight: int = OFFLOAD_MAX_INFLIGHT, queue_size: int = OFFLOAD_QUEUE_SIZE):
+        self.executor = executor
+        self.on_decoded = on_decoded
+        self.batch = batch
+        self.interval = interval
+        self.max_inflight = max(1, max_inflight)
+        self.pending = ShedQueue("decode", max(batch, queue_size), DROP_OLDEST)
+        self.results: "asyncio.Queue" = asyncio.Queue()
+        self.inflight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        self._consumer = asyncio.create_task(self._consume())
+
+    # Gọi từ notify callback; chỉ thêm vào lô, không giải mã trên event loop
+    def submit(self, mac: str, data: bytes, received: float):
+        if self._stopping:
+            return
+        self.pending.put((mac, bytes(data), received))
+        if len(self.pending) >= self.batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._dispatch)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending or self.inflight >= self.max_inflight:
+            return
+        batch: List[Tuple[str, bytes, float]] = self.pending.drain(self.batch)
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self.executor, decode_location_batch, [data for _, data, _ in batch])
+        except Exception as e:
+            # Pool đã hỏng thì lỗi ngay khi gửi; để _consume xử lý lô này theo đúng thứ tự
+            future = loop.create_future()
+            future.set_exception(e)
+        self.results.put_nowait((batch, future, time.perf_counter()))
+        self.inflight += 1
+        OFFLOAD_PENDING.set(self.inflight)
+
+    async def _consume(self):
+        while True:
+            item = await self.results.get()
+            if item is None:
+                # Dấu kết thúc từ stop(): chỉ dừng khi không còn lô nào đang chờ hoặc đang trong pool
+                if not self.pending and self.results.empty():
+                    return
+                self._dispatch()
+                self.results.put_nowait(None)
+                continue
+            batch, future, started = item
+            try:
+                locations = await future
+            except Exception as e:
+                # Pool hỏng (tiến trình con chết...): giải mã lại trên event loop, lỗi từng frame do
+                # decode_location_batch tự đánh dấu
+                log.error(f"Lỗi khi giải mã lô trong pool: {e}", extra=fields(stage="decode", batch=len(batch)))
+                locations = decode_location_batch([data for _, data, _ in batch])
+            OFFLOAD_SECONDS.observe(time.perf_counter() - started)
+            OFFLOAD_BATCH_SIZE.observe(len(batch))
+            self.inflight -= 1
+            OFFLOAD_PENDING.set(self.inflight)
+            for (mac, data, received), location in zip(batch, locations):
+                try:
+                    self.on_decoded(mac, data, location, received)
+                except Exception as e:
+                    # Lỗi khi xử lý một frame không được làm dừng task nhận kết quả
+                    log.exception(f"Lỗi khi xử lý frame: {e}", extra=fields(mac=mac, stage="decode"))
+            # Pool vừa trống một chỗ: gửi tiếp frame đang chờ
+            if self.pending and self._timer is None:
+                self._dispatch()
+
+    # Dừng nhận frame mới, gửi nốt các frame đang chờ và đợi mọi kết quả được xử lý theo thứ tự (tối đa timeout giây)
+    async def stop(self, timeout: float = OFFLOAD_DRAIN_TIMEOUT):
+        self._stopping = True
+        if self._consumer is None:
+            return
+        self._dispatch()
+        self.results.put_nowait(None)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._consumer), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Hết thời gian chờ giải mã nốt các lô", extra=fields(stage="decode", pending=len(self.pending),
+                                                                              inflight=self.inflight))
+        finally:
+            self._consumer.cancel()
+
+
+# Tạo pool theo cấu hình OFFLOAD; trả về None nếu tắt
+def open_offload(mode: str = OFFLOAD, workers: int = OFFLOAD_WORKERS) -> Optional[Executor]:
+    global _executor
+    _executor = _create_executor(mode, workers)
+    if mode == "process":
+        # Khởi động trước các tiến trình con để lô đầu tiên không phải chờ spawn
+        for _ in range(workers):
+            _executor.submit(decode_location_batch, [])
+    if _executor is not None:
+        log.info(f"Bật xử lý CPU trong {mode} pool", extra=fields(stage="offload", workers=workers))
+    return _executor
+
+
+def close_offload():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,89 @@
+from typing import Dict, NamedTuple
+
+# Operation mode (2 byte, characteristic OPERATION_MODE_UUID)
+# Byte 1: bit 7 tag(0)/anchor(1), bit 6-5 UWB off(0)/passive(1)/active(2), bit 4 firmware 1(0)/2(1),
+#         bit 3 accelerometer, bit 2 LED, bit 1 firmware update, bit 0 reserved
+# Byte 2: bit 7 initiator (anchor), bit 6 low power (tag), bit 5 location engine (tag), bit 4-0 reserved
+UWB_MODES = ("off", "passive", "active", "unknown")
+# Các bit có nghĩa (10 bit); phần còn lại là reserved
+MEANINGFUL_MASK = 0xFEE0
+
+
+# Bản ghi operation mode đã giải mã; bất biến nên có thể dùng chung từ bảng tra cứu
+class OperationMode(NamedTuple):
+    node_type: str = "tag"
+    uwb_mode: str = "active"
+    firmware: int = 1
+    accelerometer_enable: bool = False
+    led_enable: bool = False
+    firmware_update_enable: bool = False
+    initiator_enable: bool = False
+    low_power_mode: bool = False
+    location_engine_enable: bool = False
+
+    # Dạng dict giống tag-op-check.py: chỉ có các trường riêng của loại node
+    def to_dict(self) -> Dict:
+        result = {
+            "node_type": self.node_type,
+            "uwb_mode": self.uwb_mode,
+            "firmware_select": f"firmware {self.firmware}",
+            "accelerometer_enable": self.accelerometer_enable,
+            "led_enable": self.led_enable,
+            "firmware_update_enable": self.firmware_update_enable,
+        }
+        if self.node_type == "anchor":
+            result["initiator_enable"] = self.initiator_enable
+        else:
+            result["low_power_mode"] = self.low_power_mode
+            result["location_engine_enable"] = self.location_engine_enable
+        return result
+
+
+def _decode_value(value: int) -> OperationMode:
+    byte1, byte2 = value >> 8, value & 0xFF
+    return OperationMode(
+        node_type="anchor" if byte1 & 0x80 else "tag",
+        uwb_mode=UWB_MODES[(byte1 & 0x60) >> 5],
+        firmware=2 if byte1 & 0x10 else 1,
+        accelerometer_enable=bool(byte1 & 0x08),
+        led_enable=bool(byte1 & 0x04),
+        firmware_update_enable=bool(byte1 & 0x02),
+        initiator_enable=bool(byte2 & 0x80),
+        low_power_mode=bool(byte2 & 0x40),
+        location_engine_enable=bool(byte2 & 0x20),
+    )
+
+
+# Bảng tra cứu tính sẵn cho mọi tổ hợp của 10 bit có nghĩa (1024 bản ghi)
+_TABLE: Dict[int, OperationMode] = {
+    value: _decode_value(value)
+    for value in ((high << 9) | (low << 5) for high in range(0x80) for low in range(0x08))
+}
+
+
+# Giải mã 2 byte operation mode: chỉ là một phép tra bảng
+def decode_operation_mode(data: bytes) -> OperationMode:
+    if len(data) != 2:
+        raise ValueError("Operation Mode phải là 2 byte.")
+    return _TABLE[((data[0] << 8) | data[1]) & MEANINGFUL_MASK]
+
+
+# Loại node (tag/anchor) từ operation mode
+def node_type(data: bytes) -> str:
+    return decode_operation_mode(data).node_type
+
+
+# Mã hóa bản ghi thành 2 byte để ghi; giữ nguyên các bit reserved của base (giá trị đang có trên thiết bị)
+def encode_operation_mode(mode: OperationMode, base: bytes = b"\x00\x00") -> bytes:
+    if mode.uwb_mode not in UWB_MODES[:3]:
+        raise ValueError(f"UWB mode không hợp lệ: {mode.uwb_mode}")
+    if mode.firmware not in (1, 2):
+        raise ValueError(f"Firmware không hợp lệ: {mode.firmware}")
+    byte1 = (0x80 if mode.node_type == "anchor" else 0) | (UWB_MODES.index(mode.uwb_mode) << 5) | \
+        (0x10 if mode.firmware == 2 else 0) | (0x08 if mode.accelerometer_enable else 0) | \
+        (0x04 if mode.led_enable else 0) | (0x02 if mode.firmware_update_enable else 0)
+    byte2 = (0x80 if mode.initiator_enable else 0) | (0x40 if mode.low_power_mode else 0) | \
+        (0x20 if mode.location_engine_enable else 0)
+    reserved = ((base[0] << 8) | base[1]) & ~MEANINGFUL_MASK & 0xFFFF
+    value = (byte1 << 8) | byte2 | reserved
+    return bytes([value >> 8, value & 0xFF])
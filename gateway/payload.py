@@ -0,0 +1,30 @@
+from typing import Dict
+
+
+# Tạo payload theo định dạng server yêu cầu (dùng chung cho tag, anchor và mọi output)
+def build_payload(name: str, mac: str, module_type: str, operation: str, location, status: str,
+                  current_time: str) -> Dict:
+    return {
+        "name": name,
+        "id": mac,
+        "type": module_type,
+        "operation": operation,
+        "location": location,
+        "status": status,
+        "time": current_time
+    }
+
+
+# Tạo payload sự kiện (zone enter/exit/dwell, proximity...) gửi kèm hoặc thay cho vị trí thô;
+# các trường riêng của sự kiện (zone, other, distance, dwell...) được giữ nguyên
+def build_event_payload(name: str, mac: str, module_type: str, event: Dict, location, current_time: str) -> Dict:
+    payload = {
+        "name": name,
+        "id": mac,
+        "type": module_type,
+        "location": location,
+        "status": "active",
+        "time": current_time
+    }
+    payload.update((key, value) for key, value in event.items() if key not in ("id", "ts"))
+    return payload
@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import cProfile
+import functools
+import io
+import pstats
+import signal
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from logger import fields, get_logger
+
+log = get_logger("gateway.profile")
+
+# Profiler đang hoạt động (None khi không chạy ở chế độ --profile)
+_active: Optional["Profiler"] = None
+
+
+# Thống kê thời gian: số lần, tổng, lớn nhất
+class _Stat:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+# Bọc một coroutine để đo thời gian CPU của từng bước (giữa hai lần await),
+# tức là thời gian coroutine thực sự chiếm event loop
+class _StepTimer:
+    def __init__(self, coro, name: str, profiler: "Profiler"):
+        self.coro = coro
+        self.name = name
+        self.profiler = profiler
+
+    def __await__(self):
+        stat = self.profiler.coroutines[self.name]
+        started = time.perf_counter()
+        send_value, error = None, None
+        try:
+            while True:
+                step = time.perf_counter()
+                try:
+                    if error is not None:
+                        future = self.coro.throw(error)
+                    else:
+                        future = self.coro.send(send_value)
+                except StopIteration as stop:
+                    stat.add(time.perf_counter() - step)
+                    return stop.value
+                stat.add(time.perf_counter() - step)
+                try:
+                    send_value, error = (yield future), None
+                except BaseException as e:
+                    send_value, error = None, e
+        finally:
+            self.profiler.lifetimes[self.name].add(time.perf_counter() - started)
+
+
+# Decorator cho coroutine cần đo; không tốn chi phí đáng kể khi không profile
+def timed(name: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _active is None:
+                return await fn(*args, **kwargs)
+            return await _StepTimer(fn(*args, **kwargs), name, _active)
+        return wrapper
+    return decorator
+
+
+# Profiler cho event loop của gateway
+class Profiler:
+    def __init__(self, mode: str = "cprofile", output: str = "gateway-profile", slow_callback_ms: float = 50.0,
+                 sample_interval: float = 0.005):
+        self.mode = mode  # "cprofile" hoặc "stack" (lấy mẫu stack, xuất dạng collapsed)
+        self.output = output
+        self.slow_callback = slow_callback_ms / 1000.0
+        self.sample_interval = sample_interval
+        self.coroutines: Dict[str, _Stat] = collections.defaultdict(_Stat)
+        self.lifetimes: Dict[str, _Stat] = collections.defaultdict(_Stat)
+        self.callbacks: Dict[str, _Stat] = collections.defaultdict(_Stat)
+        self.slow_callbacks = 0
+        self.stacks: Dict[str, int] = collections.Counter()
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampler = threading.Event()
+        self._original_run = None
+        self._started = 0.0
+
+    # Thay asyncio.Handle._run để đo thời gian mọi callback của event loop
+    def _patch_handles(self):
+        profiler = self
+        original_run = self._original_run = asyncio.events.Handle._run
+
+        def _run(handle):
+            started = time.perf_counter()
+            original_run(handle)
+            elapsed = time.perf_counter() - started
+            if elapsed >= profiler.slow_callback:
+                name = _describe_handle(handle)
+                profiler.callbacks[name].add(elapsed)
+                profiler.slow_callbacks += 1
+                log.warning("Callback chậm", extra=fields(stage="profile", callback=name,
+                                                            latency_ms=round(elapsed * 1000, 1)))
+
+        asyncio.events.Handle._run = _run
+
+    def _sample_stacks(self, thread_id: int):
+        while not self._stop_sampler.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        global _active
+        _active = self
+        self._started = time.perf_counter()
+        self._patch_handles()
+        if self.mode == "stack":
+            self._sampler = threading.Thread(target=self._sample_stacks, args=(threading.get_ident(),),
+                                             name="stack-sampler", daemon=True)
+            self._sampler.start()
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        log.info("Bật chế độ profile", extra=fields(stage="profile", mode=self.mode,
+                                                     slow_callback_ms=self.slow_callback * 1000))
+
+    def stop(self):
+        global _active
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._stop_sampler.set()
+            self._sampler.join()
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+        _active = None
+
+    # Báo cáo thời gian theo coroutine và callback chậm
+    def summary(self) -> str:
+        lines = [f"Thời gian chạy: {time.perf_counter() - self._started:.1f}s, callback chậm: {self.slow_callbacks}",
+                 f"{'coroutine':<32} {'bước':>8} {'CPU tổng (ms)':>14} {'bước max (ms)':>14} {'lần chạy':>9}"]
+        for name, stat in sorted(self.coroutines.items(), key=lambda item: -item[1].total):
+            lines.append(f"{name:<32} {stat.count:>8} {stat.total * 1000:>14.1f} {stat.max * 1000:>14.2f} "
+                         f"{self.lifetimes[name].count:>9}")
+        if self.callbacks:
+            lines.append(f"{'callback chậm':<60} {'số lần':>7} {'max (ms)':>9}")
+            for name, stat in sorted(self.callbacks.items(), key=lambda item: -item[1].max)[:20]:
+                lines.append(f"{name[:60]:<60} {stat.count:>7} {stat.max * 1000:>9.1f}")
+        return "\n".join(lines)
+
+    # Ghi báo cáo ra file: .pstats (cProfile) hoặc .collapsed (stack), kèm .txt tóm tắt
+    def dump(self) -> str:
+        report = self.summary()
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(f"{self.output}.pstats")
+            buffer = io.StringIO()
+            pstats.Stats(self._cprofile, stream=buffer).sort_stats("cumulative").print_stats(30)
+            report += "\n\n" + buffer.getvalue()
+        if self.stacks:
+            with open(f"{self.output}.collapsed", "w") as f:
+                for stack, count in self.stacks.items():
+                    f.write(f"{stack} {count}\n")
+        with open(f"{self.output}.txt", "w") as f:
+            f.write(report)
+        log.info("Đã ghi báo cáo profile", extra=fields(stage="profile", output=self.output))
+        return report
+
+    # Ghi báo cáo khi nhận tín hiệu (mặc định SIGUSR1) mà không dừng gateway
+    def install_signal_handler(self, loop: asyncio.AbstractEventLoop, signum: int = getattr(signal, "SIGUSR1", 0)):
+        if signum:
+            try:
+                loop.add_signal_handler(signum, self.dump)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+
+def _describe_handle(handle) -> str:
+    callback = getattr(handle, "_callback", None)
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f"Task {getattr(coro, '__qualname__', repr(coro))}"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+# Chạy một coroutine dưới profiler, ghi báo cáo khi kết thúc (kể cả Ctrl+C)
+def run_profiled(main_coro_factory, mode: str = "cprofile", output: str = "gateway-profile",
+                 slow_callback_ms: float = 50.0):
+    profiler = Profiler(mode, output, slow_callback_ms)
+
+    async def runner():
+        profiler.install_signal_handler(asyncio.get_running_loop())
+        await main_coro_factory()
+
+    profiler.start()
+    try:
+        asyncio.run(runner())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiler.stop()
+        print(profiler.dump())
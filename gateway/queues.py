@@ -0,0 +1,116 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+from logger import fields, get_logger
+from metrics import QUEUE_DEPTH, REGISTRY
+
+# Cấu hình qua biến môi trường
+QUEUE_ALERT_RATIO = float(os.getenv("QUEUE_ALERT_RATIO", "0.8"))  # cảnh báo khi độ đầy vượt ngưỡng này
+QUEUE_CLEAR_RATIO = float(os.getenv("QUEUE_CLEAR_RATIO", "0.5"))  # hết cảnh báo khi xuống dưới ngưỡng này
+# Hàng đợi giữa xử lý và upload trong main.py: sức chứa và chính sách
+SAMPLE_QUEUE_SIZE = int(os.getenv("SAMPLE_QUEUE_SIZE", "1000"))  # mẫu thô, mặc định chỉ giữ mẫu mới nhất mỗi tag
+SAMPLE_QUEUE_POLICY = os.getenv("SAMPLE_QUEUE_POLICY", "latest")
+TRACK_QUEUE_SIZE = int(os.getenv("TRACK_QUEUE_SIZE", "5000"))  # mẫu bộ nén giữ lại (compression.py)
+TRACK_QUEUE_POLICY = os.getenv("TRACK_QUEUE_POLICY", "drop_oldest")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))  # sự kiện zone/proximity, trạng thái anchor
+EVENT_QUEUE_POLICY = os.getenv("EVENT_QUEUE_POLICY", "drop_oldest")
+
+# Chính sách khi hàng đợi đầy:
+#   drop_oldest: bỏ phần tử cũ nhất để nhận phần tử mới
+#   drop_newest: giữ phần tử cũ, từ chối phần tử mới
+#   latest:      phần tử cùng key (MAC) ghi đè phần tử đang chờ; đầy thì bỏ phần tử cũ nhất
+DROP_OLDEST, DROP_NEWEST, LATEST = "drop_oldest", "drop_newest", "latest"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, LATEST)
+# Mức ưu tiên: phần tử HIGH (trạng thái anchor, cảnh báo tiếp cận) được lấy ra trước
+# và chỉ bị bỏ khi hàng đợi toàn phần tử HIGH
+NORMAL, HIGH = 0, 1
+
+QUEUE_CAPACITY = REGISTRY.gauge("gateway_queue_capacity", "Sức chứa của hàng đợi", ["queue"])
+QUEUE_SHED = REGISTRY.counter("gateway_queue_shed_total", "Số phần tử bị bỏ hoặc gộp do hàng đợi đầy",
+                              ["queue", "reason"])
+QUEUE_ALERT = REGISTRY.gauge("gateway_queue_alert", "1 khi hàng đợi vượt ngưỡng cảnh báo", ["queue"])
+
+log = get_logger("gateway.queue")
+
+
+# Hàng đợi có giới hạn giữa các bước capture -> xử lý -> upload: bộ nhớ không tăng khi quá tải,
+# phần tử bị bỏ theo chính sách và được đếm trong gateway_queue_shed_total
+class ShedQueue:
+    def __init__(self, name: str, maxsize: int, policy: str = DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Chính sách hàng đợi không hợp lệ: {policy} (hỗ trợ: {', '.join(POLICIES)})")
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        # Mỗi mức ưu tiên một OrderedDict theo thứ tự vào; slot là (key,) khi gộp theo key, ngược lại là số thứ tự
+        self._levels = (OrderedDict(), OrderedDict())
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self.alerting = False
+        QUEUE_CAPACITY.set(self.maxsize, queue=name)
+        QUEUE_DEPTH.set(0, queue=name)
+
+    def __len__(self) -> int:
+        return len(self._levels[NORMAL]) + len(self._levels[HIGH])
+
+    # Thêm phần tử; trả về False nếu phần tử mới bị từ chối
+    def put(self, item: Any, key: Optional[Hashable] = None, priority: int = NORMAL) -> bool:
+        level = self._levels[priority]
+        if self.policy == LATEST and key is not None:
+            slot = (key,)
+            if slot in level:
+                # Giữ vị trí cũ để tag không bị đẩy xuống cuối mỗi lần có mẫu mới
+                level[slot] = item
+                QUEUE_SHED.inc(queue=self.name, reason="coalesced")
+                return True
+        else:
+            self._seq += 1
+            slot = self._seq
+        if len(self) >= self.maxsize and not self._evict(priority):
+            QUEUE_SHED.inc(queue=self.name, reason="rejected")
+            return False
+        level[slot] = item
+        self._ready.set()
+        self._update()
+        return True
+
+    # Bỏ phần tử cũ nhất ở mức ưu tiên thấp nhất; drop_newest chỉ nhường chỗ cho phần tử ưu tiên cao hơn
+    def _evict(self, priority: int) -> bool:
+        highest = priority if self.policy == DROP_NEWEST else priority + 1
+        for level in self._levels[:highest]:
+            if level:
+                level.popitem(last=False)
+                QUEUE_SHED.inc(queue=self.name, reason="evicted")
+                return True
+        return False
+
+    # Lấy ra tối đa limit phần tử (HIGH trước, mỗi mức theo thứ tự vào)
+    def drain(self, limit: Optional[int] = None) -> List[Any]:
+        items = []
+        for level in reversed(self._levels):
+            while level and (limit is None or len(items) < limit):
+                items.append(level.popitem(last=False)[1])
+        if not self:
+            self._ready.clear()
+        self._update()
+        return items
+
+    # Chờ tới khi có phần tử
+    async def wait(self):
+        await self._ready.wait()
+
+    def _update(self):
+        depth = len(self)
+        QUEUE_DEPTH.set(depth, queue=self.name)
+        if not self.alerting and depth >= self.maxsize * QUEUE_ALERT_RATIO:
+            self.alerting = True
+            QUEUE_ALERT.set(1, queue=self.name)
+            log.warning(f"Hàng đợi {self.name} sắp đầy ({depth}/{self.maxsize})",
+                        extra=fields(stage="queue", queue=self.name, depth=depth, policy=self.policy))
+        elif self.alerting and depth <= self.maxsize * QUEUE_CLEAR_RATIO:
+            self.alerting = False
+            QUEUE_ALERT.set(0, queue=self.name)
+            log.info(f"Hàng đợi {self.name} đã trở lại bình thường ({depth}/{self.maxsize})",
+                     extra=fields(stage="queue", queue=self.name, depth=depth))
@@ -0,0 +1,264 @@
+import math
+import os
+import struct
+from typing import Dict, List, Optional
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Cấu hình qua biến môi trường
+RECENT = os.getenv("RECENT", "1") == "1"
+RECENT_CAPACITY = int(os.getenv("RECENT_CAPACITY", "64"))  # số mẫu gần nhất giữ cho mỗi tag
+RECENT_WINDOW = int(os.getenv("RECENT_WINDOW", "10"))  # số mẫu mặc định để tính tốc độ / hướng / làm mượt
+RECENT_DWELL_RADIUS = float(os.getenv("RECENT_DWELL_RADIUS", "0.5"))  # m, còn trong bán kính này thì coi là đứng tại chỗ
+
+RECENT_TAGS = REGISTRY.gauge("gateway_recent_tags", "Số tag có lịch sử gần đây trong ring buffer")
+
+log = get_logger("gateway.recent")
+
+# Các cột của một mẫu trong mảng dữ liệu
+T, X, Y, Z, Q = range(5)
+FIELDS = ("t", "x", "y", "z", "q")
+_SAMPLE = struct.Struct("<5d")
+
+
+# Lịch sử gần đây của mọi tag trong một mảng numpy cấp phát sẵn (tag x 2*capacity x [t, x, y, z, chất lượng]).
+# Mỗi mẫu được ghi hai lần (ô i và i + capacity), nên N mẫu gần nhất luôn nằm liền nhau: window() trả về view
+# (không copy) và append() là O(1), ghi thẳng vào bộ đệm bằng struct.pack_into, không cấp phát
+class RecentHistory:
+    def __init__(self, capacity: int = RECENT_CAPACITY, window: int = RECENT_WINDOW,
+                 dwell_radius: float = RECENT_DWELL_RADIUS, rows: int = 64):
+        if np is None:
+            raise RuntimeError("Cần cài numpy để dùng RecentHistory")
+        if capacity < 2:
+            raise ValueError("capacity phải >= 2")
+        self.capacity = capacity
+        self.window_size = min(window, capacity)
+        self.dwell_radius = dwell_radius
+        self.rows: Dict[str, int] = {}
+        self.macs: List[str] = []
+        self.head: List[int] = []  # ô ghi tiếp theo của từng tag, trong [0, capacity)
+        self.count: List[int] = []
+        self._row_bytes = 2 * capacity * _SAMPLE.size
+        self._mirror = capacity * _SAMPLE.size
+        self._allocate(rows)
+
+    def _allocate(self, rows: int):
+        old = getattr(self, "data", None)
+        self.data = np.zeros((rows, 2 * self.capacity, len(FIELDS)), dtype=np.float64)
+        if old is not None:
+            self.data[:len(old)] = old
+        self._buffer = memoryview(self.data).cast("B")
+
+    def _row(self, mac: str) -> int:
+        row = self.rows.get(mac)
+        if row is None:
+            row = len(self.macs)
+            if row == len(self.data):
+                # Thêm hàng khi có tag mới: nhân đôi số hàng (hiếm, không nằm trên đường append thường xuyên)
+                self._allocate(2 * len(self.data))
+            self.rows[mac] = row
+            self.macs.append(mac)
+            self.head.append(0)
+            self.count.append(0)
+            RECENT_TAGS.set(len(self.macs))
+        return row
+
+    def append(self, mac: str, ts: float, x: float, y: float, z: float, quality: float):
+        row = self._row(mac)
+        col = self.head[row]
+        offset = row * self._row_bytes + col * _SAMPLE.size
+        _SAMPLE.pack_into(self._buffer, offset, ts, x, y, z, quality)
+        _SAMPLE.pack_into(self._buffer, offset + self._mirror, ts, x, y, z, quality)
+        self.head[row] = col + 1 if col + 1 < self.capacity else 0
+        if self.count[row] < self.capacity:
+            self.count[row] += 1
+
+    def __len__(self) -> int:
+        return len(self.macs)
+
+    # View (không copy) n x 5 của n mẫu gần nhất theo thứ tự thời gian tăng dần; None nếu chưa có mẫu.
+    # View sẽ bị ghi đè bởi các append sau, cần giữ lâu thì copy
+    def window(self, mac: str, n: Optional[int] = None) -> Optional["np.ndarray"]:
+        row = self.rows.get(mac)
+        if row is None or not self.count[row]:
+            return None
+        n = min(n or self.window_size, self.count[row])
+        end = self.head[row] + self.capacity
+        return self.data[row, end - n:end]
+
+    # Tốc độ trung bình (m/s) trên n mẫu gần nhất: tổng quãng đường / thời gian
+    def speed(self, mac: str, n: Optional[int] = None) -> Optional[float]:
+        w = self.window(mac, n)
+        if w is None or len(w) < 2:
+            return None
+        elapsed = w[-1, T] - w[0, T]
+        if elapsed <= 0:
+            return None
+        steps = np.sqrt((np.diff(w[:, X:Z + 1], axis=0) ** 2).sum(axis=1))
+        return float(steps.sum() / elapsed)
+
+    # Hướng di chuyển (độ, 0 = trục X, ngược chiều kim đồng hồ) từ mẫu đầu tới mẫu cuối của cửa sổ
+    def heading(self, mac: str, n: Optional[int] = None) -> Optional[float]:
+        w = self.window(mac, n)
+        if w is None or len(w) < 2:
+            return None
+        dx, dy = w[-1, X] - w[0, X], w[-1, Y] - w[0, Y]
+        if dx == 0 and dy == 0:
+            return None
+        return math.degrees(math.atan2(dy, dx)) % 360.0
+
+    # Thời gian (giây) tag ở trong bán kính dwell_radius quanh vị trí mới nhất, tính trên toàn bộ lịch sử giữ lại
+    # (giới hạn dưới nếu mọi mẫu đều ở trong bán kính)
+    def dwell(self, mac: str, radius: Optional[float] = None) -> Optional[float]:
+        w = self.window(mac, self.capacity)
+        if w is None:
+            return None
+        radius = self.dwell_radius if radius is None else radius
+        outside = np.flatnonzero(((w[:, X:Z + 1] - w[-1, X:Z + 1]) ** 2).sum(axis=1) > radius * radius)
+        first = outside[-1] + 1 if len(outside) else 0
+        return float(w[-1, T] - w[first, T])
+
+    # Vị trí làm mượt: trung bình có trọng số theo chất lượng của n mẫu gần nhất
+    def smoothed(self, mac: str, n: Optional[int] = None) -> Optional[tuple]:
+        w = self.window(mac, n)
+        if w is None:
+            return None
+        weights = w[:, Q] + 1.0
+        x, y, z = weights @ w[:, X:Z + 1] / weights.sum()
+        return float(x), float(y), float(z)
+
+    # Tính cùng lúc cho mọi tag (mảng tags x capacity, vector hóa toàn bộ): tốc độ, hướng và vị trí làm mượt
+    # trên n mẫu gần nhất, dwell trên toàn bộ lịch sử giữ lại. Trả về (danh sách MAC, dict tên -> mảng theo tag);
+    # tốc độ / hướng là NaN khi chưa đủ mẫu
+    def analytics_arrays(self, n: Optional[int] = None):
+        tags = len(self.macs)
+        n = min(n or self.window_size, self.capacity)
+        cap = self.capacity
+        count = np.array(self.count, dtype=np.int64)
+        index = np.arange(tags)
+        # Một lần gom (copy) lịch sử của mọi tag về cùng thứ tự thời gian; cửa sổ n mẫu là view của nó
+        full = self.data[index[:, None], np.array(self.head, dtype=np.int64)[:, None] + np.arange(cap)]
+        present = np.arange(cap) >= (cap - count)[:, None]  # ô đã có mẫu thật
+        position = full[:, :, X:Z + 1]
+        t = full[:, :, T]
+
+        # Dwell: từ mẫu ngay sau mẫu cuối cùng nằm ngoài bán kính quanh vị trí mới nhất
+        outside = present & (((position - position[:, -1:]) ** 2).sum(axis=2) > self.dwell_radius ** 2)
+        last_outside = np.where(outside.any(axis=1), cap - 1 - np.argmax(outside[:, ::-1], axis=1), cap - 1 - count)
+        dwell = t[:, -1] - t[index, last_outside + 1]
+
+        window = position[:, -n:]
+        valid = present[:, -n:]
+        first = n - np.minimum(count, n)
+        steps = np.where(valid[:, :-1], np.sqrt((np.diff(window, axis=1) ** 2).sum(axis=2)), 0.0)
+        elapsed = t[:, -1] - t[index, cap - n + first]
+        displacement = window[:, -1] - window[index, first]
+        weights = np.where(valid, full[:, -n:, Q] + 1.0, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.where(elapsed > 0, steps.sum(axis=1) / elapsed, np.nan)
+            moved = (displacement[:, 0] != 0) | (displacement[:, 1] != 0)
+            heading = np.where(moved, np.degrees(np.arctan2(displacement[:, 1], displacement[:, 0])) % 360.0, np.nan)
+        smoothed = np.einsum("ij,ijk->ik", weights, window) / weights.sum(axis=1)[:, None]
+        return list(self.macs), {"speed": speed, "heading": heading, "dwell": dwell, "smoothed": smoothed,
+                                 "samples": np.minimum(count, n)}
+
+    # Như analytics_arrays nhưng trả về dict theo MAC (dùng cho API / payload)
+    def analytics(self, n: Optional[int] = None) -> Dict[str, Dict]:
+        if not self.macs:
+            return {}
+        macs, values = self.analytics_arrays(n)
+        speed = np.round(values["speed"], 3).tolist()
+        heading = np.round(values["heading"], 1).tolist()
+        dwell = np.round(values["dwell"], 3).tolist()
+        smoothed = np.round(values["smoothed"], 3).tolist()
+        samples = values["samples"].tolist()
+        return {
+            mac: {
+                "speed": None if math.isnan(speed[i]) else speed[i],
+                "heading": None if math.isnan(heading[i]) else heading[i],
+                "dwell": dwell[i],
+                "smoothed": smoothed[i],
+                "samples": samples[i],
+            }
+            for i, mac in enumerate(macs)
+        }
+
+
+# Tạo lịch sử gần đây theo cấu hình (None nếu tắt hoặc thiếu numpy)
+def open_recent() -> Optional[RecentHistory]:
+    if not RECENT:
+        return None
+    if np is None:
+        log.warning("Chưa cài numpy, tắt lịch sử gần đây (RECENT)", extra=fields(stage="recent"))
+        return None
+    return RecentHistory()
+
+
+if __name__ == "__main__":
+    # Mô phỏng: 500 tag, 10 Hz trong 60 giây, so sánh append / analytics với deque + vòng lặp Python
+    import random
+    import time
+    from collections import deque
+
+    random.seed(1)
+    tags = [f"EB:52:53:F5:{i // 256:02X}:{i % 256:02X}" for i in range(500)]
+    history = RecentHistory(capacity=64, window=10)
+    deques = {mac: deque(maxlen=64) for mac in tags}
+    frames = []
+    for step in range(600):
+        ts = step * 0.1
+        for i, mac in enumerate(tags):
+            moving = i % 2 == 0
+            frames.append((mac, ts, (ts * 1.0 if moving else 0.0) + random.gauss(0, 0.02), i + random.gauss(0, 0.02),
+                           1.0, 90))
+
+    started = time.perf_counter()
+    for frame in frames:
+        history.append(*frame)
+    numpy_append = time.perf_counter() - started
+    started = time.perf_counter()
+    for mac, ts, x, y, z, quality in frames:
+        deques[mac].append((ts, x, y, z, quality))
+    deque_append = time.perf_counter() - started
+
+    # Cùng các phép tính bằng vòng lặp Python trên deque (cách của moving-test.py)
+    def python_analytics(samples):
+        window = list(samples)[-10:]
+        path = sum(math.dist(a[1:4], b[1:4]) for a, b in zip(window, window[1:]))
+        speed = path / (window[-1][0] - window[0][0])
+        heading = math.degrees(math.atan2(window[-1][2] - window[0][2], window[-1][1] - window[0][1])) % 360.0
+        last = samples[-1]
+        start = samples[0][0]
+        for sample in reversed(samples):
+            if math.dist(sample[1:4], last[1:4]) > RECENT_DWELL_RADIUS:
+                break
+            start = sample[0]
+        total = sum(s[4] + 1 for s in window)
+        smoothed = tuple(sum(s[k] * (s[4] + 1) for s in window) / total for k in (1, 2, 3))
+        return speed, heading, last[0] - start, smoothed
+
+    started = time.perf_counter()
+    history.analytics_arrays()
+    numpy_arrays = time.perf_counter() - started
+    started = time.perf_counter()
+    result = history.analytics()
+    numpy_analytics = time.perf_counter() - started
+    started = time.perf_counter()
+    for samples in deques.values():
+        python_analytics(samples)
+    python_loop = time.perf_counter() - started
+
+    print(f"append: numpy {numpy_append / len(frames) * 1e6:.2f} us/mẫu, deque {deque_append / len(frames) * 1e6:.2f} us/mẫu")
+    print(f"analytics {len(tags)} tag: numpy {numpy_arrays * 1000:.2f} ms (mảng), {numpy_analytics * 1000:.2f} ms (dict), "
+          f"vòng lặp Python {python_loop * 1000:.2f} ms")
+    print(f"tag di chuyển: {result[tags[0]]}")
+    print(f"tag đứng yên: {result[tags[1]]}")
+    print(f"từng tag: speed {history.speed(tags[0]):.3f}, heading {history.heading(tags[0]):.1f}, "
+          f"dwell {history.dwell(tags[1]):.1f}, smoothed {tuple(round(v, 3) for v in history.smoothed(tags[1]))}")
+    print(f"python:   {python_analytics(deques[tags[0]])[:2]}, dwell {python_analytics(deques[tags[1]])[2]:.1f}")
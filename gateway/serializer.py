@@ -0,0 +1,122 @@
+import gzip
+import json
+import struct
+import time
+from typing import Any, Callable, Dict, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Bộ mã hóa payload: tên, content-type và hàm chuyển object -> bytes
+class Serializer:
+    def __init__(self, name: str, content_type: str, dumps: Callable[[Any], bytes]):
+        self.name = name
+        self.content_type = content_type
+        self.dumps = dumps
+
+    def __repr__(self):
+        return f"Serializer({self.name!r})"
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+SERIALIZERS: Dict[str, Serializer] = {
+    "json": Serializer("json", "application/json", _json_dumps),
+}
+if orjson is not None:
+    SERIALIZERS["orjson"] = Serializer("orjson", "application/json", orjson.dumps)
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = Serializer("msgpack", "application/msgpack", msgpack.packb)
+
+# Thứ tự ưu tiên khi chọn "auto" (theo kết quả benchmark bên dưới).
+# msgpack không nằm trong danh sách vì server phải hỗ trợ định dạng này.
+AUTO_ORDER = ["orjson", "json"]
+
+
+# Lấy serializer theo tên ("auto", "json", "orjson", "msgpack")
+def get_serializer(name: str = "auto") -> Serializer:
+    name = (name or "auto").lower()
+    if name == "auto":
+        for candidate in AUTO_ORDER:
+            if candidate in SERIALIZERS:
+                return SERIALIZERS[candidate]
+    if name not in SERIALIZERS:
+        raise ValueError(f"Serializer '{name}' không khả dụng (đã cài: {', '.join(SERIALIZERS)})")
+    return SERIALIZERS[name]
+
+
+# Nén gzip body; mtime=0 để cùng dữ liệu cho ra cùng bytes
+def gzip_compress(body: bytes, level: int = 6) -> bytes:
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+# Tạo dữ liệu Location Data Mode 2 giống thực tế (vị trí + khoảng cách tới anchor)
+def make_mode_2_frame(x_mm: int, y_mm: int, z_mm: int, quality: int, distances: List[tuple]) -> bytes:
+    frame = struct.pack("<B i i i B", 2, x_mm, y_mm, z_mm, quality)
+    frame += struct.pack("<B", len(distances))
+    for node_id, distance_mm, dist_quality in distances:
+        frame += struct.pack("<H i B", node_id, distance_mm, dist_quality)
+    return frame
+
+
+# Payload mẫu được giải mã bằng location.py, giống payload gửi từ main.py
+def sample_payloads(count: int) -> List[Dict]:
+    from location import decode_location_mode_2
+    from payload import build_payload
+
+    anchors = [0xC60E, 0xC511, 0xD29A, 0xD40F]
+    payloads = []
+    for i in range(count):
+        frame = make_mode_2_frame(
+            1200 + i * 7, 3400 - i * 3, 1100, 64 + i % 36,
+            [(node_id, 2500 + 13 * i + 101 * k, 100) for k, node_id in enumerate(anchors)],
+        )
+        payloads.append(build_payload(
+            f"DW{i:04X}", f"EB:52:53:F5:{i // 256:02X}:{i % 256:02X}", "tag", "5c20",
+            decode_location_mode_2(frame), "active", "2025-03-01 08:00:00",
+        ))
+    return payloads
+
+
+def _bench(fn: Callable[[], Any], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+# Microbenchmark: so sánh các serializer trên payload mode 2 đơn lẻ và theo lô
+def benchmark(batch_size: int = 50, repeat: int = 2000) -> Dict[str, Dict[str, float]]:
+    payloads = sample_payloads(batch_size)
+    single = payloads[0]
+    results = {}
+    for name, serializer in SERIALIZERS.items():
+        batch_body = serializer.dumps(payloads)
+        results[name] = {
+            "single_us": _bench(lambda: serializer.dumps(single), repeat) * 1e6,
+            "batch_us": _bench(lambda: serializer.dumps(payloads), max(1, repeat // 20)) * 1e6,
+            "single_bytes": len(serializer.dumps(single)),
+            "batch_bytes": len(batch_body),
+            "batch_gzip_bytes": len(gzip_compress(batch_body)),
+            "gzip_us": _bench(lambda: gzip_compress(batch_body), max(1, repeat // 20)) * 1e6,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"{'serializer':<10} {'single µs':>10} {'batch µs':>10} {'single B':>9} {'batch B':>9} {'gzip B':>8} {'gzip µs':>9}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['single_us']:>10.2f} {r['batch_us']:>10.1f} {r['single_bytes']:>9} "
+              f"{r['batch_bytes']:>9} {r['batch_gzip_bytes']:>8} {r['gzip_us']:>9.1f}")
+    print(f"Mặc định (auto): {get_serializer('auto').name}")
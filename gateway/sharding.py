@@ -0,0 +1,318 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from global_var import LABEL_CHAR_UUID, LOCATION_DATA_CHAR_UUID, OPERATION_MODE_CHAR_UUID
+from logger import fields, get_logger, setup_logging
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường
+BLE_ADAPTERS = [adapter.strip() for adapter in os.getenv("BLE_ADAPTERS", "hci0").split(",") if adapter.strip()]
+BLE_BACKEND = os.getenv("BLE_BACKEND", "bleak")  # bleak | simulated
+# Bật chế độ nhiều tiến trình khi có nhiều adapter hoặc chạy giả lập
+SHARDING = len(BLE_ADAPTERS) > 1 or BLE_BACKEND == "simulated"
+ADAPTER_CAPACITY = int(os.getenv("ADAPTER_CAPACITY", "7"))  # số kết nối đồng thời tối đa mỗi adapter
+SHARD_SCAN_TIMEOUT = float(os.getenv("SHARD_SCAN_TIMEOUT", "10"))
+SHARD_LOAD_PENALTY = float(os.getenv("SHARD_LOAD_PENALTY", "3"))  # dB trừ cho mỗi module adapter đang giữ
+SHARD_FAILURE_COOLDOWN = float(os.getenv("SHARD_FAILURE_COOLDOWN", "30"))  # giây tránh adapter vừa lỗi với module
+SHARD_FLUSH_INTERVAL = float(os.getenv("SHARD_FLUSH_INTERVAL", "0.05"))  # giây gom frame trước khi gửi về
+SHARD_MONITOR_INTERVAL = float(os.getenv("SHARD_MONITOR_INTERVAL", "2"))
+SHARD_ANCHOR_ATTEMPTS = int(os.getenv("SHARD_ANCHOR_ATTEMPTS", "5"))
+
+SHARD_MODULES = REGISTRY.gauge("gateway_shard_modules", "Số module đang gán cho mỗi adapter", ["adapter"])
+SHARD_WORKERS = REGISTRY.gauge("gateway_shard_workers_alive", "Số tiến trình worker adapter đang chạy")
+SHARD_REASSIGN = REGISTRY.counter("gateway_shard_reassign_total", "Số lần gán lại module sang adapter khác",
+                                  ["reason"])
+SHARD_FRAMES = REGISTRY.counter("gateway_shard_frames_total", "Số frame nhận từ worker", ["adapter"])
+
+log = get_logger("gateway.sharding")
+
+
+def get_backend(name: str):
+    if name == "simulated":
+        from simulated import SimulatedClient, SimulatedScanner
+        return SimulatedClient, SimulatedScanner
+    from bleak import BleakClient, BleakScanner
+    return BleakClient, BleakScanner
+
+
+# ---------------------------------------------------------------------------
+# Worker: một tiến trình cho mỗi adapter, nhận lệnh qua commands, gửi kết quả qua events
+# Lệnh:     ("scan",) ("connect", module) ("drop", mac) ("stop",)
+# Kết quả:  ("scan", adapter, {mac: rssi}) ("info", adapter, mac, name, op_mode)
+#           ("anchor", adapter, mac, name, op_mode, location) ("frames", adapter, [(mac, data), ...])
+#           ("lost", adapter, mac, reason)
+
+def adapter_worker(adapter: str, backend: str, commands, events):
+    setup_logging()
+    try:
+        asyncio.run(_worker_main(adapter, backend, commands, events))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_main(adapter: str, backend: str, commands, events):
+    client_class, scanner_class = get_backend(backend)
+    loop = asyncio.get_running_loop()
+    connect_lock = asyncio.Lock()  # BlueZ chỉ thiết lập một kết nối mỗi lần trên một adapter
+    frames: List = []
+    tasks: Dict[str, asyncio.Task] = {}
+
+    # Gom frame và gửi về coordinator theo lô, giảm số lần pickle/IPC
+    async def flush_frames():
+        while True:
+            await asyncio.sleep(SHARD_FLUSH_INTERVAL)
+            if frames:
+                batch = frames[:]
+                frames.clear()
+                events.put(("frames", adapter, batch))
+
+    flusher = asyncio.create_task(flush_frames())
+    while True:
+        command = await loop.run_in_executor(None, commands.get)
+        kind = command[0]
+        if kind == "scan":
+            try:
+                found = await scanner_class.discover(timeout=SHARD_SCAN_TIMEOUT, return_adv=True,
+                                                     bluez={"adapter": adapter})
+                events.put(("scan", adapter, {address.upper(): adv.rssi for address, (_, adv) in found.items()}))
+            except Exception as e:
+                log.error(f"Lỗi khi quét trên {adapter}: {e}", extra=fields(stage="scan", adapter=adapter))
+                events.put(("scan", adapter, {}))
+        elif kind == "connect":
+            module = command[1]
+            mac = module["id"]
+            if mac not in tasks or tasks[mac].done():
+                tasks[mac] = asyncio.create_task(
+                    _serve_module(client_class, adapter, module, events, frames, connect_lock))
+        elif kind == "drop":
+            task = tasks.pop(command[1], None)
+            if task is not None:
+                task.cancel()
+        elif kind == "stop":
+            break
+    for task in list(tasks.values()) + [flusher]:
+        task.cancel()
+    await asyncio.gather(*tasks.values(), flusher, return_exceptions=True)
+
+
+async def _serve_module(client_class, adapter: str, module: Dict, events, frames: List, connect_lock: asyncio.Lock):
+    mac = module["id"]
+    client = client_class(mac, bluez={"adapter": adapter})
+    try:
+        async with connect_lock:
+            await client.connect()
+            label = await client.read_gatt_char(LABEL_CHAR_UUID)
+            operation_mode = await client.read_gatt_char(OPERATION_MODE_CHAR_UUID)
+            name = label.decode("utf-8", errors="ignore") if label else module["name"]
+            if module["type"] == "anchor":
+                location = await client.read_gatt_char(LOCATION_DATA_CHAR_UUID)
+                events.put(("anchor", adapter, mac, name, bytes(operation_mode), bytes(location)))
+                return
+            await client.start_notify(LOCATION_DATA_CHAR_UUID,
+                                      lambda sender, data: frames.append((mac, bytes(data))))
+        events.put(("info", adapter, mac, name, bytes(operation_mode)))
+        while client.is_connected:
+            await asyncio.sleep(1)
+        events.put(("lost", adapter, mac, "disconnected"))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        events.put(("lost", adapter, mac, str(e)))
+    finally:
+        if client.is_connected:
+            await client.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# Coordinator: chạy trong tiến trình chính, gán module cho adapter theo RSSI và tải,
+# gán lại khi kết nối hỏng hoặc worker chết; frame đi vào pipeline chung qua on_frame
+
+class Coordinator:
+    def __init__(self, adapters: Sequence[str] = BLE_ADAPTERS, backend: str = BLE_BACKEND,
+                 capacity: int = ADAPTER_CAPACITY, on_frame: Optional[Callable] = None,
+                 on_info: Optional[Callable] = None, on_anchor: Optional[Callable] = None,
+                 on_lost: Optional[Callable] = None, on_failed: Optional[Callable] = None):
+        self.adapters = list(adapters)
+        self.backend = backend
+        self.capacity = capacity
+        self.on_frame = on_frame
+        self.on_info = on_info
+        self.on_anchor = on_anchor
+        self.on_lost = on_lost
+        self.on_failed = on_failed
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        self.commands: Dict[str, "multiprocessing.Queue"] = {}
+        self.alive: Set[str] = set()
+        self.rssi: Dict[str, Dict[str, int]] = {}
+        self.modules: Dict[str, Dict] = {}
+        self.assigned: Dict[str, str] = {}  # mac -> adapter
+        self.unassigned: Set[str] = set()
+        self.failures: Dict[str, Dict[str, float]] = {}  # mac -> adapter -> thời điểm lỗi gần nhất
+        self.attempts: Dict[str, int] = {}
+        self._scanned: Optional[asyncio.Event] = None
+        self._pump_thread: Optional[threading.Thread] = None
+
+    def load(self, adapter: str) -> int:
+        return sum(1 for assigned in self.assigned.values() if assigned == adapter)
+
+    def _update_load_metrics(self):
+        for adapter in self.adapters:
+            SHARD_MODULES.set(self.load(adapter), adapter=adapter)
+        SHARD_WORKERS.set(len(self.alive))
+
+    # Chọn adapter tốt nhất: RSSI cao nhất trừ phạt theo tải, bỏ qua adapter đầy, chết hoặc
+    # (trừ khi allow_failed) vừa lỗi với module
+    def choose(self, mac: str, allow_failed: bool = False) -> Optional[str]:
+        now = time.monotonic()
+        failed = self.failures.get(mac, {})
+        best, best_score = None, None
+        for adapter in self.alive:
+            load = self.load(adapter)
+            if load >= self.capacity:
+                continue
+            if not allow_failed and now - failed.get(adapter, -SHARD_FAILURE_COOLDOWN) < SHARD_FAILURE_COOLDOWN:
+                continue
+            score = self.rssi.get(adapter, {}).get(mac.upper(), -127) - SHARD_LOAD_PENALTY * load
+            if best_score is None or score > best_score:
+                best, best_score = adapter, score
+        return best
+
+    def assign(self, mac: str, allow_failed: bool = False) -> Optional[str]:
+        adapter = self.choose(mac, allow_failed)
+        if adapter is None:
+            self.unassigned.add(mac)
+            return None
+        self.unassigned.discard(mac)
+        self.assigned[mac] = adapter
+        self.commands[adapter].put(("connect", self.modules[mac]))
+        log.info(f"Gán {self.modules[mac]['name']} cho {adapter}", extra=fields(mac=mac, adapter=adapter,
+                                                                             stage="shard"))
+        self._update_load_metrics()
+        return adapter
+
+    def start(self):
+        for adapter in self.adapters:
+            commands = self.context.Queue()
+            process = self.context.Process(target=adapter_worker, args=(adapter, self.backend, commands, self.events),
+                                           name=f"gateway-{adapter}", daemon=True)
+            process.start()
+            self.processes[adapter] = process
+            self.commands[adapter] = commands
+            self.alive.add(adapter)
+        loop = asyncio.get_running_loop()
+        self._pump_thread = threading.Thread(target=self._pump, args=(loop,), name="shard-events", daemon=True)
+        self._pump_thread.start()
+        self._update_load_metrics()
+
+    # Thread đọc queue kết quả của các worker và chuyển vào event loop
+    def _pump(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            try:
+                event = self.events.get()
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            loop.call_soon_threadsafe(self._handle, event)
+
+    def _handle(self, event):
+        kind, adapter = event[0], event[1]
+        if kind == "frames":
+            SHARD_FRAMES.inc(len(event[2]), adapter=adapter)
+            if self.on_frame is not None:
+                for mac, data in event[2]:
+                    self.on_frame(mac, data)
+        elif kind == "scan":
+            self.rssi[adapter] = event[2]
+            if self._scanned is not None and all(name in self.rssi for name in self.alive):
+                self._scanned.set()
+        elif kind == "info":
+            _, _, mac, name, operation_mode = event
+            self.attempts.pop(mac, None)
+            if self.on_info is not None:
+                self.on_info(mac, name, operation_mode)
+        elif kind == "anchor":
+            _, _, mac, name, operation_mode, location = event
+            if self.assigned.get(mac) == adapter:
+                del self.assigned[mac]
+            self.attempts.pop(mac, None)
+            self._update_load_metrics()
+            if self.on_anchor is not None:
+                self.on_anchor(mac, name, operation_mode, location)
+        elif kind == "lost":
+            self._lost(event[2], adapter, event[3])
+
+    def _lost(self, mac: str, adapter: str, reason: str):
+        if self.assigned.get(mac) != adapter:
+            return
+        del self.assigned[mac]
+        self.failures.setdefault(mac, {})[adapter] = time.monotonic()
+        module = self.modules[mac]
+        log.warning(f"Mất kết nối {module['name']} trên {adapter}: {reason}",
+                    extra=fields(mac=mac, adapter=adapter, stage="shard"))
+        if self.on_lost is not None:
+            self.on_lost(mac)
+        self.attempts[mac] = self.attempts.get(mac, 0) + 1
+        if module["type"] == "anchor" and self.attempts[mac] >= SHARD_ANCHOR_ATTEMPTS:
+            self._update_load_metrics()
+            if self.on_failed is not None:
+                self.on_failed(mac, module["name"])
+            return
+        SHARD_REASSIGN.inc(reason="connection")
+        self.assign(mac)
+
+    # Quét trên mọi adapter, gán module, rồi theo dõi worker và gán lại khi cần
+    async def run(self, modules: Sequence[Dict]):
+        self.modules = {module["id"]: module for module in modules}
+        self.start()
+        self._scanned = asyncio.Event()
+        for commands in self.commands.values():
+            commands.put(("scan",))
+        try:
+            await asyncio.wait_for(self._scanned.wait(), SHARD_SCAN_TIMEOUT * 2)
+        except asyncio.TimeoutError:
+            log.warning("Không nhận đủ kết quả quét từ các adapter", extra=fields(stage="scan"))
+
+        # Module chỉ một adapter thấy được gán trước, sau đó theo RSSI mạnh nhất
+        def priority(mac: str):
+            seen = [rssi[mac.upper()] for rssi in self.rssi.values() if mac.upper() in rssi]
+            return len(seen) if seen else len(self.adapters) + 1, -max(seen, default=-127)
+
+        for mac in sorted(self.modules, key=priority):
+            self.assign(mac)
+
+        while True:
+            await asyncio.sleep(SHARD_MONITOR_INTERVAL)
+            for adapter, process in self.processes.items():
+                if adapter in self.alive and not process.is_alive():
+                    self.alive.discard(adapter)
+                    log.error(f"Worker {adapter} đã dừng (exit code {process.exitcode})",
+                              extra=fields(adapter=adapter, stage="shard"))
+                    for mac in [mac for mac, owner in self.assigned.items() if owner == adapter]:
+                        del self.assigned[mac]
+                        SHARD_REASSIGN.inc(reason="worker")
+                        self.assign(mac)
+            # Module chưa có chỗ: thử lại, kể cả trên adapter vừa lỗi nếu không còn lựa chọn khác
+            for mac in list(self.unassigned):
+                self.assign(mac, allow_failed=True)
+            self._update_load_metrics()
+
+    def stop(self):
+        for adapter in self.alive:
+            try:
+                self.commands[adapter].put(("stop",))
+            except (ValueError, OSError):
+                pass
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.events.put(None)
+        self.alive.clear()
+        self._update_load_metrics()
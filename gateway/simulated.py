@@ -0,0 +1,155 @@
+import asyncio
+import json
+import math
+import os
+import random
+import struct
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from global_var import (LABEL_CHAR_UUID, LOCATION_DATA_CHAR_UUID, LOCATION_DATA_MODE_UUID, OPERATION_MODE_CHAR_UUID,
+                        UPDATE_RATE_UUID)
+
+# Cấu hình qua biến môi trường
+SIM_MODULES_FILE = os.getenv("SIM_MODULES_FILE", "module.json")  # danh sách module giả lập
+SIM_RATE = float(os.getenv("SIM_RATE", "10"))  # tần số notify của mỗi tag (Hz)
+SIM_DROP_RATE = float(os.getenv("SIM_DROP_RATE", "0"))  # xác suất mất kết nối mỗi giây của mỗi tag
+SIM_CONNECT_DELAY = float(os.getenv("SIM_CONNECT_DELAY", "0.2"))  # giây để "kết nối"
+
+
+# Backend BLE giả lập: cùng giao diện với BleakClient / BleakScanner ở mức gateway dùng,
+# để chạy thử toàn bộ pipeline (sharding, upload, metrics) trên máy không có radio
+
+class SimulatedError(Exception):
+    pass
+
+
+# Giá trị các characteristic cấu hình đã ghi, theo MAC (sống trong tiến trình hiện tại)
+_written: Dict[str, Dict[str, bytes]] = {}
+
+
+def _seed(*parts: str) -> int:
+    return zlib.crc32("|".join(parts).encode())
+
+
+def _modules() -> Dict[str, Dict]:
+    try:
+        with open(SIM_MODULES_FILE, "r") as f:
+            return {module["id"].upper(): module for module in json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Vị trí giả lập: tag đi vòng tròn (tâm, bán kính, pha suy ra từ MAC), anchor đứng yên
+def simulated_position(mac: str, module_type: str, t: float):
+    rng = random.Random(_seed(mac))
+    cx, cy = rng.uniform(2, 28), rng.uniform(2, 18)
+    if module_type == "anchor":
+        return cx, cy, 2.5
+    radius, phase = rng.uniform(1, 5), rng.uniform(0, 2 * math.pi)
+    angle = phase + t / radius  # ~1 m/s
+    return cx + radius * math.cos(angle), cy + radius * math.sin(angle), 1.0
+
+
+def location_frame(x: float, y: float, z: float, quality: int = 90) -> bytes:
+    return struct.pack("<B i i i B", 0, int(x * 1000), int(y * 1000), int(z * 1000), quality)
+
+
+class _Advertisement:
+    def __init__(self, rssi: int, local_name: str):
+        self.rssi = rssi
+        self.local_name = local_name
+
+
+class _Device:
+    def __init__(self, address: str, name: str):
+        self.address = address
+        self.name = name
+
+
+class SimulatedScanner:
+    # RSSI giả lập phụ thuộc cặp (adapter, MAC), ổn định giữa các lần quét
+    @staticmethod
+    async def discover(timeout: float = 5.0, return_adv: bool = False, bluez: Optional[Dict] = None, **kwargs):
+        await asyncio.sleep(min(timeout, 0.5))
+        adapter = (bluez or {}).get("adapter", "hci0")
+        found = {}
+        for mac, module in _modules().items():
+            rssi = -40 - _seed(adapter, mac) % 50
+            found[mac] = (_Device(mac, module["name"]), _Advertisement(rssi, module["name"]))
+        if return_adv:
+            return found
+        return [device for device, _ in found.values()]
+
+
+class SimulatedClient:
+    # Nhận địa chỉ MAC hoặc thiết bị từ discover(), như BleakClient
+    def __init__(self, address, bluez: Optional[Dict] = None, **kwargs):
+        self.address = getattr(address, "address", address).upper()
+        self.module = _modules().get(self.address, {"name": "SIM" + self.address[-5:].replace(":", ""),
+                                                    "type": "tag"})
+        self.is_connected = False
+        self._notify_tasks: List[asyncio.Task] = []
+        self._started = 0.0
+
+    async def connect(self):
+        await asyncio.sleep(SIM_CONNECT_DELAY)
+        if self.address not in _modules():
+            raise SimulatedError(f"Không tìm thấy thiết bị {self.address}")
+        self.is_connected = True
+        self._started = asyncio.get_running_loop().time()
+
+    async def disconnect(self):
+        self.is_connected = False
+        for task in self._notify_tasks:
+            task.cancel()
+        self._notify_tasks.clear()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    def _require_connection(self):
+        if not self.is_connected:
+            raise SimulatedError("Chưa kết nối")
+
+    def _location(self) -> bytes:
+        t = asyncio.get_running_loop().time() - self._started
+        return location_frame(*simulated_position(self.address, self.module["type"], t))
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        self._require_connection()
+        written = _written.get(self.address, {})
+        if uuid in written:
+            return bytearray(written[uuid])
+        if uuid == LABEL_CHAR_UUID:
+            return bytearray(self.module["name"].encode())
+        if uuid == OPERATION_MODE_CHAR_UUID:
+            return bytearray(b"\x80\x00" if self.module["type"] == "anchor" else b"\x00\x00")
+        if uuid == LOCATION_DATA_MODE_UUID:
+            return bytearray(b"\x00")
+        if uuid == UPDATE_RATE_UUID:
+            return bytearray(struct.pack("<II", 100, 1000))
+        if uuid == LOCATION_DATA_CHAR_UUID:
+            return bytearray(self._location())
+        raise SimulatedError(f"Characteristic không hỗ trợ: {uuid}")
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = True):
+        self._require_connection()
+        _written.setdefault(self.address, {})[uuid] = bytes(data)
+
+    async def start_notify(self, uuid: str, callback: Callable[[int, bytearray], None]):
+        self._require_connection()
+        self._notify_tasks.append(asyncio.create_task(self._notify(callback)))
+
+    async def _notify(self, callback: Callable[[int, bytearray], None]):
+        period = 1.0 / SIM_RATE
+        while self.is_connected:
+            await asyncio.sleep(period)
+            if SIM_DROP_RATE and random.random() < SIM_DROP_RATE * period:
+                self.is_connected = False
+                break
+            callback(0, bytearray(self._location()))
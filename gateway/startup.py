@@ -0,0 +1,33 @@
+import time
+from typing import Dict
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+# Mốc 0: lúc main.py bắt đầu nạp (startup là module được import đầu tiên)
+STARTED = time.perf_counter()
+
+STARTUP_SECONDS = REGISTRY.gauge("gateway_startup_seconds", "Số giây từ lúc khởi động tới khi xong từng giai đoạn",
+                                 ["phase"])
+
+log = get_logger("gateway.startup")
+
+_marks: Dict[str, float] = {}
+
+
+# Ghi mốc thời gian của một giai đoạn khởi động (chỉ lần đầu); mốc "first_position" kết thúc khởi động
+# và ghi log bảng thời gian: imports, config, scan, connected, first_position
+def mark(phase: str):
+    if phase in _marks:
+        return
+    elapsed = time.perf_counter() - STARTED
+    _marks[phase] = elapsed
+    STARTUP_SECONDS.set(round(elapsed, 4), phase=phase)
+    if phase == "first_position":
+        report()
+
+
+def report():
+    summary = ", ".join(f"{phase} {elapsed:.2f}s" for phase, elapsed in sorted(_marks.items(), key=lambda item: item[1]))
+    log.info(f"Thời gian khởi động: {summary}",
+             extra=fields(stage="startup", **{phase: round(elapsed, 3) for phase, elapsed in _marks.items()}))
@@ -9,6 +9,7 @@ from typing import Dict, Optional
 from dotenv import load_dotenv
 import os
 from global_var import *
+from opmode import node_type
 load_dotenv()
 sv_url = os.getenv("SV_URL") + ":" + os.getenv("PORT") + "/" + os.getenv("TOPIC")
 # UUID của các characteristic
@@ -41,10 +42,6 @@ def send_to_server(data: Dict) -> int:
         print(f"Error sending to server: {e}")
         return 500
 
-# Giải mã Operation Mode
-def decode_operation_mode(op_mode: bytes) -> str:
-    return 'tag' if (op_mode[0] & 0x80) == 0 else 'anchor'
-
 # Xử lý dữ liệu Location
 def process_location_data(location_data: bytes) -> Dict:
     mode = location_data[0]
@@ -77,7 +74,7 @@ async def connect_and_collect_data(mac: str, module: Dict, semaphore: asyncio.Se
                     label = await client.read_gatt_char(NAME_UUID)
                     label = label.decode('utf-8')
                     op_mode = await client.read_gatt_char(OPERATION_MODE_UUID)
-                    tag_or_anchor = decode_operation_mode(op_mode)
+                    tag_or_anchor = node_type(op_mode)
                     location_data_mode = await client.read_gatt_char(LOCATION_DATA_MODE_UUID)
                     location_data = await client.read_gatt_char(LOCATION_DATA_UUID)
                     location_info = process_location_data(location_data)
@@ -0,0 +1,216 @@
+import asyncio
+import collections
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from breaker import CircuitBreaker
+from logger import fields, get_logger
+from metrics import REGISTRY, UPLOAD_SECONDS, UPLOAD_TOTAL
+from offload import OFFLOAD_ENCODE_MIN, get_executor
+from profiler import timed
+from serializer import get_serializer, gzip_compress
+
+load_dotenv()
+sv_url = os.getenv("SV_URL") + ":" + os.getenv("PORT") + "/" + os.getenv("TOPIC")
+
+# Địa chỉ API endpoint (gửi theo lô dùng BATCH_URL nếu có, mặc định cùng endpoint)
+API_URL = sv_url
+BATCH_URL = os.getenv("BATCH_URL", API_URL)
+
+# Serializer: auto | json | orjson | msgpack
+SERIALIZER = get_serializer(os.getenv("SERIALIZER", "auto"))
+# Nén gzip cho request gửi theo lô khi body lớn hơn GZIP_MIN_BYTES
+UPLOAD_GZIP = os.getenv("UPLOAD_GZIP", "0") == "1"
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "5"))  # giây cho mỗi request
+# Buffer cục bộ giữ payload khi server lỗi / circuit breaker mở; đầy thì bỏ payload cũ nhất
+UPLOAD_BUFFER_SIZE = int(os.getenv("UPLOAD_BUFFER_SIZE", "10000"))
+UPLOAD_FLUSH_BATCH = int(os.getenv("UPLOAD_FLUSH_BATCH", "100"))  # số payload mỗi request khi gửi lại buffer
+UPLOAD_INTERVAL = float(os.getenv("UPLOAD_INTERVAL", "1"))  # giây giữa các lần lấy hàng đợi để gửi
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "32"))  # số request gửi mẫu đồng thời
+
+# Phân loại mã trạng thái: lỗi tạm thời thì giữ lại và gửi sau, lỗi endpoint thì mở breaker lâu,
+# các lỗi 4xx khác là lỗi của chính payload nên bỏ
+RETRYABLE_STATUS = {408, 425, 429}
+ENDPOINT_STATUS = {401, 403, 404, 405}
+
+UPLOAD_BUFFERED = REGISTRY.gauge("gateway_upload_buffered", "Số payload đang chờ trong buffer cục bộ")
+UPLOAD_DROPPED = REGISTRY.counter("gateway_upload_dropped_total", "Số payload bị bỏ", ["reason"])
+UPLOAD_REPLAYED = REGISTRY.counter("gateway_upload_replayed_total", "Số payload gửi lại thành công từ buffer")
+
+BREAKER = CircuitBreaker("upload")
+_buffer: "collections.deque[Dict]" = collections.deque()
+_flush_task: Optional[asyncio.Task] = None
+
+log = get_logger("gateway.upload")
+
+
+# Mã hóa payload thành body + headers, nén gzip nếu được bật
+def encode_body(payload, compress: bool = False):
+    body = SERIALIZER.dumps(payload)
+    headers = {"Content-Type": SERIALIZER.content_type}
+    if compress and len(body) >= GZIP_MIN_BYTES:
+        body = gzip_compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+# Lô lớn được mã hóa / nén trong pool (offload.py) để không chiếm event loop
+async def encode_batch(payloads: List[Dict], compress: bool = False):
+    executor = get_executor()
+    if executor is None or len(payloads) < OFFLOAD_ENCODE_MIN:
+        return encode_body(payloads, compress)
+    return await asyncio.get_running_loop().run_in_executor(executor, encode_body, payloads, compress)
+
+
+# ok | retryable | endpoint | permanent (None: lỗi mạng / timeout)
+def classify(status: Optional[int]) -> str:
+    if status is None:
+        return "retryable"
+    if 200 <= status < 300:
+        return "ok"
+    if status in RETRYABLE_STATUS or status >= 500:
+        return "retryable"
+    if status in ENDPOINT_STATUS:
+        return "endpoint"
+    return "permanent"
+
+
+# Giữ payload trong buffer cục bộ để gửi lại khi server hoạt động trở lại
+def buffer_payloads(payloads: List[Dict]):
+    for payload in payloads:
+        if len(_buffer) >= UPLOAD_BUFFER_SIZE:
+            _buffer.popleft()
+            UPLOAD_DROPPED.inc(reason="buffer_full")
+        _buffer.append(payload)
+    UPLOAD_BUFFERED.set(len(_buffer))
+
+
+async def _post(url: str, body: bytes, headers: Dict, kind: str) -> Tuple[Optional[int], float]:
+    started = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=UPLOAD_TIMEOUT)) as session:
+            async with session.post(url, data=body, headers=headers) as response:
+                elapsed = time.perf_counter() - started
+                UPLOAD_SECONDS.observe(elapsed, kind=kind)
+                UPLOAD_TOTAL.inc(kind=kind, status=response.status)
+                return response.status, elapsed
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        UPLOAD_TOTAL.inc(kind=kind, status="error")
+        log.error(f"Lỗi khi gửi dữ liệu tới API: {e!r}", extra=fields(stage="upload", kind=kind))
+        return None, time.perf_counter() - started
+
+
+# Cập nhật breaker theo kết quả của request mang ticket; payload lỗi tạm thời được đưa vào buffer
+def _settle(outcome: str, payloads: List[Dict], info: Dict, ticket: int):
+    if outcome == "ok":
+        BREAKER.success(ticket)
+        if _buffer:
+            _schedule_flush()
+    elif outcome == "permanent":
+        UPLOAD_DROPPED.inc(len(payloads), reason="permanent")
+        BREAKER.success(ticket)  # server vẫn trả lời, chỉ payload bị từ chối
+    else:
+        if outcome == "endpoint":
+            log.error("Endpoint không tồn tại. Vui lòng kiểm tra cấu hình server.", extra=info)
+        BREAKER.failure(ticket, endpoint=outcome == "endpoint")
+        buffer_payloads(payloads)
+
+
+def _schedule_flush():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_buffer())
+
+
+# Số payload đang chờ trong buffer cục bộ
+def buffered() -> int:
+    return len(_buffer)
+
+
+# Gửi lại buffer ngay, dùng khi không còn request mới nào kích hoạt việc gửi lại (ví dụ cuối loadgen.py)
+async def flush_buffer():
+    await _flush_buffer()
+
+
+# Gửi lại buffer theo lô khi breaker cho phép; dừng ở lỗi đầu tiên và giữ nguyên thứ tự
+async def _flush_buffer():
+    while _buffer:
+        ticket = BREAKER.acquire()
+        if ticket is None:
+            break
+        chunk = [_buffer.popleft() for _ in range(min(UPLOAD_FLUSH_BATCH, len(_buffer)))]
+        UPLOAD_BUFFERED.set(len(_buffer))
+        done = False
+        try:
+            body, headers = await encode_batch(chunk, compress=UPLOAD_GZIP)
+            status, _ = await _post(BATCH_URL, body, headers, "replay")
+            outcome = classify(status)
+            if outcome == "ok":
+                BREAKER.success(ticket)
+                UPLOAD_REPLAYED.inc(len(chunk))
+                done = True
+            elif outcome == "permanent":
+                BREAKER.success(ticket)
+                UPLOAD_DROPPED.inc(len(chunk), reason="permanent")
+                done = True
+            else:
+                BREAKER.failure(ticket, endpoint=outcome == "endpoint")
+        finally:
+            BREAKER.release(ticket)
+            if not done:
+                # Lỗi hoặc bị hủy giữa chừng: trả lô về đầu buffer
+                _buffer.extendleft(reversed(chunk))
+                UPLOAD_BUFFERED.set(len(_buffer))
+        if not done:
+            break
+
+
+# Gửi dữ liệu lên server qua API với kiểm tra lỗi chi tiết; khi breaker mở thì đưa vào buffer cục bộ
+@timed("send_to_api")
+async def send_to_api(payload: Dict):
+    ticket = BREAKER.acquire()
+    if ticket is None:
+        buffer_payloads([payload])
+        return
+    try:
+        body, headers = encode_body(payload)
+        status, elapsed = await _post(API_URL, body, headers, "single")
+        info = fields(mac=payload["id"], stage="upload", status=status, latency_ms=round(elapsed * 1000, 1))
+        outcome = classify(status)
+        if outcome == "ok":
+            log.debug(f"Gửi dữ liệu thành công cho {payload['name']}", extra=info)
+        elif status is not None:
+            log.warning(f"Gửi dữ liệu thất bại cho {payload['name']}", extra=info)
+        _settle(outcome, [payload], info, ticket)
+    finally:
+        BREAKER.release(ticket)
+
+
+# Gửi nhiều payload trong một request (body là mảng), có thể nén gzip
+@timed("send_batch_to_api")
+async def send_batch_to_api(payloads: List[Dict]):
+    if not payloads:
+        return
+    ticket = BREAKER.acquire()
+    if ticket is None:
+        buffer_payloads(payloads)
+        return
+    try:
+        body, headers = await encode_batch(payloads, compress=UPLOAD_GZIP)
+        status, elapsed = await _post(BATCH_URL, body, headers, "batch")
+        info = fields(stage="upload", batch=len(payloads), bytes=len(body), status=status,
+                      latency_ms=round(elapsed * 1000, 1))
+        outcome = classify(status)
+        if outcome == "ok":
+            log.debug("Gửi thành công lô payload", extra=info)
+        elif status is not None:
+            log.warning("Gửi lô payload thất bại", extra=info)
+        _settle(outcome, payloads, info, ticket)
+    finally:
+        BREAKER.release(ticket)
@@ -0,0 +1,178 @@
+import json
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from logger import fields, get_logger
+from metrics import REGISTRY
+
+# Cấu hình qua biến môi trường
+ZONES_FILE = os.getenv("ZONES_FILE", "zones.json")
+ZONE_GRID_CELL = float(os.getenv("ZONE_GRID_CELL", "2.0"))  # kích thước ô lưới (m)
+ZONE_HYSTERESIS = float(os.getenv("ZONE_HYSTERESIS", "0.2"))  # phải vào sâu/ra xa biên bao nhiêu m
+ZONE_CONFIRM_SAMPLES = int(os.getenv("ZONE_CONFIRM_SAMPLES", "2"))  # số mẫu liên tiếp để xác nhận
+ZONE_DEFAULT_DWELL = float(os.getenv("ZONE_DEFAULT_DWELL", "60"))  # giây ở trong zone để phát sự kiện dwell
+# Chỉ gửi sự kiện zone lên server, không gửi vị trí thô
+ZONE_EVENTS_ONLY = os.getenv("ZONE_EVENTS_ONLY", "0") == "1"
+
+ZONE_EVENTS = REGISTRY.counter("gateway_zone_events_total", "Số sự kiện zone", ["event"])
+
+log = get_logger("gateway.zones")
+
+
+# Một zone đa giác (box được chuyển thành đa giác 4 đỉnh), tùy chọn giới hạn Z
+class Zone:
+    def __init__(self, name: str, points: Sequence[Tuple[float, float]], z_range: Optional[Tuple[float, float]] = None,
+                 dwell: float = ZONE_DEFAULT_DWELL):
+        if len(points) < 3:
+            raise ValueError(f"Zone {name} cần ít nhất 3 đỉnh")
+        self.name = name
+        self.points = [(float(x), float(y)) for x, y in points]
+        self.z_range = z_range
+        self.dwell = dwell
+        xs = [x for x, _ in self.points]
+        ys = [y for _, y in self.points]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+        self.edges = list(zip(self.points, self.points[1:] + self.points[:1]))
+
+    # Điểm nằm trong đa giác (ray casting)
+    def contains(self, x: float, y: float, z: Optional[float] = None) -> bool:
+        if self.z_range is not None and z is not None and not (self.z_range[0] <= z <= self.z_range[1]):
+            return False
+        min_x, min_y, max_x, max_y = self.bbox
+        if x < min_x or x > max_x or y < min_y or y > max_y:
+            return False
+        inside = False
+        for (x1, y1), (x2, y2) in self.edges:
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    # Khoảng cách ngắn nhất từ điểm tới biên đa giác
+    def boundary_distance(self, x: float, y: float) -> float:
+        best = math.inf
+        for (x1, y1), (x2, y2) in self.edges:
+            dx, dy = x2 - x1, y2 - y1
+            length = dx * dx + dy * dy
+            t = 0.0 if length == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length))
+            distance = math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+            if distance < best:
+                best = distance
+        return best
+
+
+# Tạo Zone từ một mục trong zones.json
+def zone_from_config(entry: Dict) -> Zone:
+    if entry.get("type", "polygon") == "box":
+        (x1, y1), (x2, y2) = entry["min"], entry["max"]
+        points = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+    else:
+        points = entry["points"]
+    z_range = tuple(entry["z"]) if "z" in entry else None
+    return Zone(entry["name"], points, z_range, float(entry.get("dwell", ZONE_DEFAULT_DWELL)))
+
+
+# Đọc danh sách zone từ file cấu hình
+def load_zones(path: str = ZONES_FILE) -> List[Zone]:
+    try:
+        with open(path, "r") as f:
+            return [zone_from_config(entry) for entry in json.load(f)]
+    except FileNotFoundError:
+        return []
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        log.error(f"Lỗi khi đọc file zone {path}: {e}", extra=fields(stage="zones"))
+        return []
+
+
+# Chỉ mục lưới đều: mỗi ô chứa các zone có bbox (nới thêm margin) chạm vào ô đó
+class GridIndex:
+    def __init__(self, zones: Sequence[Zone], cell: float = ZONE_GRID_CELL, margin: float = ZONE_HYSTERESIS):
+        self.cell = cell
+        self.cells: Dict[Tuple[int, int], List[Zone]] = {}
+        for zone in zones:
+            min_x, min_y, max_x, max_y = zone.bbox
+            for cx in range(math.floor((min_x - margin) / cell), math.floor((max_x + margin) / cell) + 1):
+                for cy in range(math.floor((min_y - margin) / cell), math.floor((max_y + margin) / cell) + 1):
+                    self.cells.setdefault((cx, cy), []).append(zone)
+
+    def candidates(self, x: float, y: float) -> List[Zone]:
+        return self.cells.get((math.floor(x / self.cell), math.floor(y / self.cell)), [])
+
+
+# Trạng thái của một tag đối với một zone
+class _Membership:
+    __slots__ = ("inside", "pending", "entered_at", "dwell_sent")
+
+    def __init__(self):
+        self.inside = False
+        self.pending = 0
+        self.entered_at = 0.0
+        self.dwell_sent = False
+
+
+# Bộ máy sự kiện zone: enter/exit/dwell cho từng tag, có hysteresis chống nhiễu
+class ZoneEngine:
+    def __init__(self, zones: Sequence[Zone], cell: float = ZONE_GRID_CELL, margin: float = ZONE_HYSTERESIS,
+                 confirm: int = ZONE_CONFIRM_SAMPLES):
+        self.zones = list(zones)
+        self.margin = margin
+        self.confirm = max(1, confirm)
+        self.index = GridIndex(self.zones, cell, margin)
+        # mac -> zone -> trạng thái; chỉ giữ zone tag đang ở trong hoặc đang chờ xác nhận vào/ra
+        self.members: Dict[str, Dict[str, _Membership]] = {}
+        self._zone_by_name = {zone.name: zone for zone in self.zones}
+
+    # Các zone tag đang ở trong (đã xác nhận)
+    def zones_of(self, mac: str) -> List[str]:
+        return [name for name, state in self.members.get(mac, {}).items() if state.inside]
+
+    def _event(self, event: str, mac: str, zone: Zone, ts: float, **extra) -> Dict:
+        ZONE_EVENTS.inc(event=event)
+        result = {"event": event, "zone": zone.name, "id": mac, "ts": ts}
+        result.update(extra)
+        return result
+
+    # Xử lý một vị trí mới, trả về danh sách sự kiện phát sinh. Chỉ xét các zone của ô lưới hiện tại cùng các zone
+    # tag đang ở / đang chờ xác nhận, nên chi phí mỗi mẫu không tăng theo số zone tag từng đi qua
+    def update(self, mac: str, x: float, y: float, z: Optional[float], ts: float) -> List[Dict]:
+        states = self.members.setdefault(mac, {})
+        candidates = {zone.name: zone for zone in self.index.candidates(x, y)}
+        for name in states:
+            candidates.setdefault(name, self._zone_by_name[name])
+
+        events = []
+        for name, zone in candidates.items():
+            state = states.get(name)
+            if state is None:
+                state = states[name] = _Membership()
+            inside = zone.contains(x, y, z)
+            if inside != state.inside and zone.boundary_distance(x, y) >= self.margin:
+                state.pending += 1
+                if state.pending >= self.confirm:
+                    state.inside = inside
+                    state.pending = 0
+                    if inside:
+                        state.entered_at = ts
+                        state.dwell_sent = False
+                        events.append(self._event("enter", mac, zone, ts))
+                    else:
+                        events.append(self._event("exit", mac, zone, ts, dwell=round(ts - state.entered_at, 3)))
+            else:
+                state.pending = 0
+            if state.inside and not state.dwell_sent and ts - state.entered_at >= zone.dwell:
+                state.dwell_sent = True
+                events.append(self._event("dwell", mac, zone, ts, dwell=round(ts - state.entered_at, 3)))
+            elif not state.inside and not state.pending:
+                del states[name]
+        if not states:
+            del self.members[mac]
+        return events
+
+
+# Tạo ZoneEngine từ file cấu hình (None nếu không có zone nào)
+def open_zone_engine(path: str = ZONES_FILE) -> Optional[ZoneEngine]:
+    zones = load_zones(path)
+    if not zones:
+        return None
+    log.info(f"Đã nạp {len(zones)} zone", extra=fields(stage="zones", file=path))
+    return ZoneEngine(zones)